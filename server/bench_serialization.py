@@ -0,0 +1,105 @@
+"""
+Benchmark de serialización de /api/filter-patients: modelos Pydantic frente a FAST_JSON
+
+Mide el tiempo de CPU por petición con páginas sintéticas (sin base de datos)
+y comprueba que las dos rutas devuelven exactamente el mismo JSON, también
+con filas que hay que convertir (números como texto o ausentes).
+
+Uso: python bench_serialization.py [filas_por_página] [peticiones]
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def synthetic_rows(rows_per_page: int):
+    """Filas con los tipos que devuelve la base de datos"""
+    return [
+        (i, f"PACIENTE_{i:06d}", "Andalucía", 1950 + i % 50, "Mujer" if i % 2 else "Hombre",
+         "Trastornos del estado de ánimo", f"CENTRO_{i % 40}", "12/03/2021", "3/25/21", i % 30)
+        for i in range(rows_per_page)
+    ]
+
+
+def synthetic_page(rows):
+    """get_filtered_page que devuelve siempre estas filas"""
+    rows_per_page = len(rows)
+
+    def get_filtered_page(filters, page=1, rows_per_page=rows_per_page, cursor=None, exact_count=True):
+        return {
+            "rows": rows,
+            "total_records": 123456,
+            "current_page": page,
+            "total_pages": 1235,
+            "rows_per_page": rows_per_page,
+            "has_more": True,
+            "total_is_exact": True,
+            "next_cursor": "WyJQQUNJRU5URV8wMDAwOTkiLCA5OSwgIm5leHQiXQ",
+            "prev_cursor": None,
+        }
+
+    return get_filtered_page
+
+
+def measure(client: TestClient, fast: bool, body: dict, requests: int) -> float:
+    """Tiempo de CPU medio por petición, en milisegundos"""
+    main.FAST_JSON = fast
+    for _ in range(20):  # calentamiento
+        client.post("/api/filter-patients", json=body)
+    start = time.process_time()
+    for _ in range(requests):
+        client.post("/api/filter-patients", json=body)
+    return (time.process_time() - start) * 1000 / requests
+
+
+def responses(client: TestClient, rows) -> list:
+    """Respuesta (estado, JSON) de las dos rutas para la misma página"""
+    main.get_filter_service().get_filtered_page = synthetic_page(rows)
+    body = {"rows_per_page": len(rows)}
+    results = []
+    for fast in (False, True):
+        main.FAST_JSON = fast
+        response = client.post("/api/filter-patients", json=body)
+        results.append((response.status_code, response.json() if response.status_code == 200 else None))
+    return results
+
+
+def check_parity(client: TestClient, rows_per_page: int) -> None:
+    """Mismo JSON con filas tipadas y con filas que se convierten"""
+    rows = synthetic_rows(rows_per_page)
+    converted = list(rows)
+    converted[0] = rows[0][:3] + (1980.0,) + rows[0][4:9] + ("7",)  # Año como float, estancia como texto
+    converted[1] = rows[1][:9] + (None,)  # Estancia desconocida: 0
+    for case in (rows, converted):
+        pydantic_result, fast_result = responses(client, case)
+        assert pydantic_result[0] == fast_result[0] == 200, (pydantic_result[0], fast_result[0])
+        assert pydantic_result == fast_result, "Las dos rutas no devuelven lo mismo"
+
+
+def run_benchmark(rows_per_page: int = 100, requests: int = 500):
+    client = TestClient(main.app)
+    check_parity(client, rows_per_page)
+    main.get_filter_service().get_filtered_page = synthetic_page(synthetic_rows(rows_per_page))
+    body = {"rows_per_page": rows_per_page}
+
+    pydantic_ms = measure(client, False, body, requests)
+    fast_ms = measure(client, True, body, requests)
+
+    print(f"📊 {rows_per_page} filas por página, {requests} peticiones")
+    print(f"   Pydantic:  {pydantic_ms:.3f} ms CPU/petición")
+    print(f"   FAST_JSON: {fast_ms:.3f} ms CPU/petición")
+    print(f"   Ahorro:    {pydantic_ms - fast_ms:.3f} ms ({(1 - fast_ms / pydantic_ms) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    run_benchmark(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+    )
@@ -0,0 +1,119 @@
+"""
+Motor de datos activo (Oracle o SQLite local), diferencias de dialecto SQL
+y forma de las listas de binds
+
+El resto del SQL de los servicios (CASE, COUNT(*) OVER (), COALESCE,
+comparaciones de claves, WITH) es común a los dos motores.
+"""
+import os
+from typing import Any, Dict, Sequence
+
+ORACLE = "oracle"
+SQLITE = "sqlite"
+BACKENDS = (ORACLE, SQLITE)
+
+
+def get_backend_name() -> str:
+    """Motor configurado en DB_BACKEND (por defecto Oracle)"""
+    backend = os.getenv("DB_BACKEND", ORACLE).strip().lower()
+    if backend not in BACKENDS:
+        raise RuntimeError(f"DB_BACKEND no válido: {backend} (opciones: {', '.join(BACKENDS)})")
+    return backend
+
+
+def fetch_first_sql(rows_bind: str) -> str:
+    """Limita el resultado a :rows_bind filas"""
+    if get_backend_name() == SQLITE:
+        return f"LIMIT :{rows_bind}"
+    return f"FETCH FIRST :{rows_bind} ROWS ONLY"
+
+
+def offset_fetch_sql(offset_bind: str, rows_bind: str) -> str:
+    """Salta :offset_bind filas y devuelve las :rows_bind siguientes"""
+    if get_backend_name() == SQLITE:
+        return f"LIMIT :{rows_bind} OFFSET :{offset_bind}"
+    return f"OFFSET :{offset_bind} ROWS FETCH NEXT :{rows_bind} ROWS ONLY"
+
+
+def null_safe_equals_sql(left: str, right: str) -> str:
+    """Igualdad en la que NULL es igual a NULL"""
+    if get_backend_name() == SQLITE:
+        return f"{left} IS {right}"
+    return f"DECODE({left}, {right}, 1, 0) = 1"
+
+
+def grouping_sets_sql(source: str, columns: Sequence[str], sets: Sequence[Sequence[str]], aggregate: str) -> str:
+    """
+    Agrega una subconsulta por varios conjuntos de columnas en una sola sentencia
+
+    Cada fila del resultado es (GRAIN, columnas..., agregado): GRAIN es la
+    posición del conjunto en sets y las columnas que no son del conjunto
+    vienen a NULL. En Oracle es un GROUPING SETS, que lee la subconsulta una
+    vez; SQLite no lo admite y se emula con un GROUP BY por conjunto unidos
+    con UNION ALL.
+
+    Args:
+        source: Subconsulta con las columnas y lo que use el agregado
+        columns: Todas las columnas de agrupación, en el orden del resultado
+        sets: Conjuntos de agrupación (subconjuntos de columns, distintos)
+        aggregate: Expresión agregada, p. ej. "COUNT(DISTINCT PACIENTE_KEY)"
+    """
+    if get_backend_name() == SQLITE:
+        selects = []
+        for grain, grouped in enumerate(sets):
+            projected = ", ".join(column if column in grouped else f"NULL AS {column}" for column in columns)
+            selects.append(f"SELECT {grain} AS GRAIN, {projected}, {aggregate} FROM SRC GROUP BY {', '.join(grouped)}")
+        return f"WITH SRC AS ({source})\n" + "\nUNION ALL\n".join(selects)
+
+    # GROUPING_ID tiene un bit por columna, a 1 si no es del conjunto
+    arms = " ".join(
+        f"WHEN {sum(1 << (len(columns) - 1 - i) for i, column in enumerate(columns) if column not in grouped)} "
+        f"THEN {grain}"
+        for grain, grouped in enumerate(sets)
+    )
+    grouping_sets = ", ".join(f"({', '.join(grouped)})" for grouped in sets)
+    return (f"WITH SRC AS ({source})\n"
+            f"SELECT CASE GROUPING_ID({', '.join(columns)}) {arms} END AS GRAIN, {', '.join(columns)}, {aggregate}\n"
+            f"FROM SRC GROUP BY GROUPING SETS ({grouping_sets})")
+
+
+def statement_cache_size() -> int:
+    """
+    Sentencias preparadas que guarda cada conexión (DB_STMT_CACHE_SIZE)
+
+    Por defecto, los valores de cada driver: 20 en oracledb y 128 en sqlite3.
+    """
+    value = os.getenv("DB_STMT_CACHE_SIZE")
+    if value not in (None, ""):
+        return int(value)
+    return 128 if get_backend_name() == SQLITE else 20
+
+
+def padded_arity(count: int) -> int:
+    """Menor potencia de dos mayor o igual que count"""
+    return 1 << max(count - 1, 0).bit_length()
+
+
+def in_list_binds(name: str, values: Sequence[Any], params: Dict[str, Any], template: str = "{}") -> str:
+    """
+    Placeholders de una lista IN (...) con la aridad rellenada a potencia de dos
+
+    Cada longitud de lista distinta sería un texto SQL distinto (análisis
+    completo en Oracle y fallo en la caché de sentencias del cliente). Al
+    repetir el último valor hasta la siguiente potencia de dos, que no cambia
+    el resultado del IN, listas de 1 a N elementos comparten log2(N) textos.
+
+    Args:
+        name: Prefijo de los binds (:name_0, :name_1...)
+        values: Valores de la lista (al menos uno)
+        params: Diccionario de binds, que se completa aquí
+        template: Expresión de cada placeholder, p. ej. "UPPER({})"
+
+    Returns:
+        Placeholders separados por comas
+    """
+    placeholders = []
+    for i in range(padded_arity(len(values))):
+        params[f"{name}_{i}"] = values[min(i, len(values) - 1)]
+        placeholders.append(template.format(f":{name}_{i}"))
+    return ",".join(placeholders)
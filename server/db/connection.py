@@ -1,21 +1,159 @@
-import oracledb
+"""
+Pool de conexiones Oracle compartido por todo el proceso
+
+Con DB_BACKEND=sqlite las conexiones se abren sobre la base local de
+db.sqlite_backend en lugar del pool. oracledb se importa al crear el pool,
+no al importar el módulo, para no pagarlo en el arranque en frío.
+"""
 import os
+import threading
+import time
+from typing import Any, Dict
+
 from dotenv import load_dotenv
 
+from db.backend import SQLITE, get_backend_name, statement_cache_size
+from db.instrumentation import InstrumentedConnection, calling_service
+from metrics import observe_db_phase
+
+# Solo cargar .env si estamos en desarrollo (no en Vercel)
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-load_dotenv()
-
-wallet_path = os.getenv("WALLET_PATH")
-wallet_password = os.getenv("WALLET_PASSWORD")
-user = os.getenv("DB_USER")
-user_password = os.getenv("DB_PASSWORD")
-dsn = os.getenv("DB_TNS_ALIAS")
-
-connection = oracledb.connect(
-    user=user,
-    password=user_password,
-    dsn=dsn,
-    config_dir=wallet_path,
-    wallet_location=wallet_path,
-    wallet_password=wallet_password
-)
+if os.environ.get("VERCEL") != "1" and os.path.exists(dotenv_path):
+    load_dotenv(dotenv_path)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_db_config() -> Dict[str, Any]:
+    """
+    Lee las credenciales de la base de datos desde las variables de entorno
+
+    Returns:
+        Diccionario con los parámetros de conexión de oracledb
+    """
+    wallet_path = os.getenv("WALLET_PATH")
+    # Si wallet_path contiene ${PWD}, reemplazarlo con el directorio del servidor
+    if wallet_path and "${PWD}" in wallet_path:
+        current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        wallet_path = wallet_path.replace("${PWD}", current_dir)
+
+    config = {
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "dsn": os.getenv("DB_TNS_ALIAS"),
+        "config_dir": wallet_path,
+        "wallet_location": wallet_path,
+        "wallet_password": os.getenv("WALLET_PASSWORD"),
+    }
+
+    # Validar que todas las variables críticas están presentes
+    missing = [k for k, v in {
+        'WALLET_PATH': wallet_path,
+        'WALLET_PASSWORD': config["wallet_password"],
+        'DB_USER': config["user"],
+        'DB_PASSWORD': config["password"],
+        'DB_TNS_ALIAS': config["dsn"]
+    }.items() if not v]
+    if missing:
+        raise RuntimeError(f"Faltan variables de entorno requeridas: {', '.join(missing)}")
+
+    return config
+
+
+def get_pool_config() -> Dict[str, Any]:
+    """
+    Configuración del pool a partir de las variables de entorno
+
+    DB_POOL_MIN, DB_POOL_MAX y DB_POOL_INCREMENT controlan el tamaño del pool.
+    Con DB_POOL_PING activo, las conexiones que llevan más de
+    DB_POOL_PING_INTERVAL segundos inactivas se comprueban al adquirirlas
+    (0 = comprobar siempre).
+    """
+    ping_interval = _env_int("DB_POOL_PING_INTERVAL", 60) if _env_bool("DB_POOL_PING", True) else -1
+    return {
+        "min": _env_int("DB_POOL_MIN", 1),
+        "max": _env_int("DB_POOL_MAX", 4),
+        "increment": _env_int("DB_POOL_INCREMENT", 1),
+        "ping_interval": ping_interval,
+        "timeout": _env_int("DB_POOL_IDLE_TIMEOUT", 300),
+        "wait_timeout": _env_int("DB_POOL_WAIT_TIMEOUT", 10000),
+        "stmtcachesize": statement_cache_size(),
+    }
+
+
+def get_pool() -> "oracledb.ConnectionPool":
+    """Devuelve el pool del proceso, creándolo en el primer uso"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                import oracledb
+
+                pool_config = get_pool_config()
+                _pool = oracledb.create_pool(**get_db_config(), **pool_config,
+                                             getmode=oracledb.POOL_GETMODE_TIMEDWAIT)
+                print(f"🔌 Pool Oracle creado (min={pool_config['min']}, "
+                      f"max={pool_config['max']}, increment={pool_config['increment']})")
+    return _pool
+
+
+def get_connection():
+    """
+    Adquiere una conexión del pool
+
+    La conexión vuelve al pool al cerrarla o al salir de un bloque ``with``.
+    Sus consultas se cronometran (db.instrumentation), y también la espera
+    por una conexión libre (fase acquire de las métricas).
+    """
+    start = time.perf_counter()
+    if get_backend_name() == SQLITE:
+        from db.sqlite_backend import connect
+        connection = connect()
+    else:
+        connection = get_pool().acquire()
+    observe_db_phase(calling_service(), "acquire", time.perf_counter() - start)
+    return InstrumentedConnection(connection)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Estadísticas del pool para monitorización"""
+    if get_backend_name() == SQLITE:
+        from db.sqlite_backend import get_sqlite_path
+        return {"initialized": False, "backend": SQLITE, "path": get_sqlite_path()}
+    if _pool is None:
+        return {"initialized": False, **get_pool_config()}
+
+    return {
+        "initialized": True,
+        "min": _pool.min,
+        "max": _pool.max,
+        "increment": _pool.increment,
+        "opened": _pool.opened,
+        "busy": _pool.busy,
+        "idle": _pool.opened - _pool.busy,
+        "ping_interval": _pool.ping_interval,
+        "timeout": _pool.timeout,
+        "wait_timeout": _pool.wait_timeout,
+    }
+
+
+def close_pool() -> None:
+    """Cierra el pool (al apagar el servidor)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close(force=True)
+            _pool = None
@@ -0,0 +1,67 @@
+"""
+Ejecución de las llamadas bloqueantes a Oracle fuera del event loop
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from db.connection import get_pool_config
+from metrics import DB_EXECUTOR_SECONDS
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Devuelve el executor acotado para acceso a datos
+
+    Por defecto tiene tantos hilos como conexiones máximas del pool
+    (DB_EXECUTOR_WORKERS lo sobrescribe), de modo que ningún hilo se queda
+    bloqueado esperando una conexión libre.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(os.getenv("DB_EXECUTOR_WORKERS") or get_pool_config()["max"])
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+    return _executor
+
+
+async def run_db(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Ejecuta una función síncrona de acceso a datos en el executor de BD
+
+    Args:
+        func: Método del servicio a ejecutar
+        *args, **kwargs: Argumentos del método
+
+    Returns:
+        El resultado de la función
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+
+    def timed_call():
+        # Espera en cola (hilos ocupados) frente a tiempo de ejecución
+        started = time.perf_counter()
+        DB_EXECUTOR_SECONDS.observe(started - submitted, phase="queue")
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_EXECUTOR_SECONDS.observe(time.perf_counter() - started, phase="run")
+
+    return await loop.run_in_executor(get_executor(), timed_call)
+
+
+def shutdown_executor() -> None:
+    """Detiene el executor (al apagar el servidor)"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
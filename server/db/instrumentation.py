@@ -0,0 +1,361 @@
+"""
+Medición de las llamadas a la base de datos y registro de consultas lentas
+
+Todas las conexiones de db.connection se envuelven en InstrumentedConnection:
+cada ejecución de un cursor se cronometra (ejecución y lectura de filas por
+separado) y, si supera SLOW_QUERY_MS, se registra con su SQL normalizado, la
+forma de sus binds (nunca sus valores), el número de filas y, con
+SLOW_QUERY_EXPLAIN activo, el plan de ejecución. Todas las ejecuciones se
+acumulan además en los histogramas por fase de metrics, junto con
+una estimación de aciertos en la caché de sentencias.
+"""
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from db.backend import SQLITE, get_backend_name, statement_cache_size
+from metrics import DB_ROWS, DB_STATEMENT_CACHE, observe_db_phase
+
+_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SERVICES_DIR = os.path.join(_SERVER_DIR, "services")
+
+_WHITESPACE = re.compile(r"\s+")
+_BIND_LIST = re.compile(r"(:\w+?)_\d+(?:\s*,\s*\1_\d+)*")
+_REPEATED_BIND = re.compile(r"((?:\w+\()?:\w+_\*\)?)(?:\s*,\s*\1)+")
+
+
+def normalize_sql(statement: str) -> str:
+    """SQL en una línea, con las listas de binds numerados (:x_0, :x_1...) colapsadas"""
+    sql = _BIND_LIST.sub(r"\1_*", _WHITESPACE.sub(" ", statement).strip())
+    return _REPEATED_BIND.sub(r"\1", sql)
+
+
+def bind_shape(parameters: Any) -> Any:
+    """Nombres y tipos de los binds (sin valores, que pueden ser datos de pacientes)"""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+def calling_service() -> Optional[str]:
+    """Primer método de services/ en la pila de llamadas (quién lanzó la consulta)"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        # Los get_connection de los servicios solo delegan en db.connection
+        if code.co_filename.startswith(_SERVICES_DIR) and code.co_name != "get_connection":
+            return getattr(code, "co_qualname", code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class SlowQueryLog:
+    """
+    Registro de consultas lentas en memoria y en un fichero JSONL rotatorio
+
+    Configuración: SLOW_QUERY_MS (umbral), SLOW_QUERY_EXPLAIN (capturar
+    plan), SLOW_QUERY_LOG_FILE (vacío = sin fichero), SLOW_QUERY_LOG_MAX_BYTES,
+    SLOW_QUERY_LOG_BACKUPS y SLOW_QUERY_BUFFER (registros en memoria).
+    """
+
+    def __init__(self):
+        self.threshold_ms = float(os.getenv("SLOW_QUERY_MS", "500"))
+        self.explain = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+        self.path = os.getenv("SLOW_QUERY_LOG_FILE", os.path.join(_SERVER_DIR, "logs", "slow_queries.jsonl"))
+        self.max_bytes = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+        self.backups = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "3"))
+        self.recent: deque = deque(maxlen=int(os.getenv("SLOW_QUERY_BUFFER", "200")))
+        self.plans: Dict[str, Any] = {}
+        self.statements = 0
+        self.slow = 0
+        self._lock = threading.Lock()
+        self._logger: Optional[logging.Logger] = None
+
+    def _file_logger(self) -> Optional[logging.Logger]:
+        if self._logger is None and self.path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8"
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = logging.getLogger("slow_queries")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.addHandler(handler)
+                self._logger = logger
+            except OSError as e:
+                # Sistema de ficheros de solo lectura (p. ej. Vercel): solo en memoria
+                print(f"No se puede escribir el registro de consultas lentas en {self.path}: {str(e)}")
+                self.path = ""
+        return self._logger
+
+    def record(self, statement: str, parameters: Any, rows: int, execute_s: float, fetch_s: float,
+               service: Optional[str], connection: Any) -> None:
+        """Registra la ejecución si supera el umbral"""
+        elapsed_ms = (execute_s + fetch_s) * 1000
+        with self._lock:
+            self.statements += 1
+            if elapsed_ms < self.threshold_ms:
+                return
+            self.slow += 1
+
+        sql = normalize_sql(statement)
+        sql_id = hashlib.sha1(sql.encode("utf-8")).hexdigest()[:12]
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sql_id": sql_id,
+            "service": service,
+            "sql": sql,
+            "binds": bind_shape(parameters),
+            "rows": rows,
+            "elapsed_ms": round(elapsed_ms, 2),
+            "execute_ms": round(execute_s * 1000, 2),
+            "fetch_ms": round(fetch_s * 1000, 2),
+        }
+        if self.explain:
+            entry["plan"] = self.capture_plan(sql_id, statement, parameters, connection)
+
+        with self._lock:
+            self.recent.append(entry)
+            logger = self._file_logger()
+        if logger is not None:
+            logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def capture_plan(self, sql_id: str, statement: str, parameters: Any, connection: Any) -> List[str]:
+        """Plan de ejecución de la sentencia (una vez por SQL normalizado)"""
+        if sql_id in self.plans:
+            return self.plans[sql_id]
+        cursor = connection.cursor()
+        try:
+            if get_backend_name() == SQLITE:
+                cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or {})
+                plan = [" ".join(str(v) for v in row[1:]) for row in cursor.fetchall()]
+            else:
+                cursor.execute(f"EXPLAIN PLAN SET STATEMENT_ID = '{sql_id}' FOR {statement}", parameters or {})
+                cursor.execute(
+                    "SELECT PLAN_TABLE_OUTPUT FROM TABLE(DBMS_XPLAN.DISPLAY('PLAN_TABLE', :statement_id, 'TYPICAL'))",
+                    statement_id=sql_id
+                )
+                plan = [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            plan = [f"No se pudo obtener el plan: {str(e)}"]
+        finally:
+            cursor.close()
+        if len(self.plans) < 256:
+            self.plans[sql_id] = plan
+        return plan
+
+    def entries(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Consultas lentas más recientes primero"""
+        with self._lock:
+            return list(self.recent)[::-1][:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        """Configuración y contadores del registro"""
+        return {
+            "threshold_ms": self.threshold_ms,
+            "explain": self.explain,
+            "log_file": self.path or None,
+            "statements": self.statements,
+            "slow": self.slow,
+        }
+
+
+_slow_query_log: Optional[SlowQueryLog] = None
+_slow_query_log_lock = threading.Lock()
+
+
+def get_slow_query_log() -> SlowQueryLog:
+    """Registro de consultas lentas del proceso (se crea al primer uso, tras cargar .env)"""
+    global _slow_query_log
+    if _slow_query_log is None:
+        with _slow_query_log_lock:
+            if _slow_query_log is None:
+                _slow_query_log = SlowQueryLog()
+    return _slow_query_log
+
+
+class StatementCacheEstimate:
+    """
+    Estimación de aciertos en la caché de sentencias del cliente
+
+    Ni oracledb ni sqlite3 publican sus aciertos, así que se simula una
+    caché LRU del mismo tamaño (statement_cache_size) con el texto SQL exacto
+    como clave. Todas las conexiones del pool ejecutan la misma mezcla de
+    consultas, así que una única LRU para el proceso se aproxima a la de
+    cada conexión.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._statements: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, statement: str) -> bool:
+        """Registra una ejecución y devuelve si la sentencia ya estaba en caché"""
+        with self._lock:
+            hit = statement in self._statements
+            if hit:
+                self._statements.move_to_end(statement)
+            else:
+                self._statements[statement] = None
+                if len(self._statements) > self.size:
+                    self._statements.popitem(last=False)
+        DB_STATEMENT_CACHE.inc(result="hit" if hit else "miss")
+        return hit
+
+
+_statement_cache: Optional[StatementCacheEstimate] = None
+_statement_cache_lock = threading.Lock()
+
+
+def get_statement_cache() -> StatementCacheEstimate:
+    """Estimación de la caché de sentencias del proceso (se crea al primer uso)"""
+    global _statement_cache
+    if _statement_cache is None:
+        with _statement_cache_lock:
+            if _statement_cache is None:
+                _statement_cache = StatementCacheEstimate(statement_cache_size())
+    return _statement_cache
+
+
+class InstrumentedCursor:
+    """Cursor que cronometra cada ejecución y cuenta las filas leídas"""
+
+    def __init__(self, cursor: Any, connection: "InstrumentedConnection"):
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_connection", connection)
+        object.__setattr__(self, "_current", None)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # arraysize, prefetchrows... van al cursor real
+        setattr(self._cursor, name, value)
+
+    def __enter__(self) -> "InstrumentedCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def execute(self, statement: str, parameters: Any = None, **keyword_parameters: Any) -> Any:
+        self._finish()
+        get_statement_cache().lookup(statement)
+        args = (statement,) if parameters is None else (statement, parameters)
+        start = time.perf_counter()
+        result = self._cursor.execute(*args, **keyword_parameters)
+        object.__setattr__(self, "_current", {
+            "statement": statement,
+            "parameters": parameters if parameters is not None else keyword_parameters,
+            "execute_s": time.perf_counter() - start,
+            "fetch_s": 0.0,
+            "rows": 0,
+            "service": calling_service(),
+        })
+        return self if result is self._cursor else result
+
+    def _fetch(self, method: str, *args: Any) -> Any:
+        start = time.perf_counter()
+        result = getattr(self._cursor, method)(*args)
+        current = self._current
+        if current is not None:
+            current["fetch_s"] += time.perf_counter() - start
+            if method == "fetchone":
+                current["rows"] += result is not None
+            else:
+                current["rows"] += len(result)
+        return result
+
+    def fetchone(self) -> Any:
+        return self._fetch("fetchone")
+
+    def fetchmany(self, *args: Any) -> List[Any]:
+        return self._fetch("fetchmany", *args)
+
+    def fetchall(self) -> List[Any]:
+        return self._fetch("fetchall")
+
+    def _finish(self) -> None:
+        current = self._current
+        if current is not None:
+            object.__setattr__(self, "_current", None)
+            observe_db_phase(current["service"], "execute", current["execute_s"])
+            observe_db_phase(current["service"], "fetch", current["fetch_s"])
+            DB_ROWS.inc(current["rows"], service=current["service"] or "unknown")
+            get_slow_query_log().record(
+                current["statement"], current["parameters"], current["rows"],
+                current["execute_s"], current["fetch_s"], current["service"], self._connection.raw
+            )
+
+    def close(self) -> None:
+        self._finish()
+        self._connection.forget(self)
+        self._cursor.close()
+
+
+class InstrumentedConnection:
+    """Conexión (Oracle o SQLite) cuyos cursores se miden"""
+
+    def __init__(self, connection: Any):
+        self.raw = connection
+        self._cursors: List[InstrumentedCursor] = []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+    def __enter__(self) -> "InstrumentedConnection":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def cursor(self, *args: Any, **kwargs: Any) -> InstrumentedCursor:
+        cursor = InstrumentedCursor(self.raw.cursor(*args, **kwargs), self)
+        self._cursors.append(cursor)
+        return cursor
+
+    def forget(self, cursor: InstrumentedCursor) -> None:
+        if cursor in self._cursors:
+            self._cursors.remove(cursor)
+
+    def fetch_df_batches(self, statement: str, parameters: Any = None, **kwargs: Any):
+        """fetch_df_batches de oracledb, cronometrado como una sola ejecución"""
+        service = calling_service()
+        start = time.perf_counter()
+        rows = 0
+        try:
+            for data_frame in self.raw.fetch_df_batches(statement, parameters, **kwargs):
+                rows += data_frame.num_rows()
+                yield data_frame
+        finally:
+            elapsed = time.perf_counter() - start
+            observe_db_phase(service, "fetch", elapsed)
+            DB_ROWS.inc(rows, service=service or "unknown")
+            get_slow_query_log().record(statement, parameters, rows, 0.0, elapsed, service, self.raw)
+
+    def close(self) -> None:
+        # Los cursores que no se cerraron explícitamente se registran aquí
+        for cursor in list(self._cursors):
+            cursor._finish()
+        self._cursors.clear()
+        self.raw.close()
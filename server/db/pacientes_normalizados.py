@@ -0,0 +1,313 @@
+"""
+ETL de DATOS_ORIGINALES a la tabla normalizada e indexada PACIENTES_NORMALIZADOS
+
+La tabla guarda ya calculados el año de nacimiento (con la corrección de
+siglo para años > 2025), el código numérico de sexo, las fechas de ingreso y
+fin de contacto como DATE y una clave entera de paciente (PACIENTE_KEY, una
+por NOMBRE + CENTRO_RECODIFICADO), de modo que los filtros pueden usar
+índices y los recuentos de pacientes únicos comparan enteros.
+
+Los episodios nuevos de DATOS_ORIGINALES se pueden añadir sin reconstruir la
+tabla (--append). La marca de agua es INGEST_ID, una columna identidad que la
+ETL añade a DATOS_ORIGINALES y que numera las filas en el orden en que se
+cargan (los ROWID no sirven: una inserción convencional reutiliza huecos de
+bloques anteriores). SOURCE_INGEST_ID guarda el INGEST_ID de cada fila y las
+filas con uno mayor que el máximo cargado se normalizan a continuación, con
+ID crecientes. La carga incremental debe lanzarse cuando las cargas en
+DATOS_ORIGINALES ya han confirmado, porque el número se asigna al insertar.
+
+Uso:
+    python -m db.pacientes_normalizados [--append]
+"""
+import os
+import re
+from datetime import date
+from typing import List, Optional, Union
+
+PATIENT_TABLE = os.getenv("PATIENT_TABLE", "PACIENTES_NORMALIZADOS")
+SOURCE_TABLE = "DATOS_ORIGINALES"
+# Columna identidad de DATOS_ORIGINALES: orden de carga de los episodios
+INGEST_COLUMN = "INGEST_ID"
+
+# Año de nacimiento a partir de 'MM/DD/YY', restando un siglo a los años futuros
+BIRTH_YEAR_SQL = """
+    CASE
+        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO DEFAULT NULL ON CONVERSION ERROR, 'MM/DD/YY')) > 2025
+        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO DEFAULT NULL ON CONVERSION ERROR, 'MM/DD/YY')) - 100
+        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO DEFAULT NULL ON CONVERSION ERROR, 'MM/DD/YY'))
+    END
+"""
+
+
+# Clave entera del paciente (NOMBRE + CENTRO_RECODIFICADO); NULL si falta alguno
+PATIENT_KEY_SQL = """
+    CAST(CASE
+        WHEN NOMBRE IS NOT NULL AND CENTRO_RECODIFICADO IS NOT NULL
+        THEN DENSE_RANK() OVER (ORDER BY NOMBRE, CENTRO_RECODIFICADO)
+    END AS NUMBER(10))
+"""
+
+# En una carga incremental: la clave ya asignada a ese paciente o una nueva.
+# Las claves nunca superan el mayor ID de la tabla (la inicial es un rango
+# sobre sus filas), así que :max_id + rango no coincide con ninguna anterior
+APPEND_PATIENT_KEY_SQL = """
+    CASE
+        WHEN s.NOMBRE IS NOT NULL AND s.CENTRO_RECODIFICADO IS NOT NULL
+        THEN COALESCE(
+            (SELECT MAX(t.PACIENTE_KEY) FROM {table} t
+             WHERE t.NOMBRE = s.NOMBRE AND t.CENTRO_RECODIFICADO = s.CENTRO_RECODIFICADO),
+            :max_id + DENSE_RANK() OVER (ORDER BY s.NOMBRE, s.CENTRO_RECODIFICADO)
+        )
+    END
+"""
+
+
+def _mixed_date_sql(column: str) -> str:
+    """Convierte una columna con fechas M/D/YY o DD/MM/YYYY a DATE"""
+    return f"""
+    CASE
+        WHEN REGEXP_LIKE({column}, '^[0-9]{{1,2}}/[0-9]{{1,2}}/[0-9]{{4}}$')
+        THEN TO_DATE({column} DEFAULT NULL ON CONVERSION ERROR, 'DD/MM/YYYY')
+        WHEN REGEXP_LIKE({column}, '^[0-9]{{1,2}}/[0-9]{{1,2}}/[0-9]{{2}}$')
+        THEN TO_DATE({column} DEFAULT NULL ON CONVERSION ERROR, 'MM/DD/RR')
+    END
+    """
+
+
+_DMY_LONG = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+_MDY_SHORT = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{2})$")
+_MDY_BIRTH = re.compile(r"^\s*(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})\s*$")
+
+
+# Equivalentes en Python de las expresiones SQL anteriores, para los motores
+# que no son Oracle (db.sqlite_backend) y para convertir las filas de la API
+
+def parse_birth_year(value: Optional[str]) -> Optional[int]:
+    """Año de nacimiento de una fecha 'MM/DD/YY' (mismas reglas que BIRTH_YEAR_SQL)"""
+    match = _MDY_BIRTH.match(value or "")
+    if not match:
+        return None
+    month, day, year = (int(g) for g in match.groups())
+    if len(match.group(3)) == 2:
+        year += 2000  # 'YY' en Oracle toma el siglo actual
+    try:
+        date(year, month, day)
+    except ValueError:
+        return None
+    return year - 100 if year > 2025 else year
+
+
+def parse_mixed_date(value: Optional[str]) -> Optional[date]:
+    """Fecha de texto DD/MM/YYYY o M/D/YY (mismas reglas que _mixed_date_sql)"""
+    if not value:
+        return None
+    try:
+        match = _DMY_LONG.match(value)
+        if match:
+            day, month, year = (int(g) for g in match.groups())
+            return date(year, month, day)
+        match = _MDY_SHORT.match(value)
+        if match:
+            month, day, year = (int(g) for g in match.groups())
+            # Pivote del formato RR de Oracle en el siglo actual
+            return date(2000 + year if year < 50 else 1900 + year, month, day)
+    except ValueError:
+        return None
+    return None
+
+
+def sexo_cod(value: Optional[str]) -> int:
+    """Código de sexo (1=Hombre, 2=Mujer, 3=Otros)"""
+    return {"1": 1, "2": 2}.get((value or "").strip(), 3)
+
+
+def to_number(value: Optional[str]) -> Optional[Union[int, float]]:
+    """Número de un texto, o None si no lo es (como TO_NUMBER ... DEFAULT NULL)"""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def _normalized_columns_sql(id_sql: str, key_sql: str) -> str:
+    """Lista SELECT de la tabla normalizada sobre DATOS_ORIGINALES"""
+    return f"""
+        {id_sql} AS ID,
+        CIP_SNS_RECODIFICADO,
+        NOMBRE,
+        COMUNIDAD_AUTONOMA,
+        CATEGORIA,
+        CENTRO_RECODIFICADO,
+        SEXO,
+        CAST(CASE SEXO WHEN '1' THEN 1 WHEN '2' THEN 2 ELSE 3 END AS NUMBER(1)) AS SEXO_COD,
+        CAST({BIRTH_YEAR_SQL} AS NUMBER(4)) AS ANIO_NACIMIENTO,
+        FECHA_DE_NACIMIENTO,
+        FECHA_DE_INGRESO,
+        FECHA_DE_FIN_CONTACTO,
+        {_mixed_date_sql('FECHA_DE_INGRESO')} AS FECHA_INGRESO_DT,
+        {_mixed_date_sql('FECHA_DE_FIN_CONTACTO')} AS FECHA_FIN_CONTACTO_DT,
+        TO_NUMBER(ESTANCIA_DIAS DEFAULT NULL ON CONVERSION ERROR) AS ESTANCIA_DIAS,
+        {key_sql} AS PACIENTE_KEY,
+        {INGEST_COLUMN} AS SOURCE_INGEST_ID
+    """
+
+
+def ingest_column_statement() -> str:
+    """
+    DDL que añade INGEST_ID a DATOS_ORIGINALES
+
+    Las filas existentes se numeran al añadir la columna y las que se
+    inserten después sin ella reciben el siguiente valor (ORDER: también
+    creciente entre instancias de RAC).
+    """
+    return f"""
+    ALTER TABLE {SOURCE_TABLE} ADD (
+        {INGEST_COLUMN} NUMBER GENERATED BY DEFAULT ON NULL AS IDENTITY (ORDER)
+    )
+    """
+
+
+def has_column(cursor, table: str, column: str) -> bool:
+    """True si la tabla del esquema actual tiene esa columna"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM USER_TAB_COLUMNS WHERE TABLE_NAME = :tabla AND COLUMN_NAME = :columna",
+        tabla=table.upper(), columna=column.upper()
+    )
+    return cursor.fetchone()[0] > 0
+
+
+def build_statements(table: str = PATIENT_TABLE) -> List[str]:
+    """
+    Sentencias DDL para (re)construir la tabla normalizada y sus índices
+
+    Args:
+        table: Nombre de la tabla destino
+
+    Returns:
+        Lista de sentencias SQL en orden de ejecución
+    """
+    create = f"""
+    CREATE TABLE {table} AS
+    SELECT {_normalized_columns_sql(f"CAST(ROW_NUMBER() OVER (ORDER BY {INGEST_COLUMN}) AS NUMBER(10))",
+                                    PATIENT_KEY_SQL)}
+    FROM {SOURCE_TABLE}
+    """
+    return [
+        create,
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_PK PRIMARY KEY (ID)",
+        f"CREATE INDEX {table}_COMUNIDAD_IX ON {table} (UPPER(COMUNIDAD_AUTONOMA))",
+        # Cubre los recuentos de pacientes únicos por categoría, sexo y año
+        f"CREATE INDEX {table}_CATEGORIA_IX ON {table} (CATEGORIA, SEXO_COD, ANIO_NACIMIENTO, PACIENTE_KEY)",
+        f"CREATE INDEX {table}_CENTRO_IX ON {table} (CENTRO_RECODIFICADO)",
+        f"CREATE INDEX {table}_ANIO_IX ON {table} (ANIO_NACIMIENTO)",
+        f"CREATE INDEX {table}_SEXO_IX ON {table} (SEXO_COD)",
+        f"CREATE INDEX {table}_NOMBRE_IX ON {table} (NOMBRE, ID)",
+        # Episodios anteriores de un paciente (recuentos incrementales)
+        f"CREATE INDEX {table}_PACIENTE_IX ON {table} (PACIENTE_KEY, ID)",
+        # Marca de agua de la carga incremental
+        f"CREATE INDEX {table}_SOURCE_IX ON {table} (SOURCE_INGEST_ID)",
+    ]
+
+
+def append_statement(table: str = PATIENT_TABLE) -> str:
+    """
+    INSERT de las filas de DATOS_ORIGINALES posteriores a la marca de agua
+
+    Binds: :max_id (mayor ID de la tabla, 0 si está vacía) y :source_hwm
+    (mayor SOURCE_INGEST_ID cargado, 0 para cargarlo todo).
+    """
+    key_sql = APPEND_PATIENT_KEY_SQL.format(table=table)
+    return f"""
+    INSERT INTO {table}
+    SELECT {_normalized_columns_sql(f":max_id + ROW_NUMBER() OVER (ORDER BY {INGEST_COLUMN})", key_sql)}
+    FROM {SOURCE_TABLE} s
+    WHERE {INGEST_COLUMN} > :source_hwm
+    """
+
+
+def read_high_water_mark(cursor, table: str = PATIENT_TABLE) -> int:
+    """
+    Mayor ID de la tabla normalizada (0 si está vacía)
+
+    Los ID crecen con cada carga, así que los agregados que recuerdan este
+    valor solo tienen que leer después las filas con un ID mayor.
+    """
+    cursor.execute(f"SELECT MAX(ID) FROM {table}")
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else 0
+
+
+def build_normalized_table(connection, table: str = PATIENT_TABLE) -> int:
+    """
+    Reconstruye la tabla normalizada desde DATOS_ORIGINALES
+
+    Args:
+        connection: Conexión Oracle abierta
+        table: Nombre de la tabla destino
+
+    Returns:
+        Número de filas cargadas
+    """
+    import oracledb
+
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(f"DROP TABLE {table} PURGE")
+        except oracledb.DatabaseError as e:
+            # ORA-00942: la tabla no existe todavía
+            if e.args[0].code != 942:
+                raise
+
+        if not has_column(cursor, SOURCE_TABLE, INGEST_COLUMN):
+            cursor.execute(ingest_column_statement())
+        for statement in build_statements(table):
+            cursor.execute(statement)
+
+        cursor.execute("BEGIN DBMS_STATS.GATHER_TABLE_STATS(USER, :tabla); END;", tabla=table)
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def append_normalized_rows(connection, table: str = PATIENT_TABLE) -> int:
+    """
+    Normaliza y añade las filas de DATOS_ORIGINALES cargadas desde la última ETL
+
+    Args:
+        connection: Conexión Oracle abierta
+        table: Nombre de la tabla destino
+
+    Returns:
+        Número de filas añadidas
+    
+    Raises:
+        RuntimeError: Si la tabla se construyó sin SOURCE_INGEST_ID (hay que
+            reconstruirla una vez y refrescar los agregados con full=true)
+    """
+    with connection.cursor() as cursor:
+        if not has_column(cursor, table, "SOURCE_INGEST_ID"):
+            raise RuntimeError(f"{table} no tiene marca de agua de carga: reconstrúyala con "
+                               "python -m db.pacientes_normalizados")
+        cursor.execute(f"SELECT MAX(ID), MAX(SOURCE_INGEST_ID) FROM {table}")
+        max_id, source_hwm = cursor.fetchone()
+        cursor.execute(append_statement(table), max_id=max_id or 0, source_hwm=source_hwm or 0)
+        added = cursor.rowcount
+        connection.commit()
+        return added
+
+
+if __name__ == "__main__":
+    import sys
+    from db.connection import get_connection
+
+    with get_connection() as connection:
+        if "--append" in sys.argv[1:]:
+            added = append_normalized_rows(connection)
+            print(f"✅ {PATIENT_TABLE}: {added} filas nuevas añadidas")
+        else:
+            total = build_normalized_table(connection)
+            print(f"✅ {PATIENT_TABLE} reconstruida con {total} filas")
@@ -0,0 +1,269 @@
+"""
+Motor SQLite local con el mismo esquema que Oracle (DB_BACKEND=sqlite)
+
+Permite ejecutar, medir y perfilar la API sin la base de datos en la nube.
+La base se crea a partir de un CSV con las columnas de DATOS_ORIGINALES:
+se copia tal cual y se normaliza en PACIENTES_NORMALIZADOS con las mismas
+reglas que la ETL de Oracle (db.pacientes_normalizados).
+
+Uso:
+    python -m db.sqlite_backend datos_originales.csv [ruta.sqlite3]
+    python -m db.sqlite_backend --append episodios_nuevos.csv [ruta.sqlite3]
+"""
+import csv
+import os
+import sqlite3
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from db.backend import statement_cache_size
+from db.pacientes_normalizados import (
+    INGEST_COLUMN, PATIENT_TABLE, SOURCE_TABLE, parse_birth_year, parse_mixed_date, sexo_cod, to_number
+)
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   "data", "pacientes.sqlite3")
+
+# Columnas de la tabla normalizada, en el orden de la ETL de Oracle
+NORMALIZED_COLUMNS = [
+    ("ID", "INTEGER PRIMARY KEY"),
+    ("CIP_SNS_RECODIFICADO", "TEXT"),
+    ("NOMBRE", "TEXT"),
+    ("COMUNIDAD_AUTONOMA", "TEXT"),
+    ("CATEGORIA", "TEXT"),
+    ("CENTRO_RECODIFICADO", "TEXT"),
+    ("SEXO", "TEXT"),
+    ("SEXO_COD", "INTEGER"),
+    ("ANIO_NACIMIENTO", "INTEGER"),
+    ("FECHA_DE_NACIMIENTO", "TEXT"),
+    ("FECHA_DE_INGRESO", "TEXT"),
+    ("FECHA_DE_FIN_CONTACTO", "TEXT"),
+    ("FECHA_INGRESO_DT", "TEXT"),
+    ("FECHA_FIN_CONTACTO_DT", "TEXT"),
+    ("ESTANCIA_DIAS", "NUMERIC"),
+    ("PACIENTE_KEY", "INTEGER"),
+    ("SOURCE_INGEST_ID", "INTEGER"),
+]
+
+
+def get_sqlite_path() -> str:
+    """Ruta del fichero SQLite (SQLITE_PATH)"""
+    return os.getenv("SQLITE_PATH") or DEFAULT_SQLITE_PATH
+
+
+def _upper(value):
+    # UPPER de SQLite solo convierte ASCII; Oracle convierte también 'í', 'ñ'...
+    return value.upper() if isinstance(value, str) else value
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """Cursor con la parte de la interfaz de oracledb que usan los servicios"""
+
+    prefetchrows = 2  # Sin efecto en SQLite; se admite para no distinguir motores
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SQLiteConnection(sqlite3.Connection):
+    """Conexión que se cierra al salir de un bloque with, como las del pool de Oracle"""
+
+    def cursor(self, factory=SQLiteCursor):
+        return super().cursor(factory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def connect(path: Optional[str] = None, create: bool = False) -> SQLiteConnection:
+    """
+    Abre la base SQLite local
+
+    Args:
+        path: Ruta del fichero (por defecto SQLITE_PATH)
+        create: Si es False, falla cuando el fichero no existe en lugar de crearlo vacío
+    """
+    path = path or get_sqlite_path()
+    if not create and not os.path.exists(path):
+        raise RuntimeError(f"No existe la base SQLite {path}; créela con python -m db.sqlite_backend <csv>")
+    connection = sqlite3.connect(path, factory=SQLiteConnection, check_same_thread=False,
+                                 cached_statements=statement_cache_size())
+    connection.create_function("UPPER", 1, _upper, deterministic=True)
+    return connection
+
+
+def normalize_row(patient_id: int, row: dict) -> tuple:
+    """Fila de PACIENTES_NORMALIZADOS a partir de una fila de DATOS_ORIGINALES"""
+    fecha_ingreso = parse_mixed_date(row.get("FECHA_DE_INGRESO"))
+    fecha_fin = parse_mixed_date(row.get("FECHA_DE_FIN_CONTACTO"))
+    return (
+        patient_id,
+        row.get("CIP_SNS_RECODIFICADO"),
+        row.get("NOMBRE"),
+        row.get("COMUNIDAD_AUTONOMA"),
+        row.get("CATEGORIA"),
+        row.get("CENTRO_RECODIFICADO"),
+        row.get("SEXO"),
+        sexo_cod(row.get("SEXO")),
+        parse_birth_year(row.get("FECHA_DE_NACIMIENTO")),
+        row.get("FECHA_DE_NACIMIENTO"),
+        row.get("FECHA_DE_INGRESO"),
+        row.get("FECHA_DE_FIN_CONTACTO"),
+        fecha_ingreso.isoformat() if fecha_ingreso else None,
+        fecha_fin.isoformat() if fecha_fin else None,
+        to_number(row.get("ESTANCIA_DIAS")),
+    )
+
+
+def assign_patient_keys(normalized: List[tuple], existing: Optional[Dict[tuple, int]] = None,
+                        offset: int = 0) -> List[tuple]:
+    """
+    Añade PACIENTE_KEY a las filas normalizadas (como PATIENT_KEY_SQL)
+
+    Un entero por (NOMBRE, CENTRO_RECODIFICADO) en orden, o None si falta alguno.
+    En una carga incremental (como APPEND_PATIENT_KEY_SQL) se reutilizan las
+    claves de existing y las nuevas se numeran a partir de offset.
+    """
+    existing = existing or {}
+    pairs = sorted({(r[2], r[5]) for r in normalized if r[2] is not None and r[5] is not None})
+    keys = {pair: existing.get(pair) or offset + i for i, pair in enumerate(pairs, start=1)}
+    return [r + (keys.get((r[2], r[5])),) for r in normalized]
+
+
+def build_sqlite_database(rows: Iterable[dict], path: Optional[str] = None, table: str = PATIENT_TABLE) -> int:
+    """
+    (Re)construye la base SQLite con DATOS_ORIGINALES y la tabla normalizada
+
+    Args:
+        rows: Filas de DATOS_ORIGINALES como diccionarios (cadenas vacías = NULL)
+        path: Ruta del fichero SQLite
+        table: Nombre de la tabla normalizada
+
+    Returns:
+        Número de filas cargadas
+    """
+    path = path or get_sqlite_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    rows = [{k: (v if v != "" else None) for k, v in row.items()} for row in rows]
+    source_columns: List[str] = list(rows[0]) if rows else [
+        c for c, _ in NORMALIZED_COLUMNS if c not in ("ID", "PACIENTE_KEY", "SOURCE_INGEST_ID")
+    ]
+
+    with connect(path, create=True) as connection:
+        # INGEST_ID como la columna identidad de Oracle: AUTOINCREMENT no reutiliza valores
+        quoted = ", ".join(f'"{c}" TEXT' for c in source_columns)
+        connection.execute(f"DROP TABLE IF EXISTS {SOURCE_TABLE}")
+        connection.execute(f"CREATE TABLE {SOURCE_TABLE} ({INGEST_COLUMN} INTEGER PRIMARY KEY AUTOINCREMENT, {quoted})")
+        insert_source_rows(connection, source_columns, rows)
+
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+        connection.execute(f"CREATE TABLE {table} ({', '.join(f'{c} {t}' for c, t in NORMALIZED_COLUMNS)})")
+        connection.executemany(
+            f"INSERT INTO {table} VALUES ({', '.join('?' for _ in NORMALIZED_COLUMNS)})",
+            # La fila i de DATOS_ORIGINALES tiene INGEST_ID i en una tabla recién creada
+            [r + (r[0],) for r in assign_patient_keys([normalize_row(i, row) for i, row in enumerate(rows, start=1)])]
+        )
+
+        # Mismos índices que en Oracle (el de UPPER(COMUNIDAD) es sobre la columna)
+        for name, columns in [
+            ("COMUNIDAD_IX", "COMUNIDAD_AUTONOMA"),
+            ("CATEGORIA_IX", "CATEGORIA, SEXO_COD, ANIO_NACIMIENTO, PACIENTE_KEY"),
+            ("CENTRO_IX", "CENTRO_RECODIFICADO"),
+            ("ANIO_IX", "ANIO_NACIMIENTO"),
+            ("SEXO_IX", "SEXO_COD"),
+            ("NOMBRE_IX", "NOMBRE, ID"),
+            ("PACIENTE_IX", "PACIENTE_KEY, ID"),
+            ("SOURCE_IX", "SOURCE_INGEST_ID"),
+        ]:
+            connection.execute(f"CREATE INDEX {table}_{name} ON {table} ({columns})")
+        connection.execute("ANALYZE")
+        connection.commit()
+        return connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def insert_source_rows(connection: SQLiteConnection, source_columns: List[str], rows: List[dict]) -> None:
+    """Inserta filas en DATOS_ORIGINALES; INGEST_ID lo asigna SQLite"""
+    names = ", ".join(f'"{c}"' for c in source_columns)
+    connection.executemany(
+        f"INSERT INTO {SOURCE_TABLE} ({names}) VALUES ({', '.join('?' for _ in source_columns)})",
+        ([row.get(c) for c in source_columns] for row in rows)
+    )
+
+
+def append_normalized_rows(connection: SQLiteConnection, table: str = PATIENT_TABLE) -> int:
+    """
+    Normaliza y añade las filas de DATOS_ORIGINALES posteriores a la marca de
+    agua (mayor SOURCE_INGEST_ID), como db.pacientes_normalizados.append_normalized_rows
+
+    Returns:
+        Número de filas añadidas
+    """
+    max_id, source_hwm = connection.execute(f"SELECT MAX(ID), MAX(SOURCE_INGEST_ID) FROM {table}").fetchone()
+    max_id = max_id or 0
+    cursor = connection.execute(
+        f"SELECT * FROM {SOURCE_TABLE} WHERE {INGEST_COLUMN} > ? ORDER BY {INGEST_COLUMN}", (source_hwm or 0,)
+    )
+    columns = [d[0] for d in cursor.description][1:]
+    new_rows = [(values[0], dict(zip(columns, values[1:]))) for values in cursor.fetchall()]
+    if not new_rows:
+        return 0
+
+    normalized = [normalize_row(max_id + i, row) for i, (_ingest_id, row) in enumerate(new_rows, start=1)]
+    existing = {}
+    for nombre, centro in {(r[2], r[5]) for r in normalized if r[2] is not None and r[5] is not None}:
+        key = connection.execute(
+            f"SELECT MAX(PACIENTE_KEY) FROM {table} WHERE NOMBRE = ? AND CENTRO_RECODIFICADO = ?",
+            (nombre, centro)
+        ).fetchone()[0]
+        if key is not None:
+            existing[(nombre, centro)] = key
+    keyed = assign_patient_keys(normalized, existing, offset=max_id)
+    connection.executemany(
+        f"INSERT INTO {table} VALUES ({', '.join('?' for _ in NORMALIZED_COLUMNS)})",
+        [r + (ingest_id,) for r, (ingest_id, _row) in zip(keyed, new_rows)]
+    )
+    connection.commit()
+    return len(new_rows)
+
+
+def append_sqlite_rows(rows: Iterable[dict], path: Optional[str] = None, table: str = PATIENT_TABLE) -> int:
+    """
+    Añade episodios nuevos a DATOS_ORIGINALES y los normaliza sin reconstruir la tabla
+
+    Returns:
+        Número de filas añadidas a la tabla normalizada
+    """
+    rows = [{k: (v if v != "" else None) for k, v in row.items()} for row in rows]
+    with connect(path) as connection:
+        source_columns = [r[1] for r in connection.execute(f"PRAGMA table_info({SOURCE_TABLE})")
+                          if r[1] != INGEST_COLUMN]
+        insert_source_rows(connection, source_columns, rows)
+        return append_normalized_rows(connection, table)
+
+
+def read_csv(csv_path: str, delimiter: str = ",") -> List[dict]:
+    """Lee un CSV con las columnas de DATOS_ORIGINALES"""
+    with open(csv_path, encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f, delimiter=delimiter))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    append = "--append" in args
+    args = [a for a in args if a != "--append"]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    target = args[1] if len(args) > 1 else get_sqlite_path()
+    if append:
+        added = append_sqlite_rows(read_csv(args[0]), target)
+        print(f"✅ {target}: {added} filas nuevas añadidas a {PATIENT_TABLE}")
+    else:
+        total = build_sqlite_database(read_csv(args[0]), target)
+        print(f"✅ {target}: {PATIENT_TABLE} construida con {total} filas")
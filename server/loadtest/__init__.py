@@ -0,0 +1,3 @@
+"""
+Pruebas de carga de la API
+"""
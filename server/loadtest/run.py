@@ -0,0 +1,296 @@
+"""
+Pruebas de carga HTTP de la API (latencias p50/p95/p99 y peticiones por segundo)
+
+Los escenarios se definen en scenarios.json: cada uno tiene una concurrencia,
+una duración (o un número total de peticiones) y una mezcla ponderada de
+peticiones cuyos parámetros se eligen al azar de listas de valores
+(opcionalmente con pesos). Con la misma semilla la secuencia es reproducible.
+
+Uso:
+    python -m loadtest.run --scenario filter-mix --base-url http://localhost:8001
+    python -m loadtest.run --scenario dashboard --save-baseline
+    python -m loadtest.run --scenario dashboard --tolerance 0.15
+
+Los resultados se guardan en loadtest/results/ y se comparan con
+loadtest/baseline.json si existe; una regresión mayor que la tolerancia
+hace que el proceso termine con código 1.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCENARIOS = os.path.join(LOADTEST_DIR, "scenarios.json")
+DEFAULT_RESULTS_DIR = os.path.join(LOADTEST_DIR, "results")
+DEFAULT_BASELINE = os.path.join(LOADTEST_DIR, "baseline.json")
+
+# Métricas comparadas con la línea base: (clave, True si mayor es peor)
+COMPARED_METRICS = [("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("rps", False)]
+
+
+def load_scenarios(path: str = DEFAULT_SCENARIOS) -> Dict[str, Any]:
+    """Lee el fichero de escenarios"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def pick(rng: random.Random, options: Any) -> Any:
+    """Elige un valor de una lista o de {"values": [...], "weights": [...]}"""
+    if isinstance(options, dict):
+        return rng.choices(options["values"], weights=options.get("weights"))[0]
+    return rng.choice(options)
+
+
+def build_request(rng: random.Random, template: Dict[str, Any]) -> Tuple[str, str, Optional[bytes]]:
+    """
+    Genera (método, ruta, cuerpo) a partir de una plantilla
+
+    Los valores elegidos van al cuerpo JSON en POST y a la query string en GET.
+    """
+    method = template.get("method", "GET").upper()
+    values = {name: pick(rng, options) for name, options in template.get("choices", {}).items()}
+    path = template["path"]
+    if method == "GET":
+        query = {**template.get("params", {}), **values}
+        if query:
+            path = f"{path}?{urlencode(query)}"
+        return method, path, None
+    body = {**template.get("body", {}), **values}
+    return method, path, json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    """Resumen de latencias (en ms) y rendimiento de un conjunto de peticiones"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 2) if elapsed > 0 else None,
+        "mean_ms": round(sum(ordered) / count, 2) if count else None,
+        "p50_ms": round(percentile(ordered, 0.50), 2) if count else None,
+        "p95_ms": round(percentile(ordered, 0.95), 2) if count else None,
+        "p99_ms": round(percentile(ordered, 0.99), 2) if count else None,
+        "max_ms": round(ordered[-1], 2) if count else None,
+    }
+
+
+class LoadTest:
+    """Ejecuta un escenario con varios hilos que comparten un reloj y un presupuesto de peticiones"""
+
+    def __init__(self, base_url: str, scenario: Dict[str, Any], seed: int = 0,
+                 concurrency: Optional[int] = None, duration: Optional[float] = None,
+                 requests_total: Optional[int] = None, timeout: float = 30):
+        self.base = urlsplit(base_url)
+        self.scenario = scenario
+        self.seed = seed
+        self.concurrency = concurrency or scenario.get("concurrency", 8)
+        self.requests_total = requests_total or (None if duration else scenario.get("requests_total"))
+        self.duration = duration or (None if self.requests_total else scenario.get("duration", 30))
+        self.timeout = timeout
+        self.templates = scenario["requests"]
+        self.weights = [t.get("weight", 1) for t in self.templates]
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._latencies: Dict[str, List[float]] = {t["name"]: [] for t in self.templates}
+        self._errors: Dict[str, int] = {t["name"]: 0 for t in self.templates}
+        self._status: Dict[str, Dict[str, int]] = {t["name"]: {} for t in self.templates}
+
+    def _connection(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.base.scheme == "https" else http.client.HTTPConnection
+        return cls(self.base.hostname, self.base.port, timeout=self.timeout)
+
+    def _next_slot(self, deadline: Optional[float]) -> bool:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        with self._lock:
+            if self.requests_total is not None and self._issued >= self.requests_total:
+                return False
+            self._issued += 1
+            return True
+
+    def _worker(self, worker_id: int, deadline: Optional[float]) -> None:
+        rng = random.Random(self.seed * 1000 + worker_id)
+        connection = self._connection()
+        prefix = self.base.path.rstrip("/")
+        try:
+            while self._next_slot(deadline):
+                template = rng.choices(self.templates, weights=self.weights)[0]
+                method, path, body = build_request(rng, template)
+                headers = {"Accept": "application/json"}
+                if body is not None:
+                    headers["Content-Type"] = "application/json"
+
+                start = time.perf_counter()
+                try:
+                    connection.request(method, prefix + path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    status = str(response.status)
+                    ok = response.status < 400
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection = self._connection()
+                    status, ok = "connection-error", False
+                elapsed_ms = (time.perf_counter() - start) * 1000
+
+                with self._lock:
+                    name = template["name"]
+                    self._status[name][status] = self._status[name].get(status, 0) + 1
+                    if ok:
+                        self._latencies[name].append(elapsed_ms)
+                    else:
+                        self._errors[name] += 1
+        finally:
+            connection.close()
+
+    def run(self) -> Dict[str, Any]:
+        """Lanza los hilos, espera a que terminen y devuelve el informe"""
+        started_at = datetime.now().isoformat(timespec="seconds")
+        start = time.perf_counter()
+        deadline = start + self.duration if self.duration else None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [executor.submit(self._worker, i, deadline) for i in range(self.concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        all_latencies = [value for values in self._latencies.values() for value in values]
+        return {
+            "scenario": self.scenario["name"],
+            "started_at": started_at,
+            "base_url": self.base.geturl(),
+            "concurrency": self.concurrency,
+            "duration_s": round(elapsed, 2),
+            "seed": self.seed,
+            "total": summarize(all_latencies, sum(self._errors.values()), elapsed),
+            "endpoints": {
+                name: {**summarize(self._latencies[name], self._errors[name], elapsed), "status": self._status[name]}
+                for name in self._latencies
+            },
+        }
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Compara un resultado con la línea base del mismo escenario
+
+    Returns:
+        Lista de diferencias por endpoint y métrica, marcando las regresiones
+    """
+    rows = []
+    sections = [("total", result["total"], baseline.get("total", {}))]
+    sections += [(name, stats, baseline.get("endpoints", {}).get(name, {}))
+                 for name, stats in result["endpoints"].items()]
+    for name, current, previous in sections:
+        for metric, higher_is_worse in COMPARED_METRICS:
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regression = change > tolerance if higher_is_worse else change < -tolerance
+            rows.append({"endpoint": name, "metric": metric, "baseline": before, "current": after,
+                         "change": round(change, 4), "regression": regression})
+    return rows
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"\n📊 Escenario {result['scenario']} — concurrencia {result['concurrency']}, {result['duration_s']} s")
+    print(f"   {'endpoint':<24}{'peticiones':>11}{'errores':>9}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in [*result["endpoints"].items(), ("TOTAL", result["total"])]:
+        print(f"   {name:<24}{stats['requests']:>11}{stats['errors']:>9}{_fmt(stats['rps']):>9}"
+              f"{_fmt(stats['p50_ms']):>10}{_fmt(stats['p95_ms']):>10}{_fmt(stats['p99_ms']):>10}")
+
+
+def print_comparison(rows: List[Dict[str, Any]]) -> None:
+    print("\n📈 Comparación con la línea base")
+    for row in rows:
+        mark = "❌" if row["regression"] else "✅"
+        print(f"   {mark} {row['endpoint']:<24}{row['metric']:<8}{_fmt(row['baseline']):>10} → "
+              f"{_fmt(row['current']):>10}  ({row['change'] * 100:+.1f}%)")
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pruebas de carga de la API")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:8001"))
+    parser.add_argument("--scenarios-file", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--scenario", action="append", help="Escenario a ejecutar (repetible; por defecto todos)")
+    parser.add_argument("--concurrency", type=int, help="Sustituye la concurrencia del escenario")
+    parser.add_argument("--duration", type=float, help="Duración en segundos")
+    parser.add_argument("--requests", type=int, help="Número total de peticiones (en lugar de duración)")
+    parser.add_argument("--seed", type=int, help="Semilla de la mezcla de peticiones")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda este resultado como línea base")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento relativo admitido (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    config = load_scenarios(args.scenarios_file)
+    scenarios = {s["name"]: s for s in config["scenarios"]}
+    names = args.scenario or list(scenarios)
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(unknown)}")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    regressions = 0
+    for name in names:
+        result = LoadTest(
+            args.base_url, scenarios[name],
+            seed=args.seed if args.seed is not None else config.get("seed", 0),
+            concurrency=args.concurrency, duration=args.duration, requests_total=args.requests
+        ).run()
+        print_report(result)
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(args.results_dir, f"{stamp}-{name}.json")
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"   💾 Resultado guardado en {output}")
+
+        if name in baselines and not args.save_baseline:
+            rows = compare(result, baselines[name], args.tolerance)
+            print_comparison(rows)
+            regressions += sum(row["regression"] for row in rows)
+        baselines[name] = result if args.save_baseline else baselines.get(name)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in baselines.items() if v is not None}, f, ensure_ascii=False, indent=2)
+        print(f"\n📌 Línea base actualizada en {args.baseline}")
+
+    if regressions:
+        print(f"\n❌ {regressions} métricas empeoran más de un {args.tolerance * 100:.0f}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,59 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+import itertools
 from pydantic import BaseModel
-from typing import List, Optional
-from services.patient_filter_service import PatientFilterService
+from typing import List, Literal, Optional, Union
+from contextlib import asynccontextmanager
+from services.patient_filter_service import PATIENT_FIELDS, InvalidCursorError, PatientFilterService, row_to_patient
 from services.visualization_service import VisualizationService
+from services.age_binning import AgeBinning, InvalidAgeBinning
+from services.export_service import (
+    EXPORT_FORMATS, ExportsBusyError, PatientExportService, format_for_accept, gzip_chunks
+)
+from services.arrow_export import ARROW_FORMATS, arrow_available, serialize_rows
+from db.connection import close_pool, get_pool_stats
+from db.instrumentation import get_slow_query_log
+from db.executor import run_db, shutdown_executor
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, MetricsMiddleware
+
+from services.startup_snapshot import seed_filter_service, seed_visualization_service
 
+import hmac
 import os
+import threading
 
-wallet_path = os.environ.get("WALLET_PATH")
-print("WALLET_PATH:", wallet_path)
-if wallet_path and os.path.exists(wallet_path):
-    print("Archivos en wallet:", os.listdir(wallet_path))
-else:
-    print("No se encuentra la carpeta wallet en:", wallet_path)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    filter_service = get_filter_service()
+    visualization_service = get_visualization_service()
+    if os.getenv("FILTER_OPTIONS_REFRESH", "true").lower() == "true":
+        filter_service.options_cache.start_refresher()
+    if filter_service.columnar_cache is not None:
+        try:
+            await run_db(filter_service.columnar_cache.refresh)
+        except Exception as e:
+            print(f"No se pudo cargar el snapshot columnar al arrancar: {str(e)}")
+        filter_service.columnar_cache.start_refresher()
+    if visualization_service.use_cube and visualization_service.cube_cache.get_if_fresh() is None:
+        # Construir el cubo al arrancar (salvo que venga de la instantánea de
+        # arranque); si falla, se reintenta en la primera petición
+        try:
+            await run_db(visualization_service.cube_cache.refresh)
+        except Exception as e:
+            print(f"No se pudo construir el cubo de agregados al arrancar: {str(e)}")
+    if visualization_service.use_cube:
+        visualization_service.cube_cache.start_refresher()
+    yield
+    filter_service.options_cache.stop_refresher()
+    if filter_service.columnar_cache is not None:
+        filter_service.columnar_cache.stop_refresher()
+    visualization_service.cube_cache.stop_refresher()
+    # Esperar a las consultas en curso y liberar las conexiones del pool
+    shutdown_executor()
+    close_pool()
 
-app = FastAPI(title="Team Bingo Malackaton API", version="1.0.0")
+app = FastAPI(title="Team Bingo Malackaton API", version="1.0.0", lifespan=lifespan)
 
 # Configurar CORS
 app.add_middleware(
@@ -26,11 +65,92 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Metadatos de paginación de las respuestas Arrow/Parquet
+    # y modo de recuento de las visualizaciones
+    expose_headers=["X-Total-Records", "X-Current-Page", "X-Total-Pages", "X-Rows-Per-Page",
+                    "X-Has-More", "X-Total-Is-Exact", "X-Next-Cursor", "X-Prev-Cursor",
+                    "X-Count-Mode", "X-Count-Relative-Error"],
 )
+# Métricas de Prometheus por ruta (/metrics); se añade la última para medir también CORS
+app.add_middleware(MetricsMiddleware, router=app.router)
+
+# Respuesta rápida de /api/filter-patients sin modelos Pydantic por fila (FAST_JSON)
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+try:
+    import orjson  # noqa: F401 (opcional: ORJSONResponse lo necesita)
+    FastJSONResponse = ORJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+# Los servicios se crean en la primera petición que los usa, no al importar
+# el módulo (arranque en frío de la función serverless). El cerrojo es
+# reentrante porque un servicio puede crear otro (exportación -> filtros)
+_services = {}
+_services_lock = threading.RLock()
+
+def _lazy_service(name: str, factory):
+    service = _services.get(name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(name)
+            if service is None:
+                service = _services[name] = factory()
+    return service
+
+def _create_filter_service() -> PatientFilterService:
+    service = PatientFilterService()
+    seed_filter_service(service)  # Catálogo desde STARTUP_SNAPSHOT_PATH, si hay
+    return service
+
+def _create_visualization_service() -> VisualizationService:
+    service = VisualizationService()
+    seed_visualization_service(service)  # Cubo desde STARTUP_SNAPSHOT_PATH, si hay
+    return service
 
-# Instanciar los servicios
-filter_service = PatientFilterService()
-visualization_service = VisualizationService()
+def get_filter_service() -> PatientFilterService:
+    return _lazy_service("filter", _create_filter_service)
+
+def get_visualization_service() -> VisualizationService:
+    return _lazy_service("visualization", _create_visualization_service)
+
+def get_export_service() -> PatientExportService:
+    return _lazy_service("export", lambda: PatientExportService(get_filter_service()))
+
+def token_matches(given: Optional[str], expected: str) -> bool:
+    """Compara un token en tiempo constante"""
+    return given is not None and hmac.compare_digest(given.encode("utf-8"), expected.encode("utf-8"))
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """
+    Protege los endpoints de administración con ADMIN_TOKEN (cabecera X-Admin-Token)
+
+    Sin ADMIN_TOKEN los endpoints quedan deshabilitados (503), no abiertos.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=503, detail="Administración deshabilitada: ADMIN_TOKEN no definido")
+    if not token_matches(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Token de administración no válido")
+
+def require_metrics_token(authorization: Optional[str] = Header(None),
+                          x_admin_token: Optional[str] = Header(None)):
+    """
+    Protege /metrics con METRICS_TOKEN (Authorization: Bearer), que es lo que
+    envía Prometheus; sin METRICS_TOKEN se aplica la misma regla que a /api/admin/*
+    """
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if not metrics_token:
+        require_admin(x_admin_token)
+    elif not token_matches(authorization, f"Bearer {metrics_token}"):
+        raise HTTPException(status_code=403, detail="Token de métricas no válido")
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Comprueba si la cabecera If-None-Match del cliente incluye el ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
 
 # Modelos Pydantic
 class FilterRequest(BaseModel):
@@ -42,6 +162,8 @@ class FilterRequest(BaseModel):
     centros: List[str] = []
     page: int = 1
     rows_per_page: int = 20
+    cursor: Optional[str] = None  # Paginación por cursor (next_cursor/prev_cursor)
+    exact_count: bool = True  # False: sin recuento exacto, solo has_more
 
 class PatientRecord(BaseModel):
     id: int
@@ -61,32 +183,132 @@ class FilterResponse(BaseModel):
     current_page: int
     total_pages: int
     rows_per_page: int
+    has_more: bool = False
+    total_is_exact: bool = True
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+# Columnas que se copian tal cual en FAST_JSON si ya tienen el tipo del modelo
+_PATIENT_FIELD_TYPES = [(i, name, int if PatientRecord.model_fields[name].annotation is int else str)
+                        for i, name in enumerate(PATIENT_FIELDS)]
+
+def patient_rows_content(rows: List[tuple]) -> List[dict]:
+    """
+    Filas de la página como objetos PatientRecord ya serializados (FAST_JSON)
+
+    Las filas cuyos valores ya tienen el tipo del modelo se copian sin
+    Pydantic; las demás se validan con PatientRecord, así que se convierten o
+    fallan igual que en la respuesta con modelos.
+    """
+    data = []
+    for row in rows:
+        if all(type(row[i]) is kind for i, _name, kind in _PATIENT_FIELD_TYPES):
+            data.append({name: row[i] for i, name, _kind in _PATIENT_FIELD_TYPES})
+        else:
+            data.append(PatientRecord(**row_to_patient(row)).model_dump())
+    return data
+
+class BatchVisualizationRequest(BaseModel):
+    diagnoses: Union[Literal["all"], List[str]] = "all"  # Lista de CATEGORIA o "all"
+    charts: List[Literal["age_pyramid", "age_histogram", "gender_distribution", "pie_chart"]] = [
+        "age_pyramid", "age_histogram", "gender_distribution", "pie_chart"
+    ]
+    # Intervalos de edad: como mucho uno de bin_width, bin_edges o quantiles
+    bin_width: Optional[int] = None
+    bin_edges: Optional[List[int]] = None
+    quantiles: Optional[int] = None
+    as_of: Optional[str] = None  # AAAA, AAAA-MM-DD o "today" (por defecto VIS_AGE_AS_OF)
+
+def build_filter_dict(filters: FilterRequest) -> dict:
+    """Convierte el modelo Pydantic al diccionario de filtros de los servicios"""
+    return {
+        "comunidades": filters.comunidades,
+        "año_nacimiento_min": filters.año_nacimiento_min,
+        "año_nacimiento_max": filters.año_nacimiento_max,
+        "sexo": filters.sexo,
+        "diagnosticos": filters.diagnosticos,
+        "centros": filters.centros
+    }
 
 @app.get("/")
 async def root():
     return {"message": "Team Bingo Malackaton API - Funcionando correctamente"}
 
+def require_arrow():
+    """Devuelve 406 si se pide Arrow/Parquet y PyArrow no está instalado"""
+    if not arrow_available():
+        raise HTTPException(status_code=406, detail="Formato Arrow/Parquet no disponible (falta pyarrow)")
+
+async def filter_patients_arrow(filter_dict: dict, filters: FilterRequest, export_format: str) -> Response:
+    """
+    Página de pacientes filtrados en Arrow IPC o Parquet
+    Los metadatos de paginación viajan en cabeceras X-*
+    """
+    result = await run_db(
+        get_filter_service().get_filtered_page,
+        filter_dict,
+        filters.page,
+        filters.rows_per_page,
+        filters.cursor,
+        filters.exact_count
+    )
+    content = await run_db(serialize_rows, result["rows"], export_format)
+    headers = {
+        "X-Total-Records": str(result["total_records"]),
+        "X-Current-Page": str(result["current_page"]),
+        "X-Total-Pages": str(result["total_pages"]),
+        "X-Rows-Per-Page": str(result["rows_per_page"]),
+        "X-Has-More": str(result["has_more"]).lower(),
+        "X-Total-Is-Exact": str(result["total_is_exact"]).lower(),
+    }
+    if result["next_cursor"]:
+        headers["X-Next-Cursor"] = result["next_cursor"]
+    if result["prev_cursor"]:
+        headers["X-Prev-Cursor"] = result["prev_cursor"]
+    return Response(content=content, media_type=ARROW_FORMATS[export_format], headers=headers)
+
 @app.post("/api/filter-patients", response_model=FilterResponse)
-async def filter_patients(filters: FilterRequest):
+async def filter_patients(filters: FilterRequest, request: Request):
     """
     Filtra pacientes según los criterios especificados
+    Con Accept: application/vnd.apache.arrow.stream o application/vnd.apache.parquet
+    devuelve la página en ese formato
     """
+    arrow_format = format_for_accept(request.headers.get("accept"), ARROW_FORMATS)
+    if arrow_format:
+        require_arrow()
+    
     try:
         # Convertir el modelo Pydantic a diccionario
-        filter_dict = {
-            "comunidades": filters.comunidades,
-            "año_nacimiento_min": filters.año_nacimiento_min,
-            "año_nacimiento_max": filters.año_nacimiento_max,
-            "sexo": filters.sexo,
-            "diagnosticos": filters.diagnosticos,
-            "centros": filters.centros
-        }
+        filter_dict = build_filter_dict(filters)
+        
+        if arrow_format:
+            return await filter_patients_arrow(filter_dict, filters, arrow_format)
+        
+        if FAST_JSON:
+            # Mismo JSON que FilterResponse, serializado directamente desde las filas
+            page = await run_db(
+                get_filter_service().get_filtered_page,
+                filter_dict,
+                filters.page,
+                filters.rows_per_page,
+                filters.cursor,
+                filters.exact_count
+            )
+            content = FilterResponse(data=[], **{
+                field: page[field] for field in FilterResponse.model_fields if field != "data"
+            }).model_dump()
+            content["data"] = patient_rows_content(page["rows"])
+            return FastJSONResponse(content=content)
         
         # Usar el servicio para obtener datos filtrados
-        result = filter_service.get_filtered_patients(
+        result = await run_db(
+            get_filter_service().get_filtered_patients,
             filter_dict, 
             filters.page, 
-            filters.rows_per_page
+            filters.rows_per_page,
+            filters.cursor,
+            filters.exact_count
         )
         
         # Convertir datos a modelos Pydantic
@@ -97,80 +319,309 @@ async def filter_patients(filters: FilterRequest):
             total_records=result["total_records"],
             current_page=result["current_page"],
             total_pages=result["total_pages"],
-            rows_per_page=result["rows_per_page"]
+            rows_per_page=result["rows_per_page"],
+            has_more=result["has_more"],
+            total_is_exact=result["total_is_exact"],
+            next_cursor=result["next_cursor"],
+            prev_cursor=result["prev_cursor"]
         )
         
+    except InvalidCursorError as e:
+        # Solo el cursor es culpa del cliente; datos que no validan son un 500
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al filtrar datos: {str(e)}")
 
+@app.post("/api/filter-patients/export")
+async def export_patients(
+    filters: FilterRequest,
+    request: Request,
+    export_format: Optional[str] = Query(None, alias="format", pattern="^(csv|ndjson|arrow|parquet)$"),
+    gzip: bool = Query(False, description="Comprimir la respuesta con gzip")
+):
+    """
+    Exporta en streaming todos los pacientes que cumplen los filtros (CSV, NDJSON, Arrow o Parquet)
+    Sin ?format= se elige según la cabecera Accept (CSV por defecto)
+    Se ignoran los campos de paginación del filtro
+    """
+    if export_format is None:
+        export_format = format_for_accept(request.headers.get("accept")) or "csv"
+    if export_format in ARROW_FORMATS:
+        require_arrow()
+    
+    chunks = get_export_service().stream(build_filter_dict(filters), export_format)
+    if gzip:
+        chunks = gzip_chunks(chunks)
+    
+    try:
+        # Ejecutar la consulta antes de responder para poder devolver un 500 si falla
+        first_chunk = await run_db(next, chunks, b"")
+    except ExportsBusyError as e:
+        # Las descargas ocupan conexiones del pool: se rechazan antes de agotarlo
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al exportar datos: {str(e)}")
+    
+    extension = "arrows" if export_format == "arrow" else export_format
+    headers = {"Content-Disposition": f'attachment; filename="pacientes.{extension}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        itertools.chain([first_chunk], chunks),
+        media_type=EXPORT_FORMATS[export_format],
+        headers=headers
+    )
+
 @app.get("/api/patients", response_model=FilterResponse)
 async def get_patients(
+    request: Request,
     page: int = Query(1, ge=1),
-    rows_per_page: int = Query(20, ge=1, le=100)
+    rows_per_page: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursor de paginación"),
+    exact_count: bool = Query(True, description="False para omitir el recuento total")
 ):
     """
     Obtiene todos los pacientes con paginación (sin filtros)
     """
-    filters = FilterRequest(page=page, rows_per_page=rows_per_page)
-    return await filter_patients(filters)
+    filters = FilterRequest(page=page, rows_per_page=rows_per_page, cursor=cursor, exact_count=exact_count)
+    return await filter_patients(filters, request)
 
 @app.get("/api/filter-options")
-async def get_filter_options():
+async def get_filter_options(request: Request):
     """
     Obtiene las opciones disponibles para los filtros
+    Responde 304 si el cliente ya tiene la versión actual (If-None-Match)
     """
     try:
-        options = filter_service.get_filter_options()
-        return options
+        options, version = await run_db(get_filter_service().get_filter_options_with_version)
+        etag = f'"{version}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=options, headers=headers)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener opciones de filtro: {str(e)}")
 
+@app.post("/api/admin/filter-options/invalidate", dependencies=[Depends(require_admin)])
+async def invalidate_filter_options():
+    """
+    Invalida la caché de opciones de filtro
+    """
+    get_filter_service().options_cache.invalidate()
+    return {"invalidated": True}
+
+@app.get("/api/admin/filter-options/cache-stats", dependencies=[Depends(require_admin)])
+async def filter_options_cache_stats():
+    """
+    Estado de la caché de opciones de filtro
+    """
+    return get_filter_service().options_cache.stats()
+
+@app.post("/api/admin/cube/refresh", dependencies=[Depends(require_admin)])
+async def refresh_cube(full: bool = Query(False, description="Reconstruir desde cero en lugar de añadir las filas nuevas")):
+    """
+    Actualiza el cubo de agregados de visualización con las filas nuevas
+    (full=true lo reconstruye, p. ej. después de reconstruir la tabla normalizada)
+    """
+    try:
+        cube, _version = await run_db(get_visualization_service().cube_cache.refresh, full)
+        # Los resultados cacheados se calcularon con el cubo anterior
+        get_visualization_service().result_cache.clear()
+        return cube.stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al reconstruir el cubo: {str(e)}")
+
+@app.get("/api/admin/cube/stats", dependencies=[Depends(require_admin)])
+async def cube_stats():
+    """
+    Estado del cubo de agregados de visualización
+    """
+    return get_visualization_service().cube_cache.stats()
+
+@app.post("/api/admin/visualization/invalidate", dependencies=[Depends(require_admin)])
+async def invalidate_visualization_results():
+    """
+    Vacía la caché de resultados de visualización
+    """
+    get_visualization_service().result_cache.clear()
+    return {"invalidated": True}
+
+@app.get("/api/admin/visualization/cache-stats", dependencies=[Depends(require_admin)])
+async def visualization_cache_stats():
+    """
+    Estado de la caché de resultados de visualización
+    """
+    return get_visualization_service().result_cache.stats()
+
+@app.get("/api/admin/single-flight/stats", dependencies=[Depends(require_admin)])
+async def single_flight_stats():
+    """
+    Consultas ejecutadas frente a llamadas agrupadas en una ejecución en curso
+    """
+    return {
+        "patient_filter": get_filter_service().single_flight.stats(),
+        "visualization": get_visualization_service().single_flight.stats()
+    }
+
+@app.get("/api/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def slow_queries(limit: int = Query(50, ge=1, le=500)):
+    """
+    Consultas más lentas que SLOW_QUERY_MS, de la más reciente a la más antigua
+    """
+    slow_query_log = get_slow_query_log()
+    return {**slow_query_log.stats(), "queries": slow_query_log.entries(limit)}
+
+@app.get("/api/admin/pool-stats", dependencies=[Depends(require_admin)])
+async def pool_stats():
+    """
+    Estadísticas del pool de conexiones Oracle
+    """
+    return get_pool_stats()
+
+def collect_service_metrics():
+    """Estado del pool, las cachés y single-flight, leído en cada scrape de /metrics"""
+    pool = get_pool_stats()
+    if pool.get("initialized"):
+        yield ("db_pool_connections", "gauge", "Conexiones del pool por estado",
+               [("db_pool_connections", {"state": state}, pool[state]) for state in ("opened", "busy", "idle")])
+        yield ("db_pool_max_connections", "gauge", "Tamaño máximo del pool",
+               [("db_pool_max_connections", {}, pool["max"])])
+
+    caches = {
+        "filter_options": get_filter_service().options_cache.stats(),
+        "cube": get_visualization_service().cube_cache.stats(),
+        "visualization_results": get_visualization_service().result_cache.stats(),
+    }
+    if get_filter_service().columnar_cache is not None:
+        caches["columnar"] = get_filter_service().columnar_cache.stats()
+    for name, kind in (("hits", "hit"), ("misses", "miss"), ("stale_hits", "stale_hit")):
+        yield (f"cache_{name}_total", "counter", f"Accesos a caché ({kind})",
+               [(f"cache_{name}_total", {"cache": cache}, stats[name])
+                for cache, stats in caches.items() if name in stats])
+
+    flights = [get_filter_service().single_flight.stats(), get_visualization_service().single_flight.stats()]
+    yield ("single_flight_calls_total", "counter", "Llamadas ejecutadas o agrupadas en una ejecución en curso",
+           [("single_flight_calls_total", {"name": f["name"], "result": result}, f[result])
+            for f in flights for result in ("executed", "coalesced", "errors")])
+
+REGISTRY.register_collector(collect_service_metrics)
+
+@app.get("/metrics", dependencies=[Depends(require_metrics_token)], include_in_schema=False)
+async def metrics():
+    """
+    Métricas en formato de texto de Prometheus
+    """
+    return PlainTextResponse(REGISTRY.expose(), media_type=METRICS_CONTENT_TYPE)
+
 # Endpoints de visualización
-@app.get("/api/visualization/age-pyramid")
-async def get_age_pyramid(diagnosis: str = Query(..., description="Diagnóstico para filtrar")):
+def make_age_binning(bin_width: Optional[int], bin_edges: Optional[List[int]],
+                     quantiles: Optional[int], as_of: Optional[str]) -> AgeBinning:
+    """Intervalos de edad pedidos; 400 si la combinación no es válida"""
+    try:
+        return AgeBinning(width=bin_width, edges=bin_edges, quantiles=quantiles, as_of=as_of)
+    except InvalidAgeBinning as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def age_binning_params(
+    bin_width: Optional[int] = Query(None, ge=1, le=100, description="Ancho de los intervalos de edad en años"),
+    bin_edges: Optional[str] = Query(None, pattern=r"^\d+(,\d+)*$", description="Límites inferiores, p. ej. 0,18,65"),
+    quantiles: Optional[int] = Query(None, description="Número de intervalos con igual número de pacientes"),
+    as_of: Optional[str] = Query(None, description="Fecha de referencia de la edad: AAAA, AAAA-MM-DD o today"),
+) -> AgeBinning:
+    """Intervalos de edad de la pirámide y el histograma a partir de la query string"""
+    edges = [int(edge) for edge in bin_edges.split(",")] if bin_edges else None
+    return make_age_binning(bin_width, edges, quantiles, as_of)
+
+def visualization_cache_control() -> str:
+    """Cache-Control de las respuestas de visualización (navegador y CDN de Vercel)"""
+    cache = get_visualization_service().result_cache
+    return (f"public, max-age={int(cache.ttl)}, s-maxage={int(cache.ttl)}, "
+            f"stale-while-revalidate={int(cache.stale_ttl)}")
+
+async def visualization_response(request: Request, endpoint: str, diagnosis: str, error_message: str,
+                                 binning: Optional[AgeBinning] = None) -> Response:
     """
-    Obtiene datos para pirámide poblacional por diagnóstico
+    Responde un endpoint de visualización desde la caché de resultados
+    Devuelve 304 si el cliente ya tiene el resultado actual (If-None-Match)
     """
     try:
-        data = visualization_service.get_age_pyramid_data(diagnosis)
-        return data
+        data, version = await run_db(get_visualization_service().get_cached_result, endpoint, diagnosis, binning)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al generar pirámide poblacional: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{error_message}: {str(e)}")
+    
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": visualization_cache_control()}
+    # Con VIS_COUNT_MODE=approx los recuentos son estimaciones: se indica su error relativo típico
+    count_mode, relative_error = get_visualization_service().count_precision()
+    headers["X-Count-Mode"] = count_mode
+    if count_mode == "approx":
+        headers["X-Count-Relative-Error"] = f"{relative_error:.4f}"
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=data, headers=headers)
 
-@app.get("/api/visualization/age-histogram")
-async def get_age_histogram(diagnosis: str = Query(..., description="Diagnóstico para filtrar")):
+@app.get("/api/visualization/dashboard")
+async def get_dashboard(request: Request, diagnosis: str = Query(..., description="Diagnóstico para filtrar"),
+                        binning: AgeBinning = Depends(age_binning_params)):
     """
-    Obtiene datos para histograma de distribución de edades por diagnóstico
+    Obtiene pirámide, histograma, distribución por sexo y sectores de un diagnóstico
+    con una única consulta
+    """
+    return await visualization_response(request, "dashboard", diagnosis, "Error al generar panel de visualización",
+                                        binning)
+
+@app.post("/api/visualization/batch")
+async def get_visualization_batch(batch: BatchVisualizationRequest):
     """
+    Obtiene los gráficos pedidos de varios diagnósticos (o de todos) con una única agregación
+    Devuelve formato: {charts: [...], results: {diagnóstico: {gráfico: datos}}}
+    """
+    if batch.diagnoses != "all" and not batch.diagnoses:
+        raise HTTPException(status_code=400, detail="Debe indicar al menos un diagnóstico o \"all\"")
+    if not batch.charts:
+        raise HTTPException(status_code=400, detail="Debe indicar al menos un gráfico")
+    
+    diagnoses = None if batch.diagnoses == "all" else list(dict.fromkeys(d.strip() for d in batch.diagnoses))
+    charts = list(dict.fromkeys(batch.charts))
+    binning = make_age_binning(batch.bin_width, batch.bin_edges, batch.quantiles, batch.as_of)
     try:
-        data = visualization_service.get_age_histogram_data(diagnosis)
-        return data
+        return await run_db(get_visualization_service().get_batch_data, diagnoses, charts, binning)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al generar histograma de edades: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al generar visualizaciones por lotes: {str(e)}")
+
+@app.get("/api/visualization/age-pyramid")
+async def get_age_pyramid(request: Request, diagnosis: str = Query(..., description="Diagnóstico para filtrar"),
+                          binning: AgeBinning = Depends(age_binning_params)):
+    """
+    Obtiene datos para pirámide poblacional por diagnóstico
+    """
+    return await visualization_response(request, "age-pyramid", diagnosis, "Error al generar pirámide poblacional",
+                                        binning)
+
+@app.get("/api/visualization/age-histogram")
+async def get_age_histogram(request: Request, diagnosis: str = Query(..., description="Diagnóstico para filtrar"),
+                            binning: AgeBinning = Depends(age_binning_params)):
+    """
+    Obtiene datos para histograma de distribución de edades por diagnóstico
+    """
+    return await visualization_response(request, "age-histogram", diagnosis, "Error al generar histograma de edades",
+                                        binning)
 
 @app.get("/api/visualization/gender-distribution")
-async def get_gender_distribution(diagnosis: str = Query(..., description="Diagnóstico para filtrar")):
+async def get_gender_distribution(request: Request, diagnosis: str = Query(..., description="Diagnóstico para filtrar")):
     """
     Obtiene datos para distribución por sexo por diagnóstico
     """
-    try:
-        data = visualization_service.get_gender_distribution_data(diagnosis)
-        return data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al generar distribución por sexo: {str(e)}")
+    return await visualization_response(request, "gender-distribution", diagnosis, "Error al generar distribución por sexo")
 
 @app.get("/api/visualization/pie-chart")
-async def get_pie_chart(diagnosis: str = Query(..., description="Diagnóstico para filtrar")):
+async def get_pie_chart(request: Request, diagnosis: str = Query(..., description="Diagnóstico para filtrar")):
     """
     Obtiene datos para diagrama de sectores por sexo
     Devuelve formato: {"Hombres": int, "Mujeres": int}
     """
-    try:
-        data = visualization_service.get_pie_chart_data(diagnosis)
-        return data
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al generar diagrama de sectores: {str(e)}")
+    return await visualization_response(request, "pie-chart", diagnosis, "Error al generar diagrama de sectores")
 
 if __name__ == "__main__":
     import uvicorn
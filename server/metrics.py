@@ -0,0 +1,258 @@
+"""
+Métricas del proceso en formato de texto de Prometheus (/metrics)
+
+Implementación mínima sin dependencias: contadores, gauges e histogramas con
+etiquetas. Los valores que ya llevan los servicios (estadísticas del pool y
+de las cachés) no se duplican: se leen al generar la respuesta mediante
+colectores registrados con register_collector. Está fuera de db y de
+services porque lo usan las dos capas.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets por defecto de los clientes de Prometheus
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Las fases de BD (adquirir conexión, leer filas) suelen ser de submilisegundos
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Métrica con etiquetas; cada combinación de valores es una serie"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(_Metric):
+    """Contador que solo crece"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._series.items()]
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja (peticiones en curso)"""
+
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in self._series.items()]
+
+
+class Histogram(_Metric):
+    """Histograma acumulado por buckets, con suma y número de observaciones"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[Sample]:
+        samples: List[Sample] = []
+        with self._lock:
+            series_items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in series_items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class Registry:
+    """Conjunto de métricas del proceso y colectores que se leen al exponerlas"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]) -> None:
+        """
+        Registra una función que devuelve métricas calculadas al exponerlas
+
+        La función devuelve tuplas (nombre, tipo, descripción, muestras).
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def clear_collectors(self) -> None:
+        with self._lock:
+            self._collectors.clear()
+
+    def expose(self) -> str:
+        """Texto en formato de exposición de Prometheus"""
+        families = [(m.name, m.kind, m.documentation, m.samples()) for m in self._metrics.values()]
+        for collector in list(self._collectors):
+            try:
+                families.extend(collector())
+            except Exception as e:
+                print(f"Error recogiendo métricas: {str(e)}")
+
+        lines: List[str] = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso", ("method", "route")))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP hasta enviar el último byte",
+    ("method", "route")))
+DB_EXECUTOR_SECONDS = REGISTRY.register(Histogram(
+    "db_executor_seconds", "Espera en cola y ejecución de las llamadas al executor de BD",
+    ("phase",), buckets=DB_BUCKETS))
+DB_PHASE_SECONDS = REGISTRY.register(Histogram(
+    "db_query_phase_seconds", "Tiempo de BD por método de servicio: adquirir conexión, ejecutar y leer filas",
+    ("service", "phase"), buckets=DB_BUCKETS))
+DB_STATEMENT_CACHE = REGISTRY.register(Counter(
+    "db_statement_cache_total", "Ejecuciones que aciertan o fallan en la caché de sentencias (estimación)",
+    ("result",)))
+DB_ROWS = REGISTRY.register(Counter(
+    "db_rows_fetched_total", "Filas leídas de la base de datos por método de servicio", ("service",)))
+
+
+def observe_db_phase(service: Optional[str], phase: str, seconds: float) -> None:
+    """Registra la duración de una fase de BD (acquire, execute o fetch)"""
+    DB_PHASE_SECONDS.observe(seconds, service=service or "unknown", phase=phase)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide cada petición HTTP
+
+    La ruta se etiqueta con la plantilla (/api/visualization/dashboard), no
+    con la URL, para no crear una serie por parámetro. Se resuelve con las
+    rutas de router antes de atender la petición, porque las peticiones en
+    curso también llevan la etiqueta. La duración llega hasta el último
+    trozo del cuerpo, así que incluye el streaming de las exportaciones.
+    """
+
+    def __init__(self, app: Any, router: Any = None):
+        self.app = app
+        self.router = router
+
+    def route_template(self, scope: Dict[str, Any]) -> str:
+        """Plantilla de la ruta que atenderá la petición, o unmatched"""
+        if self.router is None:
+            return "unmatched"
+        from starlette.routing import Match
+
+        partial = None
+        for route in self.router.routes:
+            match, _child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", None) or "unmatched"
+            if match == Match.PARTIAL and partial is None:
+                # Método no permitido: Starlette responde con esta ruta (405)
+                partial = route
+        return getattr(partial, "path", None) or "unmatched"
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        route_path = self.route_template(scope)
+        HTTP_IN_FLIGHT.inc(method=method, route=route_path)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec(method=method, route=route_path)
+            HTTP_DURATION.observe(time.perf_counter() - start, method=method, route=route_path)
+            HTTP_REQUESTS.inc(method=method, route=route_path, status=status["code"])
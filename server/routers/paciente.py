@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
-from db.connection import connection
+from db.connection import get_connection
+from db.executor import run_db
 
 router = APIRouter(prefix="/pacientes", tags=["pacientes"])
 
@@ -13,6 +14,13 @@ class PacientesFiltro(BaseModel):
     page: Optional[int] = 1
     rowsPerPage: Optional[int] = 20
 
+def _ejecutar_consulta(query: str, params: dict) -> List[dict]:
+    """Ejecuta la consulta con una conexión del pool y devuelve filas como diccionarios"""
+    with get_connection() as connection, connection.cursor() as cursor:
+        cursor.execute(query, params)
+        cols = [col[0] for col in cursor.description]
+        return [dict(zip(cols, row)) for row in cursor.fetchall()]
+
 @router.post("/filter")
 async def filtrar_pacientes(filtros: PacientesFiltro):
     """
@@ -70,11 +78,8 @@ async def filtrar_pacientes(filtros: PacientesFiltro):
         params["offset"] = offset
         params["rows"] = filtros.rowsPerPage
 
-        # Ejecutar consulta
-        with connection.cursor() as cursor:
-            cursor.execute(query, params)
-            cols = [col[0] for col in cursor.description]
-            data = [dict(zip(cols, row)) for row in cursor.fetchall()]
+        # Ejecutar consulta fuera del event loop
+        data = await run_db(_ejecutar_consulta, query, params)
 
         # Contar total de registros para paginación (opcional: simplificado)
         total = len(data)  # Ideal sería hacer un COUNT real con los mismos filtros
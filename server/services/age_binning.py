@@ -0,0 +1,210 @@
+"""
+Agrupación de edades configurable para la pirámide y el histograma
+
+Los pacientes llegan agrupados por año de nacimiento y sexo (cubo o
+consulta), así que la edad se calcula una vez por año de nacimiento
+distinto, no por fila, y cambiar el ancho de los intervalos, los límites o
+la fecha de referencia no requiere volver a leer los episodios.
+"""
+import bisect
+import datetime
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+# Intervalos por defecto: cada 10 años hasta '80+'
+DEFAULT_BIN_WIDTH = 10
+DEFAULT_MAX_AGE = 80
+
+# Año de referencia histórico de las visualizaciones (VIS_AGE_AS_OF lo cambia)
+DEFAULT_AS_OF = "2024"
+
+# Intervalo de las edades negativas (nacidos después del año de referencia)
+NEGATIVE_BUCKET = -1
+
+MAX_QUANTILES = 20
+
+
+class InvalidAgeBinning(ValueError):
+    """Opciones de intervalos de edad o fecha de referencia no válidas (error del cliente)"""
+
+
+# Pacientes únicos contados al grano de cada gráfico:
+#   labels: etiquetas de los intervalos de edad, en orden
+#   pyramid: {(índice de intervalo, sexo): n}, sin años desconocidos ni edades negativas
+#   histogram: {índice de intervalo: n} de todos los sexos; las edades negativas van al último
+#   gender: {sexo: n} de los pacientes con año de nacimiento conocido
+#   pie: {sexo: n} de todos los pacientes
+ChartCounts = Dict[str, Any]
+
+# Pacientes de un grupo: conjunto de claves o sketch HyperLogLog
+Patients = TypeVar("Patients")
+
+
+def parse_as_of(value: Optional[str]) -> int:
+    """
+    Año de referencia para calcular la edad
+
+    Acepta un año ("2024"), una fecha ISO ("2024-06-30") o "today". La tabla
+    solo guarda el año de nacimiento, así que de la fecha se usa el año.
+    """
+    value = (value or os.getenv("VIS_AGE_AS_OF") or DEFAULT_AS_OF).strip().lower()
+    if value == "today":
+        return datetime.date.today().year
+    try:
+        if len(value) == 4:
+            return int(value)
+        return datetime.date.fromisoformat(value).year
+    except ValueError:
+        raise InvalidAgeBinning(f"Fecha de referencia no válida: {value} (use AAAA, AAAA-MM-DD o today)")
+
+
+def interval_labels(edges: Sequence[int]) -> List[str]:
+    """Etiquetas de los intervalos: '0-9', '10-19'... y el último abierto ('80+')"""
+    labels = []
+    for lower, upper in zip(edges, edges[1:]):
+        labels.append(str(lower) if upper - 1 == lower else f"{lower}-{upper - 1}")
+    labels.append(f"{edges[-1]}+")
+    return labels
+
+
+def quantile_edges(age_counts: Dict[int, int], quantiles: int) -> List[int]:
+    """
+    Límites inferiores de intervalos con aproximadamente el mismo número de pacientes
+
+    Args:
+        age_counts: Pacientes por edad (solo edades >= 0)
+        quantiles: Número de intervalos pedido; puede haber menos si muchas
+            personas comparten edad
+    """
+    if not age_counts:
+        return list(range(0, DEFAULT_MAX_AGE + 1, DEFAULT_BIN_WIDTH))
+    ages = sorted(age_counts)
+    total = sum(age_counts.values())
+    edges = [ages[0]]
+    cumulative = 0
+    q = 1
+    for age in ages:
+        # La edad que alcanza el cuantil q abre el intervalo siguiente
+        while q < quantiles and cumulative >= total * q / quantiles:
+            if age > edges[-1]:
+                edges.append(age)
+            q += 1
+        cumulative += age_counts[age]
+    return edges
+
+
+class AgeBinning:
+    """
+    Intervalos de edad y fecha de referencia de una visualización
+
+    Se indica como mucho una forma de agrupar: ancho fijo (width), límites
+    inferiores explícitos (edges) o cuantiles (quantiles). Sin ninguna, los
+    intervalos son los históricos de 10 años hasta '80+'. Los pacientes más
+    jóvenes que el primer límite no aparecen en la pirámide ni en el
+    histograma.
+    """
+
+    def __init__(self, width: Optional[int] = None, edges: Optional[Sequence[int]] = None,
+                 quantiles: Optional[int] = None, as_of: Optional[str] = None):
+        if sum(option is not None for option in (width, edges, quantiles)) > 1:
+            raise InvalidAgeBinning("Indique solo uno de bin_width, bin_edges o quantiles")
+        if width is not None and width < 1:
+            raise InvalidAgeBinning("bin_width debe ser al menos 1")
+        if edges is not None:
+            edges = [int(edge) for edge in edges]
+            if not edges or edges[0] < 0 or any(b <= a for a, b in zip(edges, edges[1:])):
+                raise InvalidAgeBinning("bin_edges debe ser una lista creciente de edades no negativas")
+        if quantiles is not None and not 2 <= quantiles <= MAX_QUANTILES:
+            raise InvalidAgeBinning(f"quantiles debe estar entre 2 y {MAX_QUANTILES}")
+
+        self.width = DEFAULT_BIN_WIDTH if width is None and edges is None and quantiles is None else width
+        self.edges = edges
+        self.quantiles = quantiles
+        self.as_of_year = parse_as_of(as_of)
+
+    @property
+    def key(self) -> Tuple:
+        """Clave de caché: mismas opciones, mismo resultado"""
+        return (self.width, tuple(self.edges) if self.edges else None, self.quantiles, self.as_of_year)
+
+    @property
+    def needs_age_counts(self) -> bool:
+        """True si los límites dependen de la distribución de edades (cuantiles)"""
+        return self.quantiles is not None
+
+    def edges_for(self, age_counts: Optional[Dict[int, int]] = None) -> List[int]:
+        """
+        Límites inferiores de los intervalos
+
+        Args:
+            age_counts: Pacientes por edad; solo se usa con cuantiles
+        """
+        if self.edges is not None:
+            return list(self.edges)
+        if self.quantiles is not None:
+            return quantile_edges({age: c for age, c in (age_counts or {}).items() if age >= 0}, self.quantiles)
+        return list(range(0, DEFAULT_MAX_AGE + 1, self.width))
+
+    def bucket(self, year: Optional[int], edges: Sequence[int]) -> Optional[int]:
+        """
+        Índice del intervalo de un año de nacimiento
+
+        NEGATIVE_BUCKET si la edad es negativa y None si el año no se conoce
+        o la edad queda por debajo del primer límite.
+        """
+        if year is None:
+            return None
+        age = self.as_of_year - year
+        if age < 0:
+            return NEGATIVE_BUCKET
+        if age < edges[0]:
+            return None
+        return bisect.bisect_right(edges, age) - 1
+
+    def chart_counts(self, year_sex: Dict[Tuple[Optional[int], int], Patients],
+                     union_count: Callable[[List[Patients]], int]) -> ChartCounts:
+        """
+        Recuentos de cada gráfico a partir de los pacientes por (año de nacimiento, sexo)
+
+        Un paciente con episodios de distinto año de nacimiento o sexo está
+        en varios grupos, así que cada recuento es el tamaño de la unión de
+        los grupos que le corresponden, no la suma de sus tamaños.
+
+        Args:
+            year_sex: Pacientes (claves o sketch) por año de nacimiento y sexo
+            union_count: Pacientes distintos en la unión de varios grupos
+        """
+        age_counts = None
+        if self.needs_age_counts:
+            by_year: Dict[int, List[Patients]] = {}
+            for (year, _sexo), patients in year_sex.items():
+                if year is not None:
+                    by_year.setdefault(year, []).append(patients)
+            age_counts = {self.as_of_year - year: union_count(group) for year, group in by_year.items()}
+        edges = self.edges_for(age_counts)
+        last = len(edges) - 1
+
+        groups: Dict[str, Dict[Any, List[Patients]]] = {"pyramid": {}, "histogram": {}, "gender": {}, "pie": {}}
+        bucket_by_year: Dict[int, Optional[int]] = {}
+        for (year, sexo), patients in year_sex.items():
+            groups["pie"].setdefault(sexo, []).append(patients)
+            if year is None:
+                continue
+            groups["gender"].setdefault(sexo, []).append(patients)
+            if year not in bucket_by_year:
+                bucket_by_year[year] = self.bucket(year, edges)
+            bucket = bucket_by_year[year]
+            if bucket is None:
+                continue
+            if bucket == NEGATIVE_BUCKET:
+                groups["histogram"].setdefault(last, []).append(patients)
+            else:
+                groups["histogram"].setdefault(bucket, []).append(patients)
+                groups["pyramid"].setdefault((bucket, sexo), []).append(patients)
+
+        counts: ChartCounts = {
+            chart: {key: union_count(group) for key, group in by_key.items()}
+            for chart, by_key in groups.items()
+        }
+        counts["labels"] = interval_labels(edges)
+        return counts
@@ -0,0 +1,204 @@
+"""
+Cubo de agregados precalculado para las visualizaciones
+"""
+import copy
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+from services.age_binning import AgeBinning, ChartCounts
+from services.hyperloglog import HyperLogLog, relative_error as sketch_relative_error
+
+# Dimensiones del cubo, en el orden de las claves de cada celda
+DIMENSIONS = ("categoria", "sexo", "anio_nacimiento", "comunidad", "centro")
+
+CubeKey = Tuple[Optional[str], int, Optional[int], Optional[str], Optional[str]]
+
+# Pacientes de una celda: claves PACIENTE_KEY (exacto) o sketch (aproximado)
+PatientSet = Union[Set[int], HyperLogLog]
+
+
+class AggregateCube:
+    """
+    Pacientes únicos por (categoría, sexo, año de nacimiento, comunidad, centro)
+
+    El año de nacimiento, y no un grupo de edad, es la dimensión de edad: los
+    intervalos y la fecha de referencia se eligen al consultar
+    (services.age_binning) sin reconstruir el cubo.
+
+    Cada celda guarda los pacientes de sus episodios, no solo cuántos son:
+    un paciente (NOMBRE + CENTRO) puede tener episodios con distinta
+    comunidad, sexo o año de nacimiento y estar en varias celdas, así que
+    las agregaciones unen los pacientes de las celdas en lugar de sumar sus
+    recuentos. En modo exacto son conjuntos de claves; en modo aproximado
+    (from_sketches), sketches HyperLogLog, que se unen igual y ocupan como
+    mucho 2^precision bytes por celda. relative_error es el error relativo
+    típico de los recuentos (0 en modo exacto).
+
+    high_water_mark es el mayor ID de la tabla incluido en el cubo; merge
+    une los pacientes de las filas posteriores sin recalcular el resto.
+    """
+
+    def __init__(self, patients: Dict[CubeKey, PatientSet], precision: Optional[int] = None,
+                 high_water_mark: Optional[int] = None):
+        self.patients = patients
+        self.precision = precision
+        self.relative_error = sketch_relative_error(precision) if precision is not None else 0.0
+        self.high_water_mark = high_water_mark
+        self.built_at = time.time()
+        self.cells = {key: self._count(group) for key, group in patients.items()}
+        self.version = f"{int(self.built_at * 1000):x}-{len(self.cells)}"
+
+        # Pacientes por categoría, año y sexo: es lo que piden los gráficos
+        self._year_sex_by_categoria: Dict[Optional[str], Dict[Tuple[Optional[int], int], PatientSet]] = {}
+        for (categoria, anio, sexo), group in self._union_by((0, 2, 1), patients.items()).items():
+            self._year_sex_by_categoria.setdefault(categoria, {})[(anio, sexo)] = group
+
+    @property
+    def count_mode(self) -> str:
+        """'approx' si los recuentos son estimaciones de sketches, 'exact' si no"""
+        return "exact" if self.precision is None else "approx"
+
+    @property
+    def mergeable(self) -> bool:
+        """True si se le pueden añadir filas nuevas (se sabe hasta qué ID llega)"""
+        return self.high_water_mark is not None
+
+    @classmethod
+    def from_sketches(cls, sketches: Dict[CubeKey, HyperLogLog], precision: int,
+                      high_water_mark: Optional[int] = None) -> "AggregateCube":
+        """
+        Construye un cubo aproximado a partir de un sketch de pacientes por celda
+
+        El error relativo declarado es el de la precisión de los sketches:
+        aunque las celdas pequeñas se cuentan exactas, las agregaciones
+        combinan sketches y pueden no serlo.
+        """
+        return cls(sketches, precision=precision, high_water_mark=high_water_mark)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Sequence[Any]], precision: Optional[int] = None,
+                  high_water_mark: Optional[int] = None) -> "AggregateCube":
+        """
+        Construye el cubo a partir de las filas de to_rows
+
+        Args:
+            rows: Filas (categoria, sexo, anio_nacimiento, comunidad, centro,
+                pacientes), con la lista de claves o el estado del sketch
+            precision: Precisión de los sketches, o None en modo exacto
+        """
+        if precision is None:
+            patients = {tuple(row[:5]): set(row[5]) for row in rows}
+        else:
+            patients = {tuple(row[:5]): HyperLogLog.from_state(row[5]) for row in rows}
+        return cls(patients, precision=precision, high_water_mark=high_water_mark)
+
+    def to_rows(self) -> List[List[Any]]:
+        """Celdas serializables en JSON: (categoria, sexo, anio_nacimiento, comunidad, centro, pacientes)"""
+        if self.precision is None:
+            return [[*key, sorted(group)] for key, group in self.patients.items()]
+        return [[*key, group.to_state()] for key, group in self.patients.items()]
+
+    def _count(self, group: PatientSet) -> int:
+        return len(group) if self.precision is None else group.count()
+
+    def _union(self, groups: Sequence[PatientSet]) -> PatientSet:
+        """Pacientes de la unión de varios grupos (sin modificarlos)"""
+        if self.precision is None:
+            return set().union(*groups)
+        merged = HyperLogLog(self.precision)
+        for group in groups:
+            merged.merge(group)
+        return merged
+
+    def union_count(self, groups: Sequence[PatientSet]) -> int:
+        """Pacientes distintos de la unión de varios grupos"""
+        if len(groups) == 1:
+            return self._count(groups[0])
+        return self._count(self._union(groups))
+
+    def _union_by(self, positions: Sequence[int], items: Iterable[Tuple[CubeKey, PatientSet]]) -> Dict[Tuple, PatientSet]:
+        """Une los pacientes de las celdas agrupados por las posiciones indicadas"""
+        grouped: Dict[Tuple, List[PatientSet]] = {}
+        for key, group in items:
+            grouped.setdefault(tuple(key[i] for i in positions), []).append(group)
+        return {key: groups[0] if len(groups) == 1 else self._union(groups) for key, groups in grouped.items()}
+
+    def merge(self, patients: Dict[CubeKey, PatientSet], high_water_mark: int) -> "AggregateCube":
+        """
+        Cubo con las filas añadidas después de high_water_mark
+
+        Args:
+            patients: Pacientes de las filas nuevas por celda (claves o
+                sketches, como los del cubo); se unen a los existentes
+            high_water_mark: Mayor ID incluido en las filas nuevas
+
+        Este cubo no se modifica (las peticiones en curso lo siguen usando):
+        el nuevo comparte las celdas no tocadas y solo copia las que cambian,
+        así que el coste depende del delta.
+        """
+        cube = copy.copy(self)
+        cube.patients = dict(self.patients)
+        cube.cells = dict(self.cells)
+        cube.high_water_mark = high_water_mark
+        cube.built_at = time.time()
+        cube._year_sex_by_categoria = dict(self._year_sex_by_categoria)
+        copied = set()
+
+        for key, group in patients.items():
+            cube.patients[key] = self._union([self.patients[key], group]) if key in self.patients else group
+            cube.cells[key] = self._count(cube.patients[key])
+            categoria, sexo, anio = key[0], key[1], key[2]
+            if categoria not in copied:
+                cube._year_sex_by_categoria[categoria] = dict(cube._year_sex_by_categoria.get(categoria, {}))
+                copied.add(categoria)
+            by_year_sex = cube._year_sex_by_categoria[categoria]
+            current = by_year_sex.get((anio, sexo))
+            by_year_sex[(anio, sexo)] = self._union([current, group]) if current is not None else group
+
+        cube.version = f"{int(cube.built_at * 1000):x}-{len(cube.cells)}"
+        return cube
+
+    def year_sex_counts(self, categoria: str) -> Dict[Tuple[Optional[int], int], int]:
+        """Pacientes únicos por (año de nacimiento, sexo) de una categoría"""
+        return {key: self._count(group) for key, group in self._year_sex_by_categoria.get(categoria, {}).items()}
+
+    def chart_counts(self, categoria: str, binning: AgeBinning) -> ChartCounts:
+        """Recuentos de cada gráfico de una categoría, uniendo pacientes por intervalo y sexo"""
+        return binning.chart_counts(self._year_sex_by_categoria.get(categoria, {}), self.union_count)
+
+    def categorias(self):
+        """Categorías presentes en el cubo"""
+        return sorted(c for c in self._year_sex_by_categoria if c is not None)
+
+    def rollup(self, dimensions: Sequence[str], **filters: Any) -> Dict[Tuple, int]:
+        """
+        Pacientes únicos agregando el cubo sobre las dimensiones indicadas
+
+        Args:
+            dimensions: Dimensiones que se conservan (subconjunto de DIMENSIONS)
+            **filters: Valor exacto, o colección de valores, por dimensión
+
+        Returns:
+            Diccionario {tupla de valores de las dimensiones: recuento}
+        """
+        positions = [DIMENSIONS.index(d) for d in dimensions]
+        checks = []
+        for dimension, value in filters.items():
+            allowed = set(value) if isinstance(value, (list, tuple, set, frozenset)) else {value}
+            checks.append((DIMENSIONS.index(dimension), allowed))
+
+        selected = ((key, group) for key, group in self.patients.items()
+                    if all(key[i] in allowed for i, allowed in checks))
+        return {key: self._count(group) for key, group in self._union_by(positions, selected).items()}
+
+    def stats(self) -> Dict[str, Any]:
+        """Tamaño y antigüedad del cubo"""
+        return {
+            "cells": len(self.cells),
+            "categorias": len(self._year_sex_by_categoria),
+            "built_at": self.built_at,
+            "version": self.version,
+            "count_mode": self.count_mode,
+            "relative_error": self.relative_error,
+            "high_water_mark": self.high_water_mark,
+        }
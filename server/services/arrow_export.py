@@ -0,0 +1,155 @@
+"""
+Serialización de cohortes de pacientes en Arrow IPC y Parquet (opcional, requiere PyArrow)
+
+PyArrow se importa en la primera petición que lo necesita, no al importar el
+módulo: tarda decenas de milisegundos y alarga el arranque en frío.
+"""
+import threading
+from typing import Any, Iterable, Iterator, List, Sequence
+
+from db.pacientes_normalizados import parse_mixed_date
+from services.patient_filter_service import PATIENT_FIELDS
+
+pa = None
+pq = None
+_pyarrow_checked = False
+_pyarrow_lock = threading.Lock()
+
+ARROW_FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _load_pyarrow() -> bool:
+    global pa, pq, _pyarrow_checked
+    if not _pyarrow_checked:
+        with _pyarrow_lock:
+            if not _pyarrow_checked:
+                try:
+                    import pyarrow
+                    import pyarrow.ipc  # noqa: F401 (registra pa.ipc)
+                    import pyarrow.parquet
+                    pa, pq = pyarrow, pyarrow.parquet
+                except ImportError:  # PyArrow es opcional: sin él solo hay CSV/NDJSON/JSON
+                    pass
+                _pyarrow_checked = True
+    return pa is not None
+
+
+def arrow_available() -> bool:
+    """Indica si PyArrow está instalado (y lo importa)"""
+    return _load_pyarrow()
+
+
+def patient_schema() -> "pa.Schema":
+    """Esquema Arrow de un paciente, con los mismos nombres que PatientRecord"""
+    _load_pyarrow()
+    return pa.schema([
+        ("id", pa.int64()),
+        ("nombre", pa.string()),
+        ("comunidad", pa.string()),
+        ("año_nacimiento", pa.int32()),
+        ("sexo", pa.string()),
+        ("diagnostico", pa.string()),
+        ("centro", pa.string()),
+        ("fecha_ingreso", pa.date32()),
+        ("fecha_fin_contacto", pa.date32()),
+        ("estancia_dias", pa.int32()),
+    ])
+
+
+def rows_to_table(rows: Sequence[tuple]) -> "pa.Table":
+    """
+    Construye una tabla Arrow columna a columna a partir de filas de pacientes
+
+    Las filas tienen el orden de PATIENT_FIELDS con fechas en texto, como las
+    de get_filtered_page; no se crea ningún diccionario por fila.
+    """
+    _load_pyarrow()
+    columns: List[List[Any]] = [list(column) for column in zip(*rows)] or [[] for _ in PATIENT_FIELDS]
+    columns[7] = [parse_mixed_date(v) for v in columns[7]]
+    columns[8] = [parse_mixed_date(v) for v in columns[8]]
+    columns[9] = [int(v) if v else 0 for v in columns[9]]
+    return pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, patient_schema())],
+        schema=patient_schema()
+    )
+
+
+def conform_batch(data_frame: Any) -> "pa.Table":
+    """
+    Convierte un lote de fetch_df_batches al esquema de pacientes
+
+    Las columnas llegan en el orden de la consulta tipada, con nombres en
+    mayúsculas y tipos de Oracle (NUMBER, DATE); se renombran y se convierten.
+    """
+    _load_pyarrow()
+    table = pa.table(data_frame).rename_columns(PATIENT_FIELDS)
+    return table.cast(patient_schema(), safe=False)
+
+
+class _ChunkSink:
+    """Fichero en memoria que entrega lo escrito por trozos"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        """Devuelve y descarta lo escrito desde la última llamada"""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _open_writer(sink: _ChunkSink, export_format: str):
+    _load_pyarrow()
+    if export_format == "parquet":
+        return pq.ParquetWriter(sink, patient_schema(), compression="zstd")
+    return pa.ipc.new_stream(sink, patient_schema())
+
+
+def stream_tables(tables: Iterable["pa.Table"], export_format: str) -> Iterator[bytes]:
+    """
+    Escribe los lotes como un stream Arrow IPC o un fichero Parquet, por trozos
+
+    El escritor se abre tras recibir el primer lote, así que los errores de
+    la consulta aparecen al pedir el primer trozo, igual que en CSV/NDJSON.
+    Cada lote de Parquet se escribe como un row group.
+    """
+    sink = _ChunkSink()
+    writer = None
+    for table in tables:
+        if writer is None:
+            writer = _open_writer(sink, export_format)
+        if table.num_rows:
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    if writer is None:
+        writer = _open_writer(sink, export_format)
+    writer.close()
+    yield sink.drain()
+
+
+def serialize_rows(rows: Sequence[tuple], export_format: str) -> bytes:
+    """Serializa una página de filas en Arrow IPC o Parquet"""
+    return b"".join(stream_tables([rows_to_table(rows)], export_format))
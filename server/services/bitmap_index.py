@@ -0,0 +1,177 @@
+"""
+Índices bitmap por dimensión sobre el snapshot columnar
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from services.columnar_engine import ColumnarSnapshot, sexo_codes_for
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount_words(words: np.ndarray) -> np.ndarray:
+    """Número de bits activos de cada palabra de 64 bits"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).astype(np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int64)
+
+
+class Bitmap:
+    """
+    Conjunto de filas como bitset empaquetado en palabras de 64 bits
+
+    El bit i corresponde a la fila i del snapshot, así que el orden de los
+    bits activos es el orden (NOMBRE, ID) del resultado.
+    """
+
+    __slots__ = ("words", "size")
+
+    def __init__(self, words: np.ndarray, size: int):
+        self.words = words
+        self.size = size
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "Bitmap":
+        """Empaqueta una máscara booleana"""
+        packed = np.packbits(mask, bitorder="little")
+        padded = np.zeros(((packed.size + 7) // 8) * 8, dtype=np.uint8)
+        padded[:packed.size] = packed
+        return cls(padded.view(np.uint64), mask.size)
+
+    @classmethod
+    def full(cls, size: int) -> "Bitmap":
+        """Bitmap con todas las filas"""
+        return cls.from_mask(np.ones(size, dtype=bool))
+
+    @classmethod
+    def empty(cls, size: int) -> "Bitmap":
+        """Bitmap sin filas"""
+        return cls(np.zeros((size + 63) // 64, dtype=np.uint64), size)
+
+    @classmethod
+    def union(cls, bitmaps: Iterable["Bitmap"], size: int) -> "Bitmap":
+        """OR de varios bitmaps"""
+        result = cls.empty(size)
+        for bitmap in bitmaps:
+            result = result | bitmap
+        return result
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        return Bitmap(self.words & other.words, self.size)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        return Bitmap(self.words | other.words, self.size)
+
+    def and_not(self, other: "Bitmap") -> "Bitmap":
+        """Filas de self que no están en other"""
+        return Bitmap(self.words & ~other.words, self.size)
+
+    def cardinality(self) -> int:
+        """Número de filas del conjunto"""
+        return int(_popcount_words(self.words).sum())
+
+    def rank(self, position: int) -> int:
+        """Número de filas del conjunto anteriores a position"""
+        word, bit = divmod(position, 64)
+        before = int(_popcount_words(self.words[:word]).sum())
+        if bit and word < self.words.size:
+            partial = self.words[word:word + 1] & np.uint64((1 << bit) - 1)
+            before += int(_popcount_words(partial)[0])
+        return before
+
+    def select(self, start_rank: int, count: int) -> np.ndarray:
+        """
+        Posiciones de las filas con rango [start_rank, start_rank + count)
+
+        Solo se desempaquetan las palabras que contienen esas filas.
+        """
+        if count <= 0:
+            return np.empty(0, dtype=np.int64)
+        cumulative = np.cumsum(_popcount_words(self.words))
+        first = int(np.searchsorted(cumulative, start_rank, side="right"))
+        last = int(np.searchsorted(cumulative, start_rank + count, side="left")) + 1
+        if first >= self.words.size:
+            return np.empty(0, dtype=np.int64)
+        bits = np.unpackbits(self.words[first:last].view(np.uint8), bitorder="little")
+        positions = np.flatnonzero(bits) + first * 64
+        skip = start_rank - (int(cumulative[first - 1]) if first > 0 else 0)
+        return positions[skip:skip + count]
+
+
+class BitmapIndex:
+    """
+    Un bitmap por valor distinto de comunidad, sexo, diagnóstico y centro,
+    más bitmaps acumulados por año de nacimiento para los rangos
+    """
+
+    def __init__(self, snapshot: ColumnarSnapshot):
+        self.snapshot = snapshot
+        self.size = snapshot.row_count
+        self.comunidad = self._build(snapshot.comunidad.dictionary, snapshot.comunidad.codes)
+        self.categoria = self._build(snapshot.categoria.dictionary, snapshot.categoria.codes)
+        self.centro = self._build(snapshot.centro.dictionary, snapshot.centro.codes)
+        self.sexo = {code: Bitmap.from_mask(snapshot.sexo == code) for code in (1, 2, 3)}
+
+        # anio_hasta[y] = filas con año de nacimiento <= y
+        self.years = np.unique(snapshot.anio)
+        self.anio_hasta = [Bitmap.from_mask(snapshot.anio <= year) for year in self.years]
+
+    @staticmethod
+    def _build(dictionary: np.ndarray, codes: np.ndarray) -> Dict[str, Bitmap]:
+        return {value: Bitmap.from_mask(codes == code) for code, value in enumerate(dictionary)}
+
+    def _years_up_to(self, year: int) -> Bitmap:
+        """Filas con año de nacimiento <= year"""
+        i = int(np.searchsorted(self.years, year, side="right")) - 1
+        return self.anio_hasta[i] if i >= 0 else Bitmap.empty(self.size)
+
+    def evaluate(self, filters: Dict[str, Any]) -> Bitmap:
+        """Resuelve la combinación de filtros con operaciones AND/OR sobre bitmaps"""
+        result = Bitmap.full(self.size)
+
+        if filters.get('comunidades'):
+            wanted = {c.upper() for c in filters['comunidades']}
+            result = result & Bitmap.union(
+                (b for value, b in self.comunidad.items() if value.upper() in wanted), self.size
+            )
+        if filters.get('año_nacimiento_max') is not None:
+            result = result & self._years_up_to(filters['año_nacimiento_max'])
+        if filters.get('año_nacimiento_min') is not None:
+            result = result.and_not(self._years_up_to(filters['año_nacimiento_min'] - 1))
+        if filters.get('sexo'):
+            result = result & Bitmap.union((self.sexo[c] for c in set(sexo_codes_for(filters['sexo']))), self.size)
+        if filters.get('diagnosticos'):
+            result = result & Bitmap.union(
+                (self.categoria[d] for d in filters['diagnosticos'] if d in self.categoria), self.size
+            )
+        if filters.get('centros'):
+            result = result & Bitmap.union(
+                (self.centro[c] for c in filters['centros'] if c in self.centro), self.size
+            )
+
+        return result
+
+    def fetch_page(self, filters: Dict[str, Any], page: int, rows_per_page: int,
+                   cursor_key: Optional[Tuple[str, int]], direction: Optional[str],
+                   exact_count: bool) -> Tuple[List[tuple], Optional[int]]:
+        """
+        Página de resultados a partir del bitmap de filtros
+
+        Returns:
+            Tupla (filas en el orden de recorrido, total o None si no se cuenta)
+        """
+        matches = self.evaluate(filters)
+        limit = rows_per_page + 1
+
+        if direction == "next":
+            start = matches.rank(self.snapshot.position_of(cursor_key, after=True))
+            positions = matches.select(start, limit)
+        elif direction == "prev":
+            end = matches.rank(self.snapshot.position_of(cursor_key, after=False))
+            positions = matches.select(max(0, end - limit), min(limit, end))[::-1]
+        else:
+            positions = matches.select((page - 1) * rows_per_page, limit)
+
+        rows = [self.snapshot.row(int(p)) for p in positions]
+        return rows, (matches.cardinality() if exact_count else None)
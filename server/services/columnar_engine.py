@@ -0,0 +1,171 @@
+"""
+Motor columnar en memoria para el filtrado de pacientes (opcional, requiere NumPy)
+"""
+import bisect
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se consulta siempre a Oracle
+    np = None
+
+SEXO_LABELS = {1: 'Hombre', 2: 'Mujer'}
+
+
+def numpy_available() -> bool:
+    """Indica si NumPy está instalado"""
+    return np is not None
+
+
+def sexo_codes_for(sexos: Sequence[str]) -> List[int]:
+    """Convierte las etiquetas de sexo del filtro a códigos (1=Hombre, 2=Mujer, 3=Otros)"""
+    codes = []
+    for sexo in sexos:
+        if sexo.lower() == 'hombre':
+            codes.append(1)
+        elif sexo.lower() == 'mujer':
+            codes.append(2)
+        else:  # Otros
+            codes.append(3)
+    return codes
+
+
+class DictionaryColumn:
+    """Columna de texto codificada como diccionario de valores + códigos enteros"""
+
+    def __init__(self, values: Sequence[str]):
+        self.dictionary, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+        self.codes = codes.astype(np.int32)
+        self._index = {value: code for code, value in enumerate(self.dictionary)}
+
+    def codes_for(self, values: Sequence[str], transform=None) -> "np.ndarray":
+        """Códigos de los valores pedidos; con transform se compara valor transformado"""
+        if transform is None:
+            found = [self._index[v] for v in values if v in self._index]
+        else:
+            wanted = {transform(v) for v in values}
+            found = [code for code, v in enumerate(self.dictionary) if transform(v) in wanted]
+        return np.asarray(found, dtype=np.int32)
+
+    def mask(self, values: Sequence[str], transform=None) -> "np.ndarray":
+        """Máscara booleana de las filas cuyo valor está en values"""
+        return np.isin(self.codes, self.codes_for(values, transform))
+
+    def __getitem__(self, row: int) -> str:
+        return self.dictionary[self.codes[row]]
+
+
+class ColumnarSnapshot:
+    """
+    Copia columnar de las filas filtrables, ordenada por (NOMBRE, ID)
+
+    Las filas se guardan en el mismo orden que la consulta paginada, de modo
+    que la posición en el snapshot es la posición en el resultado.
+    """
+
+    def __init__(self, rows: Sequence[Sequence[Any]]):
+        rows = sorted(rows, key=lambda r: (r[1], r[0]))
+        self.row_count = len(rows)
+        self.loaded_at = time.time()
+        self.version = f"{int(self.loaded_at * 1000):x}-{self.row_count}"
+
+        self.ids = np.fromiter((int(r[0]) for r in rows), dtype=np.int64, count=self.row_count)
+        self.nombres = [r[1] for r in rows]
+        self.comunidad = DictionaryColumn([r[2] for r in rows])
+        self.anio = np.fromiter((int(r[3]) for r in rows), dtype=np.int32, count=self.row_count)
+        self.sexo = np.fromiter((int(r[4]) if r[4] is not None else 3 for r in rows),
+                                dtype=np.int8, count=self.row_count)
+        self.categoria = DictionaryColumn([r[5] for r in rows])
+        self.centro = DictionaryColumn([r[6] for r in rows])
+        self.fecha_ingreso = [r[7] for r in rows]
+        self.fecha_fin_contacto = [r[8] for r in rows]
+        self.estancia_dias = [r[9] for r in rows]
+
+        # Índice bitmap opcional (services.bitmap_index), asignado tras la carga
+        self.bitmap_index = None
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[Any]]) -> "ColumnarSnapshot":
+        """
+        Construye el snapshot a partir de filas (ID, NOMBRE, COMUNIDAD, AÑO,
+        SEXO_COD, CATEGORIA, CENTRO, FECHA_INGRESO, FECHA_FIN, ESTANCIA)
+        """
+        return cls(rows)
+
+    def filter_mask(self, filters: Dict[str, Any]) -> "np.ndarray":
+        """Evalúa la misma semántica que build_filter_conditions como máscara vectorizada"""
+        mask = np.ones(self.row_count, dtype=bool)
+
+        if filters.get('comunidades'):
+            mask &= self.comunidad.mask(filters['comunidades'], transform=str.upper)
+        if filters.get('año_nacimiento_min') is not None:
+            mask &= self.anio >= filters['año_nacimiento_min']
+        if filters.get('año_nacimiento_max') is not None:
+            mask &= self.anio <= filters['año_nacimiento_max']
+        if filters.get('sexo'):
+            mask &= np.isin(self.sexo, sexo_codes_for(filters['sexo']))
+        if filters.get('diagnosticos'):
+            mask &= self.categoria.mask(filters['diagnosticos'])
+        if filters.get('centros'):
+            mask &= self.centro.mask(filters['centros'])
+
+        return mask
+
+    def position_of(self, cursor_key: Tuple[str, int], after: bool) -> int:
+        """Posición de la clave (NOMBRE, ID) en el orden del snapshot"""
+        nombre, patient_id = cursor_key
+        lo = bisect.bisect_left(self.nombres, nombre)
+        hi = bisect.bisect_right(self.nombres, nombre, lo)
+        side = 'right' if after else 'left'
+        return lo + int(np.searchsorted(self.ids[lo:hi], patient_id, side=side))
+
+    def row(self, position: int) -> tuple:
+        """Fila en el mismo formato que la consulta de Oracle"""
+        return (
+            int(self.ids[position]),
+            self.nombres[position],
+            self.comunidad[position],
+            int(self.anio[position]),
+            SEXO_LABELS.get(int(self.sexo[position]), 'Otros'),
+            self.categoria[position],
+            self.centro[position],
+            self.fecha_ingreso[position],
+            self.fecha_fin_contacto[position],
+            self.estancia_dias[position],
+        )
+
+    def select_page(self, matches: "np.ndarray", page: int, rows_per_page: int,
+                    cursor_key: Optional[Tuple[str, int]], direction: Optional[str]) -> "np.ndarray":
+        """
+        Posiciones de la página (más una fila de control) dentro de las filas que cumplen el filtro
+
+        Args:
+            matches: Posiciones ordenadas de las filas que cumplen el filtro
+        """
+        limit = rows_per_page + 1
+        if direction == "next":
+            start = int(np.searchsorted(matches, self.position_of(cursor_key, after=True)))
+            return matches[start:start + limit]
+        if direction == "prev":
+            end = int(np.searchsorted(matches, self.position_of(cursor_key, after=False)))
+            return matches[max(0, end - limit):end][::-1]
+        offset = (page - 1) * rows_per_page
+        return matches[offset:offset + limit]
+
+    def fetch_page(self, filters: Dict[str, Any], page: int, rows_per_page: int,
+                   cursor_key: Optional[Tuple[str, int]], direction: Optional[str],
+                   exact_count: bool) -> Tuple[List[tuple], Optional[int]]:
+        """
+        Página de resultados resuelta en memoria
+
+        Returns:
+            Tupla (filas en el orden de recorrido, total o None si no se cuenta)
+        """
+        if self.bitmap_index is not None:
+            return self.bitmap_index.fetch_page(filters, page, rows_per_page, cursor_key, direction, exact_count)
+
+        matches = np.flatnonzero(self.filter_mask(filters))
+        positions = self.select_page(matches, page, rows_per_page, cursor_key, direction)
+        rows = [self.row(int(p)) for p in positions]
+        return rows, (int(matches.size) if exact_count else None)
@@ -0,0 +1,166 @@
+"""
+Exportación en streaming de cohortes de pacientes filtrados
+"""
+import csv
+import io
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from db.backend import SQLITE, get_backend_name
+from db.connection import get_pool_config
+from services.arrow_export import ARROW_FORMATS, conform_batch, rows_to_table, stream_tables
+from services.patient_filter_service import PATIENT_FIELDS, PatientFilterService, row_to_patient
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    **ARROW_FORMATS,
+}
+
+
+def format_for_accept(accept: Optional[str], formats: Iterable[str] = EXPORT_FORMATS) -> Optional[str]:
+    """
+    Formato de exportación pedido en la cabecera Accept, o None si no hay ninguno conocido
+
+    Se respeta el orden de la cabecera; los parámetros (q=...) se ignoran.
+    """
+    if not accept:
+        return None
+    media_types = {EXPORT_FORMATS[f].split(";")[0]: f for f in formats}
+    for item in accept.split(","):
+        media_type = item.split(";")[0].strip().lower()
+        if media_type in media_types:
+            return media_types[media_type]
+    return None
+
+
+class ExportsBusyError(RuntimeError):
+    """Todas las exportaciones simultáneas permitidas están en curso"""
+
+
+class PatientExportService:
+    """Servicio para exportar pacientes filtrados sin cargarlos en memoria"""
+
+    def __init__(self, filter_service: PatientFilterService):
+        self.filter_service = filter_service
+        # Filas por viaje de red del cursor (EXPORT_ARRAYSIZE)
+        self.arraysize = int(os.getenv("EXPORT_ARRAYSIZE", "5000"))
+        # Cada exportación ocupa una conexión del pool durante toda la descarga;
+        # se deja al menos una libre para el resto de endpoints
+        default_slots = max(1, get_pool_config()["max"] - 1)
+        self.max_concurrent = int(os.getenv("EXPORT_MAX_CONCURRENT") or default_slots)
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+
+    def iter_row_batches(self, filters: Dict[str, Any]) -> Iterator[List[tuple]]:
+        """
+        Recorre el resultado filtrado en lotes desde un cursor de Oracle
+
+        La consulta se ejecuta antes del primer lote, así que los errores de
+        conexión o de SQL aparecen al pedir el primer elemento.
+        """
+        base_query, params = self.filter_service.build_patient_query(filters)
+        connection = self.filter_service.get_connection()
+        cursor = connection.cursor()
+
+        try:
+            cursor.arraysize = self.arraysize
+            cursor.prefetchrows = self.arraysize + 1
+            cursor.execute(f"{base_query} ORDER BY NOMBRE, ID", params)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            connection.close()
+
+    def iter_arrow_batches(self, filters: Dict[str, Any]) -> Iterator[Any]:
+        """
+        Recorre el resultado filtrado como tablas Arrow tipadas
+
+        Usa fetch_df_batches de python-oracledb, que llena los buffers Arrow
+        directamente desde el protocolo sin crear objetos Python por fila.
+        """
+        if get_backend_name() == SQLITE:
+            # SQLite no tiene fetch_df_batches: las columnas se construyen desde las filas
+            for rows in self.iter_row_batches(filters):
+                yield rows_to_table(rows)
+            return
+
+        base_query, params = self.filter_service.build_patient_query(filters, typed=True)
+        connection = self.filter_service.get_connection()
+        try:
+            for data_frame in connection.fetch_df_batches(
+                f"{base_query} ORDER BY NOMBRE, ID", params, size=self.arraysize
+            ):
+                yield conform_batch(data_frame)
+        finally:
+            connection.close()
+
+    def stream(self, filters: Dict[str, Any], export_format: str = "csv") -> Iterator[bytes]:
+        """
+        Genera el fichero de exportación por trozos
+
+        El hueco de exportación se reserva al pedir el primer trozo y se
+        libera al terminar o cerrar el generador.
+
+        Args:
+            filters: Filtros a aplicar
+            export_format: 'csv', 'ndjson', 'arrow' o 'parquet'
+
+        Raises:
+            ExportsBusyError: Al pedir el primer trozo, si ya hay
+                EXPORT_MAX_CONCURRENT exportaciones en curso
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ExportsBusyError("Demasiadas exportaciones en curso, inténtelo más tarde")
+        try:
+            if export_format in ARROW_FORMATS:
+                yield from stream_tables(self.iter_arrow_batches(filters), export_format)
+                return
+            batches = self.iter_row_batches(filters)
+            if export_format == "ndjson":
+                yield from self._ndjson_chunks(batches)
+            else:
+                yield from self._csv_chunks(batches)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _csv_chunks(batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header_sent = False
+        for rows in batches:
+            if not header_sent:
+                writer.writerow(PATIENT_FIELDS)
+                header_sent = True
+            for row in rows:
+                patient = row_to_patient(row)
+                writer.writerow([patient[field] for field in PATIENT_FIELDS])
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+        if not header_sent:
+            writer.writerow(PATIENT_FIELDS)
+            yield buffer.getvalue().encode("utf-8")
+
+    @staticmethod
+    def _ndjson_chunks(batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+        for rows in batches:
+            lines = [json.dumps(row_to_patient(row), ensure_ascii=False, default=str) for row in rows]
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Comprime en gzip un flujo de trozos sin acumularlo en memoria"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,72 @@
+"""
+Catálogo de opciones de filtro que se puede ampliar con las filas nuevas
+"""
+from typing import Any, Dict, Iterable, Optional, Sequence
+
+SEXOS = ['Hombre', 'Mujer', 'Otros']
+
+# Rango de años que se muestra si no hay ningún año de nacimiento
+DEFAULT_BIRTH_YEAR_RANGE = (1950, 2005)
+
+
+class FilterCatalog:
+    """
+    Valores distintos de los filtros y rango de años de nacimiento
+
+    Las listas de valores son uniones de conjuntos y el rango de años un
+    mínimo y un máximo, así que añadir filas nuevas (merge) da lo mismo que
+    volver a consultar toda la tabla. high_water_mark es el mayor ID incluido
+    (None si no se conoce y hay que recargar).
+    """
+
+    def __init__(self, comunidades: Iterable[str], diagnosticos: Iterable[str], centros: Iterable[str],
+                 year_min: Optional[int], year_max: Optional[int], high_water_mark: Optional[int] = None):
+        self.comunidades = frozenset(comunidades)
+        self.diagnosticos = frozenset(diagnosticos)
+        self.centros = frozenset(centros)
+        self.year_min = year_min
+        self.year_max = year_max
+        self.high_water_mark = high_water_mark
+        self.options = self._build_options()
+
+    @classmethod
+    def from_options(cls, options: Dict[str, Any], high_water_mark: Optional[int] = None) -> "FilterCatalog":
+        """Catálogo a partir de una respuesta de /api/filter-options (instantánea de arranque)"""
+        years = options.get("año_nacimiento_range") or {}
+        return cls(options["comunidades"], options["diagnosticos"], options["centros"],
+                   years.get("min"), years.get("max"), high_water_mark)
+
+    def _build_options(self) -> Dict[str, Any]:
+        """Respuesta de /api/filter-options, con las listas ordenadas"""
+        return {
+            "comunidades": sorted(self.comunidades),
+            "sexos": list(SEXOS),
+            "diagnosticos": sorted(self.diagnosticos),
+            "centros": sorted(self.centros),
+            "año_nacimiento_range": {
+                "min": int(self.year_min) if self.year_min else DEFAULT_BIRTH_YEAR_RANGE[0],
+                "max": int(self.year_max) if self.year_max else DEFAULT_BIRTH_YEAR_RANGE[1]
+            }
+        }
+
+    def merge(self, rows: Iterable[Sequence[Any]], high_water_mark: int) -> "FilterCatalog":
+        """
+        Catálogo ampliado con filas (comunidad, categoría, centro, año de nacimiento)
+
+        Este catálogo no se modifica.
+        """
+        comunidades = set(self.comunidades)
+        diagnosticos = set(self.diagnosticos)
+        centros = set(self.centros)
+        year_min, year_max = self.year_min, self.year_max
+        for comunidad, categoria, centro, anio in rows:
+            if comunidad is not None:
+                comunidades.add(comunidad)
+            if categoria is not None:
+                diagnosticos.add(categoria)
+            if centro is not None:
+                centros.add(centro)
+            if anio is not None:
+                year_min = anio if year_min is None else min(year_min, anio)
+                year_max = anio if year_max is None else max(year_max, anio)
+        return FilterCatalog(comunidades, diagnosticos, centros, year_min, year_max, high_water_mark)
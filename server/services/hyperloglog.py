@@ -0,0 +1,146 @@
+"""
+Sketch HyperLogLog para recuentos aproximados de pacientes únicos
+
+Cada sketch resume un conjunto de claves de paciente en 2^precision
+registros; dos sketches se combinan sin perder precisión (unión de
+conjuntos), así que se pueden guardar por celda del cubo y agregar después.
+Mientras el conjunto es pequeño se guardan los hashes tal cual y el
+recuento es exacto.
+"""
+import base64
+import hashlib
+import math
+from typing import Any, Dict, Iterable, Optional, Set
+
+DEFAULT_PRECISION = 12
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(value: Any) -> int:
+    """Hash de 64 bits bien distribuido (splitmix64 para enteros)"""
+    if isinstance(value, int):
+        z = (value + 0x9E3779B97F4A7C15) & _MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return z ^ (z >> 31)
+    digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def relative_error(precision: int = DEFAULT_PRECISION) -> float:
+    """Error relativo típico (una desviación estándar) de un sketch con esta precisión"""
+    return 1.04 / math.sqrt(1 << precision)
+
+
+class HyperLogLog:
+    """
+    Estimador de cardinalidad combinable
+
+    Args:
+        precision: Bits del índice de registro (4-16); error relativo típico
+            1.04 / sqrt(2^precision), 1,6 % con el valor por defecto
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError("La precisión de HyperLogLog debe estar entre 4 y 16")
+        self.precision = precision
+        self.m = 1 << precision
+        # Representación dispersa (hashes exactos) hasta que ocupa más que los registros
+        self._sparse: Optional[Set[int]] = set()
+        self._registers: Optional[bytearray] = None
+
+    @property
+    def is_exact(self) -> bool:
+        """True mientras el sketch guarda los hashes y el recuento es exacto"""
+        return self._sparse is not None
+
+    def _to_dense(self) -> None:
+        self._registers = bytearray(self.m)
+        for h in self._sparse:
+            self._add_dense(h)
+        self._sparse = None
+
+    def _add_dense(self, h: int) -> None:
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & _MASK64
+        rank = 64 - self.precision + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def add(self, value: Any) -> None:
+        """Añade una clave"""
+        h = hash64(value)
+        if self._sparse is not None:
+            self._sparse.add(h)
+            if len(self._sparse) > self.m // 8:
+                self._to_dense()
+        else:
+            self._add_dense(h)
+
+    def update(self, values: Iterable[Any]) -> "HyperLogLog":
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Une otro sketch de la misma precisión a este"""
+        if other.precision != self.precision:
+            raise ValueError("Solo se pueden combinar sketches de la misma precisión")
+        if other._sparse is not None:
+            if self._sparse is not None:
+                self._sparse |= other._sparse
+                if len(self._sparse) > self.m // 8:
+                    self._to_dense()
+            else:
+                for h in other._sparse:
+                    self._add_dense(h)
+            return self
+        if self._sparse is not None:
+            self._to_dense()
+        registers = self._registers
+        for i, rank in enumerate(other._registers):
+            if rank > registers[i]:
+                registers[i] = rank
+        return self
+
+    def copy(self) -> "HyperLogLog":
+        sketch = HyperLogLog(self.precision)
+        sketch._sparse = set(self._sparse) if self._sparse is not None else None
+        sketch._registers = bytearray(self._registers) if self._registers is not None else None
+        return sketch
+
+    def to_state(self) -> Dict[str, Any]:
+        """Estado serializable en JSON (hashes mientras es disperso, registros en base64 si no)"""
+        if self._sparse is not None:
+            return {"precision": self.precision, "hashes": sorted(self._sparse)}
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self._registers)).decode("ascii")}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "HyperLogLog":
+        """Sketch a partir de to_state"""
+        sketch = cls(state["precision"])
+        if "registers" in state:
+            sketch._sparse = None
+            sketch._registers = bytearray(base64.b64decode(state["registers"]))
+        else:
+            sketch._sparse = set(state["hashes"])
+        return sketch
+
+    def count(self) -> int:
+        """Número estimado de claves distintas"""
+        if self._sparse is not None:
+            return len(self._sparse)
+        m = self.m
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Corrección para cardinalidades pequeñas (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def relative_error(self) -> float:
+        """Error relativo típico de este sketch (0 mientras es exacto)"""
+        return 0.0 if self.is_exact else relative_error(self.precision)
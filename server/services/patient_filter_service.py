@@ -1,56 +1,158 @@
 """
 Servicios para el filtrado de datos de pacientes
 """
-from typing import List, Dict, Any, Tuple
-import oracledb
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple
+import base64
+import json
 import os
-from dotenv import load_dotenv
+from db.backend import fetch_first_sql, in_list_binds, offset_fetch_sql
+from db.connection import get_connection
+from db.pacientes_normalizados import PATIENT_TABLE, read_high_water_mark
+from services.filter_catalog import FilterCatalog
+from services.snapshot_cache import SnapshotCache
+from services.single_flight import SingleFlight
+
+if TYPE_CHECKING:
+    from services.columnar_engine import ColumnarSnapshot
+
+# Filas que se consideran en el filtrado de pacientes
+BASE_CONDITIONS = """
+    ANIO_NACIMIENTO IS NOT NULL 
+    AND NOMBRE IS NOT NULL
+    AND COMUNIDAD_AUTONOMA IS NOT NULL
+    AND CATEGORIA IS NOT NULL
+    AND CENTRO_RECODIFICADO IS NOT NULL
+"""
+
+# Fechas y estancia tal como se muestran en la API (texto original)
+TEXT_COLUMNS = """FECHA_DE_INGRESO as fecha_ingreso,
+            FECHA_DE_FIN_CONTACTO as fecha_fin_contacto,
+            ESTANCIA_DIAS as estancia_dias"""
+
+# Fechas y estancia tipadas (columnas normalizadas)
+TYPED_COLUMNS = """FECHA_INGRESO_DT as fecha_ingreso,
+            FECHA_FIN_CONTACTO_DT as fecha_fin_contacto,
+            CAST(COALESCE(ESTANCIA_DIAS, 0) AS NUMBER(10)) as estancia_dias"""
+
+
+class InvalidCursorError(ValueError):
+    """Cursor de paginación mal formado o manipulado (error del cliente)"""
+
+
+def encode_cursor(nombre: str, patient_id: int, direction: str, total: Optional[int] = None) -> str:
+    """
+    Codifica la posición (NOMBRE, ID), la dirección y el total conocido en un cursor opaco
+    
+    El total se calcula una vez, en la petición por número de página, y viaja
+    en los cursores para que las páginas siguientes no vuelvan a contar.
+    """
+    values = [nombre, int(patient_id), direction]
+    if total is not None:
+        values.append(int(total))
+    payload = json.dumps(values, ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, str, Optional[int]]:
+    """
+    Decodifica un cursor generado por encode_cursor
+    
+    Returns:
+        Tupla (nombre, id, dirección, total o None si no se contó)
+    
+    Raises:
+        InvalidCursorError: Si el cursor no es válido
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded).decode("utf-8"))
+        nombre, patient_id, direction = values[:3]
+        patient_id = int(patient_id)
+        total = int(values[3]) if len(values) == 4 else None
+    except Exception:
+        raise InvalidCursorError("Cursor de paginación no válido")
+    if len(values) > 4 or direction not in ("next", "prev") or not isinstance(nombre, str):
+        raise InvalidCursorError("Cursor de paginación no válido")
+    return nombre, patient_id, direction, total
+
+
+# Campos de cada paciente en la respuesta, en el orden de las columnas de la consulta
+PATIENT_FIELDS = [
+    "id", "nombre", "comunidad", "año_nacimiento", "sexo", "diagnostico",
+    "centro", "fecha_ingreso", "fecha_fin_contacto", "estancia_dias"
+]
+
+
+def row_to_patient(row: tuple) -> Dict[str, Any]:
+    """Convierte una fila de la consulta de pacientes al formato de la API"""
+    return {
+        "id": row[0],  # ID estable de la tabla normalizada
+        "nombre": row[1],  # NOMBRE
+        "comunidad": row[2],  # COMUNIDAD_AUTONOMA
+        "año_nacimiento": row[3],  # ANIO_NACIMIENTO
+        "sexo": row[4],  # sexo convertido
+        "diagnostico": row[5],  # CATEGORIA
+        "centro": row[6],  # CENTRO_RECODIFICADO
+        "fecha_ingreso": row[7],  # FECHA_DE_INGRESO
+        "fecha_fin_contacto": row[8],  # FECHA_DE_FIN_CONTACTO
+        "estancia_dias": int(row[9]) if row[9] else 0  # ESTANCIA_DIAS
+    }
+
+
+def filters_key(filters: Dict[str, Any]) -> tuple:
+    """Clave normalizada de unos filtros (el orden de las listas no cambia el resultado)"""
+    return tuple(sorted(
+        (name, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value)
+        for name, value in filters.items()
+        if value not in (None, [], ())
+    ))
 
-# Cargar variables de entorno
-dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
-load_dotenv(dotenv_path)
 
 class PatientFilterService:
     """Servicio para filtrar datos de pacientes"""
     
     def __init__(self):
-        # Cargar variables de entorno aquí también
-        dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-        load_dotenv(dotenv_path)
-        
-        self.wallet_path = os.getenv("WALLET_PATH")
-        
-        # Si wallet_path contiene ${PWD}, reemplazarlo con el directorio actual
-        if self.wallet_path and "${PWD}" in self.wallet_path:
-            current_dir = os.path.dirname(os.path.dirname(__file__))  # Subir un nivel desde services/
-            self.wallet_path = self.wallet_path.replace("${PWD}", current_dir)
-        
-        self.wallet_password = os.getenv("WALLET_PASSWORD")
-        self.user = os.getenv("DB_USER")
-        self.user_password = os.getenv("DB_PASSWORD")
-        self.dsn = os.getenv("DB_TNS_ALIAS")
-        
-        # Debug: mostrar las credenciales (sin password)
-        print(f"🔑 Configuración de DB:")
-        print(f"   Usuario: {self.user}")
-        print(f"   DSN: {self.dsn}")
-        print(f"   Wallet Path: {self.wallet_path}")
-        print(f"   Wallet Password: {'***' if self.wallet_password else 'No configurado'}")
+        # Consultas idénticas concurrentes se ejecutan una sola vez
+        self.single_flight = SingleFlight("patient-filter")
+        
+        # Catálogo de opciones cacheado (FILTER_OPTIONS_TTL en segundos); los
+        # refrescos solo leen las filas añadidas (AGGREGATE_FULL_REFRESH)
+        self.options_cache = SnapshotCache(
+            lambda: self.single_flight.do("filter-options", self.load_filter_catalog),
+            ttl=float(os.getenv("FILTER_OPTIONS_TTL", "300")),
+            name="filter-options",
+            version_fn=lambda catalog: SnapshotCache.compute_version(catalog.options),
+            updater=self.update_filter_catalog,
+            full_refresh=float(os.getenv("AGGREGATE_FULL_REFRESH", "86400"))
+        )
+        
+        # Motor columnar opcional en memoria (requiere NumPy, que solo se
+        # importa si está activado)
+        self.columnar_cache = None
+        if os.getenv("COLUMNAR_ENGINE", "false").lower() == "true":
+            from services.columnar_engine import numpy_available
+            if numpy_available():
+                self.use_bitmap_index = os.getenv("BITMAP_INDEX", "true").lower() == "true"
+                self.columnar_cache = SnapshotCache(
+                    self.load_columnar_snapshot,
+                    ttl=float(os.getenv("COLUMNAR_TTL", "300")),
+                    name="columnar-snapshot",
+                    version_fn=lambda snapshot: snapshot.version
+                )
+            else:
+                print("COLUMNAR_ENGINE activado pero NumPy no está instalado; se usará Oracle")
     
     def get_connection(self):
-        """Establece conexión con la base de datos Oracle"""
-        return oracledb.connect(
-            user=self.user,
-            password=self.user_password,
-            dsn=self.dsn,
-            config_dir=self.wallet_path,
-            wallet_location=self.wallet_path,
-            wallet_password=self.wallet_password
-        )
+        """Obtiene una conexión del pool compartido de Oracle"""
+        return get_connection()
     
     def build_filter_conditions(self, filters: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
         """
         Construye las condiciones SQL y parámetros basados en los filtros
+
+        Las listas IN se rellenan a potencia de dos (in_list_binds) para que
+        haya pocos textos SQL distintos y se reutilicen las sentencias
+        preparadas.
         
         Args:
             filters: Diccionario con los filtros a aplicar
@@ -63,33 +165,16 @@ class PatientFilterService:
         
         # Filtro por comunidades autónomas
         if filters.get('comunidades') and len(filters['comunidades']) > 0:
-            placeholders = []
-            for i, comunidad in enumerate(filters['comunidades']):
-                param_name = f"comunidad_{i}"
-                placeholders.append(f":{param_name}")
-                params[param_name] = comunidad
-            conditions.append(f"UPPER(COMUNIDAD_AUTONOMA) IN ({','.join(f'UPPER({p})' for p in placeholders)})")
-        
-        # Filtro por año de nacimiento - necesitamos extraer el año de FECHA_DE_NACIMIENTO
-        # y corregir para años de 2 dígitos (convertir 20xx a 19xx si es mayor a año actual)
+            placeholders = in_list_binds("comunidad", filters['comunidades'], params, "UPPER({})")
+            conditions.append(f"UPPER(COMUNIDAD_AUTONOMA) IN ({placeholders})")
+        
+        # Filtro por año de nacimiento (precalculado en la tabla normalizada)
         if filters.get('año_nacimiento_min') is not None:
-            conditions.append("""
-                CASE 
-                    WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                    THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                    ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                END >= :año_min
-            """)
+            conditions.append("ANIO_NACIMIENTO >= :año_min")
             params["año_min"] = filters['año_nacimiento_min']
         
         if filters.get('año_nacimiento_max') is not None:
-            conditions.append("""
-                CASE 
-                    WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                    THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                    ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                END <= :año_max
-            """)
+            conditions.append("ANIO_NACIMIENTO <= :año_max")
             params["año_max"] = filters['año_nacimiento_max']
         
         # Filtro por sexo (1=Hombre, 2=Mujer, según los datos)
@@ -97,41 +182,66 @@ class PatientFilterService:
             sexo_codes = []
             for sexo in filters['sexo']:
                 if sexo.lower() == 'hombre':
-                    sexo_codes.append('1')
+                    sexo_codes.append(1)
                 elif sexo.lower() == 'mujer':
-                    sexo_codes.append('2')
+                    sexo_codes.append(2)
                 else:  # Otros
-                    sexo_codes.append('3')
+                    sexo_codes.append(3)
             
             if sexo_codes:
-                placeholders = []
-                for i, code in enumerate(sexo_codes):
-                    param_name = f"sexo_{i}"
-                    placeholders.append(f":{param_name}")
-                    params[param_name] = code
-                conditions.append(f"SEXO IN ({','.join(placeholders)})")
+                conditions.append(f"SEXO_COD IN ({in_list_binds('sexo', sexo_codes, params)})")
         
         # Filtro por diagnósticos - usar CATEGORIA que contiene el diagnóstico agrupado
         if filters.get('diagnosticos') and len(filters['diagnosticos']) > 0:
-            placeholders = []
-            for i, diagnostico in enumerate(filters['diagnosticos']):
-                param_name = f"diagnostico_{i}"
-                placeholders.append(f":{param_name}")
-                params[param_name] = diagnostico
-            conditions.append(f"CATEGORIA IN ({','.join(placeholders)})")
+            conditions.append(f"CATEGORIA IN ({in_list_binds('diagnostico', filters['diagnosticos'], params)})")
         
         # Filtro por centros
         if filters.get('centros') and len(filters['centros']) > 0:
-            placeholders = []
-            for i, centro in enumerate(filters['centros']):
-                param_name = f"centro_{i}"
-                placeholders.append(f":{param_name}")
-                params[param_name] = centro
-            conditions.append(f"CENTRO_RECODIFICADO IN ({','.join(placeholders)})")
+            conditions.append(f"CENTRO_RECODIFICADO IN ({in_list_binds('centro', filters['centros'], params)})")
         
         return conditions, params
     
-    def get_filtered_patients(self, filters: Dict[str, Any], page: int = 1, rows_per_page: int = 20) -> Dict[str, Any]:
+    def build_patient_query(self, filters: Dict[str, Any], typed: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """
+        Consulta base de pacientes con los filtros aplicados (sin orden ni paginación)
+        
+        Args:
+            filters: Filtros a aplicar
+            typed: Si es True las fechas se devuelven como DATE y la estancia
+                como entero (0 si falta), para la exportación en Arrow/Parquet
+        
+        Returns:
+            Tupla con la consulta SQL y su diccionario de parámetros
+        """
+        # Construir condiciones de filtro
+        conditions, params = self.build_filter_conditions(filters)
+        
+        # Consulta base usando la tabla normalizada
+        base_query = f"""
+        SELECT 
+            ID as id,
+            NOMBRE,
+            COMUNIDAD_AUTONOMA,
+            ANIO_NACIMIENTO as año_nacimiento,
+            CASE SEXO_COD
+                WHEN 1 THEN 'Hombre'
+                WHEN 2 THEN 'Mujer'
+                ELSE 'Otros'
+            END as sexo,
+            CATEGORIA as diagnostico,
+            CENTRO_RECODIFICADO as centro,
+            {TYPED_COLUMNS if typed else TEXT_COLUMNS}
+        FROM {PATIENT_TABLE}
+        WHERE {BASE_CONDITIONS}
+        """
+        
+        if conditions:
+            base_query += " AND " + " AND ".join(conditions)
+        
+        return base_query, params
+    
+    def get_filtered_patients(self, filters: Dict[str, Any], page: int = 1, rows_per_page: int = 20,
+                              cursor: Optional[str] = None, exact_count: bool = True) -> Dict[str, Any]:
         """
         Obtiene pacientes filtrados con paginación
         
@@ -139,100 +249,193 @@ class PatientFilterService:
             filters: Filtros a aplicar
             page: Número de página
             rows_per_page: Filas por página
+            cursor: Cursor opaco devuelto en next_cursor/prev_cursor
+            exact_count: Si es False se omite el recuento exacto
             
         Returns:
             Diccionario con datos paginados y metadatos
         """
-        connection = self.get_connection()
-        cursor = connection.cursor()
+        result = dict(self.get_filtered_page(filters, page, rows_per_page, cursor, exact_count))
+        result["data"] = [row_to_patient(row) for row in result.pop("rows")]
+        return result
+    
+    def get_filtered_page(self, filters: Dict[str, Any], page: int = 1, rows_per_page: int = 20,
+                          cursor: Optional[str] = None, exact_count: bool = True) -> Dict[str, Any]:
+        """
+        Obtiene una página de pacientes filtrados como filas (tuplas) y sus metadatos
         
-        try:
-            # Construir condiciones de filtro
-            conditions, params = self.build_filter_conditions(filters)
-            
-            # Consulta base usando DATOS_ORIGINALES
-            base_query = """
-            SELECT 
-                ROWNUM as id,
-                NOMBRE,
-                COMUNIDAD_AUTONOMA,
-                CASE 
-                    WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                    THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                    ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                END as año_nacimiento,
-                CASE 
-                    WHEN SEXO = '1' THEN 'Hombre'
-                    WHEN SEXO = '2' THEN 'Mujer'
-                    ELSE 'Otros'
-                END as sexo,
-                CATEGORIA as diagnostico,
-                CENTRO_RECODIFICADO as centro,
-                FECHA_DE_INGRESO as fecha_ingreso,
-                FECHA_DE_FIN_CONTACTO as fecha_fin_contacto,
-                ESTANCIA_DIAS as estancia_dias
-            FROM DATOS_ORIGINALES
-            WHERE FECHA_DE_NACIMIENTO IS NOT NULL 
-            AND COMUNIDAD_AUTONOMA IS NOT NULL
-            AND CATEGORIA IS NOT NULL
-            AND CENTRO_RECODIFICADO IS NOT NULL
-            """
-            
-            if conditions:
-                base_query += " AND " + " AND ".join(conditions)
-            
-            # Contar total de registros
-            count_query = f"SELECT COUNT(*) FROM ({base_query})"
-            cursor.execute(count_query, params)
-            total_records = cursor.fetchone()[0]
+        Sin cursor se pagina por número de página (OFFSET). Con cursor se
+        pagina por clave (NOMBRE, ID) a partir de la última fila vista, de
+        modo que el coste no depende de la profundidad de la página.
+        
+        El total se calcula en la misma ejecución que la página cuando se
+        pide por número de página, y los cursores lo llevan consigo: las
+        páginas por cursor no vuelven a contar, solo buscan por clave. Con
+        exact_count=False (o con un cursor sin total) no se cuenta:
+        total_records es solo una cota inferior y has_more indica si hay más
+        páginas.
+        
+        Si el motor columnar está activo y su snapshot está al día, la
+        consulta se resuelve en memoria; si no, se consulta a Oracle.
+        
+        Args:
+            filters: Filtros a aplicar
+            page: Número de página
+            rows_per_page: Filas por página
+            cursor: Cursor opaco devuelto en next_cursor/prev_cursor
+            exact_count: Si es False se omite el recuento exacto
             
-            # Calcular paginación
+        Returns:
+            Diccionario con las filas en "rows" (orden de PATIENT_FIELDS) y metadatos
+        """
+        direction = None
+        cursor_key = None
+        known_total = None
+        if cursor:
+            cursor_nombre, cursor_id, direction, known_total = decode_cursor(cursor)
+            cursor_key = (cursor_nombre, cursor_id)
+            # El total, si se contó, viene en el cursor
+            exact_count = False
+        
+        snapshot = self.get_columnar_snapshot()
+        if snapshot is not None:
+            rows, total_records = snapshot.fetch_page(
+                filters, page, rows_per_page, cursor_key, direction, exact_count
+            )
+        else:
+            # Las peticiones concurrentes con la misma página comparten la consulta
+            rows, total_records = self.single_flight.do(
+                ("page", filters_key(filters), page, rows_per_page, cursor_key, direction, exact_count),
+                self.fetch_page_from_db, filters, page, rows_per_page, cursor_key, direction, exact_count
+            )
+        if total_records is None:
+            total_records = known_total
+        total_is_exact = total_records is not None
+        
+        has_more = len(rows) > rows_per_page
+        rows = rows[:rows_per_page]
+        if direction == "prev":
+            rows.reverse()
+            has_next, has_prev = True, has_more
+        elif direction == "next":
+            has_next, has_prev = has_more, True
+        else:
+            has_next, has_prev = has_more, page > 1
+        
+        # Calcular paginación
+        if total_records is None:
+            seen = (page - 1) * rows_per_page if direction is None else 0
+            total_records = seen + len(rows)
+            total_pages = page + 1 if has_next else page
+        else:
             total_pages = (total_records + rows_per_page - 1) // rows_per_page
-            offset = (page - 1) * rows_per_page
+        
+        return {
+            "rows": rows,
+            "total_records": total_records,
+            "current_page": page,
+            "total_pages": total_pages,
+            "rows_per_page": rows_per_page,
+            "has_more": has_next,
+            "total_is_exact": total_is_exact,
+            "next_cursor": (encode_cursor(rows[-1][1], rows[-1][0], "next", total_records if total_is_exact else None)
+                            if rows and has_next else None),
+            "prev_cursor": (encode_cursor(rows[0][1], rows[0][0], "prev", total_records if total_is_exact else None)
+                            if rows and has_prev else None)
+        }
+    
+    def fetch_page_from_db(self, filters: Dict[str, Any], page: int, rows_per_page: int,
+                           cursor_key: Optional[Tuple[str, int]], direction: Optional[str],
+                           exact_count: bool) -> Tuple[List[tuple], Optional[int]]:
+        """
+        Consulta en la base de datos una página (más una fila de control) y el total
+        
+        Returns:
+            Tupla (filas en el orden de recorrido, total o None si no se cuenta)
+        """
+        connection = self.get_connection()
+        db_cursor = connection.cursor()
+        
+        try:
+            base_query, params = self.build_patient_query(filters)
             
-            # Consulta con paginación usando ROWNUM
-            paginated_query = f"""
-            SELECT * FROM (
-                SELECT ROWNUM AS rn, t.* FROM (
-                    {base_query}
-                    ORDER BY NOMBRE
-                ) t
-                WHERE ROWNUM <= :end_row
-            )
-            WHERE rn > :start_row
-            """
+            # Se pide una fila de más para saber si hay más páginas
+            page_params = dict(params, fetch_rows=rows_per_page + 1)
+            if direction is not None:
+                # Por cursor: la búsqueda por clave va dentro de la consulta
+                # base, así que solo se leen las filas de la página por el
+                # índice (NOMBRE, ID); el total no se cuenta (viaja en el cursor)
+                if direction == "prev":
+                    seek = "(NOMBRE < :cursor_nombre OR (NOMBRE = :cursor_nombre AND ID < :cursor_id))"
+                    order = "NOMBRE DESC, ID DESC"
+                else:
+                    seek = "(NOMBRE > :cursor_nombre OR (NOMBRE = :cursor_nombre AND ID > :cursor_id))"
+                    order = "NOMBRE, ID"
+                paginated_query = f"""
+                {base_query} AND {seek}
+                ORDER BY {order}
+                {fetch_first_sql("fetch_rows")}
+                """
+                page_params.update(cursor_nombre=cursor_key[0], cursor_id=cursor_key[1])
+            else:
+                # El total viaja en cada fila de la página (antes del FETCH)
+                total_expr = "COUNT(*) OVER ()" if exact_count else "CAST(NULL AS NUMBER)"
+                paginated_query = f"""
+                SELECT t.*, {total_expr} AS total_records FROM ({base_query}) t
+                ORDER BY NOMBRE, ID
+                {offset_fetch_sql("offset_rows", "fetch_rows")}
+                """
+                page_params["offset_rows"] = (page - 1) * rows_per_page
             
-            params["start_row"] = offset
-            params["end_row"] = offset + rows_per_page
+            db_cursor.execute(paginated_query, page_params)
+            rows = db_cursor.fetchall()
             
-            cursor.execute(paginated_query, params)
-            rows = cursor.fetchall()
+            if not exact_count:
+                return rows, None
+            if rows:
+                return rows, int(rows[0][10])
             
-            # Convertir resultados
-            patients = []
-            for row in rows:
-                # Saltamos el primer campo que es ROWNUM (rn) de la paginación
-                patient = {
-                    "id": row[1],  # id original
-                    "nombre": row[2],  # NOMBRE
-                    "comunidad": row[3],  # COMUNIDAD_AUTONOMA
-                    "año_nacimiento": row[4],  # año_nacimiento calculado
-                    "sexo": row[5],  # sexo convertido
-                    "diagnostico": row[6],  # CATEGORIA
-                    "centro": row[7],  # CENTRO_RECODIFICADO
-                    "fecha_ingreso": row[8],  # FECHA_DE_INGRESO
-                    "fecha_fin_contacto": row[9],  # FECHA_DE_FIN_CONTACTO
-                    "estancia_dias": int(row[10]) if row[10] else 0  # ESTANCIA_DIAS
-                }
-                patients.append(patient)
+            # Página fuera de rango: el total hay que contarlo aparte
+            db_cursor.execute(f"SELECT COUNT(*) FROM ({base_query})", params)
+            return rows, db_cursor.fetchone()[0]
             
-            return {
-                "data": patients,
-                "total_records": total_records,
-                "current_page": page,
-                "total_pages": total_pages,
-                "rows_per_page": rows_per_page
-            }
+        finally:
+            db_cursor.close()
+            connection.close()
+    
+    def get_columnar_snapshot(self) -> Optional["ColumnarSnapshot"]:
+        """
+        Snapshot columnar vigente, o None si el motor está desactivado o el
+        snapshot ha caducado (en ese caso se recarga en segundo plano)
+        """
+        if self.columnar_cache is None:
+            return None
+        snapshot = self.columnar_cache.get_if_fresh()
+        if snapshot is None:
+            self.columnar_cache.refresh_in_background()
+        return snapshot
+    
+    def load_columnar_snapshot(self) -> "ColumnarSnapshot":
+        """Carga en memoria las columnas de la tabla normalizada"""
+        from services.columnar_engine import ColumnarSnapshot
+
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        
+        try:
+            cursor.arraysize = 5000
+            cursor.execute(f"""
+                SELECT ID, NOMBRE, COMUNIDAD_AUTONOMA, ANIO_NACIMIENTO, SEXO_COD, CATEGORIA,
+                       CENTRO_RECODIFICADO, FECHA_DE_INGRESO, FECHA_DE_FIN_CONTACTO, ESTANCIA_DIAS
+                FROM {PATIENT_TABLE}
+                WHERE {BASE_CONDITIONS}
+            """)
+            snapshot = ColumnarSnapshot.from_rows(cursor.fetchall())
+            if self.use_bitmap_index:
+                from services.bitmap_index import BitmapIndex
+                snapshot.bitmap_index = BitmapIndex(snapshot)
+            print(f"🗂️  Snapshot columnar cargado ({snapshot.row_count} filas)")
+            return snapshot
             
         finally:
             cursor.close()
@@ -240,75 +443,117 @@ class PatientFilterService:
     
     def get_filter_options(self) -> Dict[str, Any]:
         """
-        Obtiene las opciones disponibles para todos los filtros
+        Obtiene las opciones disponibles para todos los filtros (cacheadas)
+        
+        Returns:
+            Diccionario con opciones de filtro disponibles
+        """
+        return self.options_cache.get()[0].options
+    
+    def get_filter_options_with_version(self) -> Tuple[Dict[str, Any], str]:
+        """
+        Obtiene las opciones de filtro cacheadas junto con su versión
+        
+        Returns:
+            Tupla (opciones, versión) donde la versión sirve como ETag
+        """
+        catalog, version = self.options_cache.get()
+        return catalog.options, version
+    
+    def load_filter_options(self) -> Dict[str, Any]:
+        """
+        Consulta en la base de datos las opciones disponibles para todos los filtros
         
         Returns:
             Diccionario con opciones de filtro disponibles
         """
+        return self.load_filter_catalog().options
+    
+    def load_filter_catalog(self) -> FilterCatalog:
+        """
+        Consulta el catálogo de opciones completo y hasta qué fila llega
+        
+        Returns:
+            Catálogo con los valores distintos y el rango de años de nacimiento
+        """
         connection = self.get_connection()
         cursor = connection.cursor()
         
         try:
+            # Las filas añadidas después se incorporan con update_filter_catalog
+            high_id = read_high_water_mark(cursor)
+            
             # Obtener comunidades autónomas únicas
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT DISTINCT COMUNIDAD_AUTONOMA 
-                FROM DATOS_ORIGINALES 
+                FROM {PATIENT_TABLE} 
                 WHERE COMUNIDAD_AUTONOMA IS NOT NULL 
                 ORDER BY COMUNIDAD_AUTONOMA
             """)
             comunidades = [row[0] for row in cursor.fetchall()]
             
-            # Obtener sexos únicos (convertir códigos a texto)
-            sexos = ['Hombre', 'Mujer', 'Otros']
-            
             # Obtener diagnósticos únicos (usar CATEGORIA)
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT DISTINCT CATEGORIA 
-                FROM DATOS_ORIGINALES 
+                FROM {PATIENT_TABLE} 
                 WHERE CATEGORIA IS NOT NULL 
                 ORDER BY CATEGORIA
             """)
             diagnosticos = [row[0] for row in cursor.fetchall()]
             
             # Obtener rango de años de nacimiento
-            cursor.execute("""
-                SELECT 
-                    MIN(CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END), 
-                    MAX(CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END)
-                FROM DATOS_ORIGINALES 
-                WHERE FECHA_DE_NACIMIENTO IS NOT NULL
+            cursor.execute(f"""
+                SELECT MIN(ANIO_NACIMIENTO), MAX(ANIO_NACIMIENTO)
+                FROM {PATIENT_TABLE} 
+                WHERE ANIO_NACIMIENTO IS NOT NULL
             """)
             result = cursor.fetchone()
-            año_min, año_max = result if result else (1950, 2005)
+            año_min, año_max = result if result else (None, None)
             
             # Obtener centros únicos
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT DISTINCT CENTRO_RECODIFICADO 
-                FROM DATOS_ORIGINALES 
+                FROM {PATIENT_TABLE} 
                 WHERE CENTRO_RECODIFICADO IS NOT NULL 
                 ORDER BY CENTRO_RECODIFICADO
             """)
             centros = [row[0] for row in cursor.fetchall()]
             
-            return {
-                "comunidades": comunidades,
-                "sexos": sexos,
-                "diagnosticos": diagnosticos,
-                "centros": centros,
-                "año_nacimiento_range": {
-                    "min": int(año_min) if año_min else 1950,
-                    "max": int(año_max) if año_max else 2005
-                }
-            }
+            return FilterCatalog(comunidades, diagnosticos, centros, año_min, año_max, high_water_mark=high_id)
             
         finally:
             cursor.close()
-            connection.close()
\ No newline at end of file
+            connection.close()
+    
+    def update_filter_catalog(self, catalog: FilterCatalog) -> Optional[FilterCatalog]:
+        """
+        Añade al catálogo los valores de las filas cargadas después de su marca de agua
+        
+        Returns:
+            El catálogo actualizado, o None si hay que recargarlo entero (no se
+            sabe hasta dónde llega o la tabla se reconstruyó con menos filas)
+        """
+        if catalog.high_water_mark is None:
+            return None
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        
+        try:
+            high_id = read_high_water_mark(cursor)
+            low_id = catalog.high_water_mark
+            if high_id < low_id:
+                return None
+            if high_id == low_id:
+                return catalog
+            
+            cursor.arraysize = 5000
+            cursor.execute(f"""
+                SELECT COMUNIDAD_AUTONOMA, CATEGORIA, CENTRO_RECODIFICADO, ANIO_NACIMIENTO
+                FROM {PATIENT_TABLE}
+                WHERE ID > :low_id AND ID <= :high_id
+            """, {"low_id": low_id, "high_id": high_id})
+            return catalog.merge(cursor.fetchall(), high_id)
+            
+        finally:
+            cursor.close()
+            connection.close()
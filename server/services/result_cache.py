@@ -0,0 +1,114 @@
+"""
+Caché LRU de resultados por clave con TTL y stale-while-revalidate
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class ResultCache:
+    """
+    Caché de resultados calculados, indexada por (endpoint, parámetros normalizados)
+
+    Un resultado con menos de ttl segundos se sirve directamente. Entre ttl y
+    ttl + stale_ttl se sirve el valor antiguo y se recalcula en segundo plano
+    (stale-while-revalidate). Pasado ese margen se recalcula en la petición.
+    Al superar max_entries se descarta el resultado usado hace más tiempo.
+    """
+
+    def __init__(self, ttl: float = 60, stale_ttl: float = 300, max_entries: int = 256,
+                 name: str = "results"):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.name = name
+        # clave -> (valor, etag, instante de carga)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, str, float]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def compute_etag(value: Any) -> str:
+        """ETag fuerte: hash del contenido serializado de forma canónica"""
+        payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _store(self, key: Hashable, value: Any) -> Tuple[Any, str]:
+        etag = self.compute_etag(value)
+        with self._lock:
+            self._entries[key] = (value, etag, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value, etag
+
+    def _revalidate(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        def _run():
+            try:
+                self._store(key, loader())
+            except Exception as e:
+                print(f"Error refrescando {self.name} {key}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=_run, name=f"{self.name}-revalidate", daemon=True).start()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Tuple[Any, str]:
+        """
+        Devuelve el resultado de la clave y su ETag, calculándolo con loader si hace falta
+
+        Args:
+            key: Clave hashable (endpoint y parámetros normalizados)
+            loader: Función sin argumentos que calcula el resultado
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.monotonic() - entry[2] if entry is not None else None
+            if entry is not None and age < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            stale = entry is not None and age < self.ttl + self.stale_ttl
+            if stale:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+            else:
+                self.misses += 1
+
+        if stale:
+            self._revalidate(key, loader)
+            return entry[0], entry[1]
+        return self._store(key, loader())
+
+    def clear(self) -> None:
+        """Descarta todos los resultados"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado de la caché para monitorización"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "stale_ttl_seconds": self.stale_ttl,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "refreshing": len(self._refreshing),
+            }
@@ -0,0 +1,176 @@
+"""
+Caché en memoria de un valor precalculado (catálogo de filtros, cubo de agregados)
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class SnapshotCache:
+    """
+    Caché de un único valor con TTL, refresco en segundo plano e invalidación
+
+    Cada valor cargado lleva una versión (por defecto, hash de su contenido)
+    que se usa como ETag para que los clientes puedan revalidar sin
+    descargarlo de nuevo.
+
+    Con updater, los refrescos son incrementales: updater recibe el valor
+    actual y devuelve el actualizado (None si hace falta una carga completa).
+    Cada full_refresh segundos se hace igualmente una carga completa con
+    loader, que corrige lo que las actualizaciones no ven (filas borradas o
+    tabla reconstruida).
+    """
+
+    def __init__(self, loader: Callable[[], Any], ttl: float = 300, name: str = "snapshot",
+                 version_fn: Optional[Callable[[Any], str]] = None,
+                 updater: Optional[Callable[[Any], Optional[Any]]] = None, full_refresh: float = 86400):
+        self.loader = loader
+        self.ttl = ttl
+        self.name = name
+        self.version_fn = version_fn or self.compute_version
+        self.updater = updater
+        self.full_refresh = full_refresh
+        self._value: Optional[Any] = None
+        self._version: Optional[str] = None
+        self._loaded_at = 0.0
+        self._full_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.incremental_updates = 0
+
+    @staticmethod
+    def compute_version(value: Any) -> str:
+        """Hash estable del contenido (serializable a JSON)"""
+        payload = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _is_fresh(self) -> bool:
+        return self._value is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def refresh(self, full: bool = False) -> Tuple[Any, str]:
+        """
+        Recarga el valor desde la base de datos
+
+        Args:
+            full: Carga completa aunque se pueda actualizar de forma incremental
+        """
+        with self._lock:
+            current = self._value
+            incremental = (not full and self.updater is not None and current is not None
+                           and time.monotonic() - self._full_loaded_at < self.full_refresh)
+        value = self.updater(current) if incremental else None
+        if value is None:
+            incremental = False
+            value = self.loader()
+        with self._lock:
+            now = time.monotonic()
+            self._value = value
+            self._version = self.version_fn(value)
+            self._loaded_at = now
+            if incremental:
+                self.incremental_updates += 1
+            else:
+                self._full_loaded_at = now
+            return self._value, self._version
+
+    def seed(self, value: Any) -> None:
+        """
+        Carga un valor ya calculado (instantánea de arranque) sin ir a la base de datos
+
+        El valor cuenta como recién cargado: se sirve durante un TTL y después
+        se recarga como cualquier otro.
+        """
+        with self._lock:
+            self._value = value
+            self._version = self.version_fn(value)
+            self._loaded_at = self._full_loaded_at = time.monotonic()
+
+    def get(self) -> Tuple[Any, str]:
+        """
+        Devuelve el valor y su versión
+
+        Si no hay valor o ha caducado se recarga; mientras el refresco en
+        segundo plano está activo, un valor caducado se sirve igualmente y
+        el hilo lo actualizará en su siguiente ciclo.
+        """
+        with self._lock:
+            if self._is_fresh() or (self._value is not None and self._refresher is not None):
+                self.hits += 1
+                return self._value, self._version
+            self.misses += 1
+        # Una sola carga a la vez; quien espere reutiliza el valor recién cargado
+        with self._load_lock:
+            with self._lock:
+                if self._is_fresh():
+                    return self._value, self._version
+            return self.refresh()
+
+    def get_if_fresh(self) -> Optional[Any]:
+        """Devuelve el valor solo si no ha caducado, sin cargarlo nunca"""
+        with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            return None
+
+    def refresh_in_background(self) -> None:
+        """Lanza una recarga en otro hilo si no hay ya una en curso"""
+        def _run():
+            try:
+                with self._load_lock:
+                    if not self._is_fresh():
+                        self.refresh()
+            except Exception as e:
+                print(f"Error refrescando {self.name}: {str(e)}")
+
+        if not self._load_lock.locked():
+            threading.Thread(target=_run, name=f"{self.name}-reload", daemon=True).start()
+
+    def invalidate(self) -> None:
+        """Descarta el valor actual; la siguiente petición lo recarga"""
+        with self._lock:
+            self._value = None
+            self._version = None
+            self._loaded_at = 0.0
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.ttl):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refrescando {self.name}: {str(e)}")
+
+    def start_refresher(self) -> None:
+        """Arranca el hilo que refresca el valor cada TTL segundos"""
+        if self._refresher is None:
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, name=f"{self.name}-refresh", daemon=True)
+            self._refresher.start()
+
+    def stop_refresher(self) -> None:
+        """Detiene el hilo de refresco"""
+        if self._refresher is not None:
+            self._stop.set()
+            self._refresher.join(timeout=5)
+            self._refresher = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado de la caché para monitorización"""
+        return {
+            "version": self._version,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._value is not None else None,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "background_refresh": self._refresher is not None,
+            "incremental_updates": self.incremental_updates,
+            "full_load_age_seconds": (round(time.monotonic() - self._full_loaded_at, 1)
+                                      if self._value is not None else None),
+        }
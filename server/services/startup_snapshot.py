@@ -0,0 +1,124 @@
+"""
+Instantánea de arranque: catálogo de filtros y cubo de agregados en un fichero JSON
+
+En un arranque en frío (función serverless) las primeras peticiones a
+/api/filter-options y a las visualizaciones se responden desde esta
+instantánea, sin abrir el pool de Oracle. Se genera en el despliegue:
+
+    python -m services.startup_snapshot [ruta.json]
+
+Y se activa con STARTUP_SNAPSHOT_PATH. Las instantáneas con más de
+STARTUP_SNAPSHOT_MAX_AGE segundos (por defecto, un día) se ignoran.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from services.aggregate_cube import AggregateCube
+from services.filter_catalog import FilterCatalog
+
+SNAPSHOT_FORMAT = 3
+
+_snapshot: Optional[Dict[str, Any]] = None
+_snapshot_loaded = False
+_snapshot_lock = threading.Lock()
+
+
+def build_snapshot(filter_service: Any, visualization_service: Any) -> Dict[str, Any]:
+    """Consulta el catálogo y el cubo y los devuelve en forma serializable"""
+    cube = visualization_service.load_cube()
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "created_at": time.time(),
+        "filter_options": filter_service.load_filter_options(),
+        # Celdas como filas (categoria, sexo, anio_nacimiento, comunidad, centro,
+        # pacientes): claves de paciente, o el sketch con VIS_COUNT_MODE=approx
+        "cube": cube.to_rows(),
+        # Precisión de los sketches, o None si el cubo es exacto
+        "cube_precision": cube.precision,
+        # Mayor ID incluido en el cubo: el primer refresco solo lee las filas
+        # posteriores. El catálogo se consulta después y llega al menos hasta
+        # aquí; volver a añadirle filas no lo cambia
+        "high_water_mark": cube.high_water_mark,
+    }
+
+
+def write_snapshot(path: str, filter_service: Any, visualization_service: Any) -> Dict[str, Any]:
+    """Genera la instantánea y la escribe de forma atómica en path"""
+    snapshot = build_snapshot(filter_service, visualization_service)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(temporary, path)
+    return snapshot
+
+
+def read_snapshot(path: str, max_age: float) -> Optional[Dict[str, Any]]:
+    """Lee la instantánea; None si no existe, no es válida o es demasiado antigua"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"No se pudo leer la instantánea de arranque {path}: {str(e)}")
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        return None
+    age = time.time() - snapshot.get("created_at", 0)
+    if age > max_age:
+        print(f"Instantánea de arranque ignorada: tiene {int(age)} s (máximo {int(max_age)} s)")
+        return None
+    return snapshot
+
+
+def get_startup_snapshot() -> Optional[Dict[str, Any]]:
+    """Instantánea configurada en STARTUP_SNAPSHOT_PATH (se lee una sola vez por proceso)"""
+    global _snapshot, _snapshot_loaded
+    if not _snapshot_loaded:
+        with _snapshot_lock:
+            if not _snapshot_loaded:
+                path = os.getenv("STARTUP_SNAPSHOT_PATH")
+                if path:
+                    _snapshot = read_snapshot(path, float(os.getenv("STARTUP_SNAPSHOT_MAX_AGE", "86400")))
+                _snapshot_loaded = True
+    return _snapshot
+
+
+def seed_filter_service(filter_service: Any) -> bool:
+    """Precarga el catálogo de filtros desde la instantánea, si hay una"""
+    snapshot = get_startup_snapshot()
+    if snapshot is None or snapshot.get("filter_options") is None:
+        return False
+    filter_service.options_cache.seed(
+        FilterCatalog.from_options(snapshot["filter_options"], snapshot.get("high_water_mark"))
+    )
+    return True
+
+
+def seed_visualization_service(visualization_service: Any) -> bool:
+    """Precarga el cubo de agregados desde la instantánea, si hay una"""
+    snapshot = get_startup_snapshot()
+    if snapshot is None or snapshot.get("cube") is None:
+        return False
+    visualization_service.cube_cache.seed(AggregateCube.from_rows(
+        snapshot["cube"], precision=snapshot.get("cube_precision"),
+        high_water_mark=snapshot.get("high_water_mark")
+    ))
+    return True
+
+
+if __name__ == "__main__":
+    from services.patient_filter_service import PatientFilterService
+    from services.visualization_service import VisualizationService
+
+    target = sys.argv[1] if len(sys.argv) > 1 else os.getenv("STARTUP_SNAPSHOT_PATH")
+    if not target:
+        print(__doc__)
+        sys.exit(1)
+    written = write_snapshot(target, PatientFilterService(), VisualizationService())
+    print(f"✅ {target}: catálogo de filtros y cubo de {len(written['cube'])} celdas")
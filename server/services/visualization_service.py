@@ -1,398 +1,473 @@
 """
 Servicios para visualización de datos médicos - Version con nuevo formato
 """
-from typing import List, Dict, Any
-import oracledb
+from typing import List, Dict, Any, Optional, Tuple
 import os
-from dotenv import load_dotenv
+from db.backend import grouping_sets_sql, in_list_binds
+from db.connection import get_connection
+from db.pacientes_normalizados import PATIENT_TABLE, read_high_water_mark
+from services.age_binning import NEGATIVE_BUCKET, AgeBinning, ChartCounts, interval_labels
+from services.aggregate_cube import AggregateCube, PatientSet
+from services.hyperloglog import DEFAULT_PRECISION, HyperLogLog, relative_error
+from services.result_cache import ResultCache
+from services.single_flight import SingleFlight
+from services.snapshot_cache import SnapshotCache
+
 
 class VisualizationService:
     """Servicio para generar datos de visualización"""
-    
+
     def __init__(self):
-        # Solo cargar .env si estamos en desarrollo (no en Vercel)
-        if os.environ.get("VERCEL") != "1":
-            dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env')
-            if os.path.exists(dotenv_path):
-                load_dotenv(dotenv_path)
-
-        self.wallet_path = os.getenv("WALLET_PATH")
-        # Si wallet_path contiene ${PWD}, reemplazarlo con el directorio actual
-        if self.wallet_path and "${PWD}" in self.wallet_path:
-            current_dir = os.path.dirname(os.path.dirname(__file__))
-            self.wallet_path = self.wallet_path.replace("${PWD}", current_dir)
-
-        self.wallet_password = os.getenv("WALLET_PASSWORD")
-        self.user = os.getenv("DB_USER")
-        self.user_password = os.getenv("DB_PASSWORD")
-        self.dsn = os.getenv("DB_TNS_ALIAS")
-
-        # Validar que todas las variables críticas están presentes
-        missing = [k for k, v in {
-            'WALLET_PATH': self.wallet_path,
-            'WALLET_PASSWORD': self.wallet_password,
-            'DB_USER': self.user,
-            'DB_PASSWORD': self.user_password,
-            'DB_TNS_ALIAS': self.dsn
-        }.items() if not v]
-        if missing:
-            raise RuntimeError(f"Faltan variables de entorno requeridas: {', '.join(missing)}")
-    
-    def get_connection(self):
-        """Establece conexión con la base de datos Oracle"""
-        return oracledb.connect(
-            user=self.user,
-            password=self.user_password,
-            dsn=self.dsn,
-            config_dir=self.wallet_path,
-            wallet_location=self.wallet_path,
-            wallet_password=self.wallet_password
+        # Consultas idénticas concurrentes se ejecutan una sola vez
+        self.single_flight = SingleFlight("visualization")
+
+        # Cubo de agregados en memoria (VIS_CUBE_ENABLED, VIS_CUBE_TTL en segundos)
+        self.use_cube = os.getenv("VIS_CUBE_ENABLED", "true").lower() == "true"
+        # Los refrescos solo leen las filas añadidas desde el anterior
+        # (AGGREGATE_FULL_REFRESH: segundos entre recargas completas)
+        self.cube_cache = SnapshotCache(
+            self.load_cube,
+            ttl=float(os.getenv("VIS_CUBE_TTL", "600")),
+            name="aggregate-cube",
+            version_fn=lambda cube: cube.version,
+            updater=self.update_cube,
+            full_refresh=float(os.getenv("AGGREGATE_FULL_REFRESH", "86400"))
         )
-    
-    def get_age_pyramid_data(self, diagnosis: str) -> List[Dict[str, Any]]:
+        # VIS_COUNT_MODE=approx: el cubo guarda un sketch HyperLogLog por celda
+        # (VIS_HLL_PRECISION) y los recuentos son estimaciones con error acotado
+        self.count_mode = os.getenv("VIS_COUNT_MODE", "exact").lower()
+        self.hll_precision = int(os.getenv("VIS_HLL_PRECISION", str(DEFAULT_PRECISION)))
+        # Caché de respuestas por endpoint y diagnóstico (VIS_RESULT_TTL,
+        # VIS_RESULT_STALE y VIS_RESULT_MAX_ENTRIES)
+        self.result_cache = ResultCache(
+            ttl=float(os.getenv("VIS_RESULT_TTL", "60")),
+            stale_ttl=float(os.getenv("VIS_RESULT_STALE", "300")),
+            max_entries=int(os.getenv("VIS_RESULT_MAX_ENTRIES", "256")),
+            name="visualization-results"
+        )
+        self.result_builders = {
+            "dashboard": self.get_dashboard_data,
+            "age-pyramid": self.get_age_pyramid_data,
+            "age-histogram": self.get_age_histogram_data,
+            "gender-distribution": self.get_gender_distribution_data,
+            "pie-chart": self.get_pie_chart_data,
+        }
+
+    def get_connection(self):
+        """Obtiene una conexión del pool compartido de Oracle"""
+        return get_connection()
+
+    def load_cube(self) -> AggregateCube:
         """
-        Obtiene datos para pirámide poblacional filtrada por diagnóstico usando intervalos de edad
-        Devuelve lista de objetos con formato: {intervalo: str, hombres: int, mujeres: int}
+        Construye el cubo de pacientes únicos por categoría, sexo, año de
+        nacimiento, comunidad y centro en una sola pasada sobre la tabla
         """
         connection = None
         try:
             connection = self.get_connection()
             cursor = connection.cursor()
-            
-            # Definir intervalos de edad (cada 10 años)
-            age_groups = ['0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
-            
-            # Query combinada para obtener datos por sexo y grupo de edad
-            # Usamos NOMBRE y CENTRO_RECODIFICADO para identificar pacientes únicos
-            query = """
-            WITH age_calculations AS (
-                SELECT 
-                    2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) as age,
-                    SEXO,
-                    NOMBRE,
-                    CENTRO_RECODIFICADO
-                FROM DATOS_ORIGINALES 
-                WHERE CATEGORIA = :diagnosis
-                AND FECHA_DE_NACIMIENTO IS NOT NULL
-                AND SEXO IN ('1', '2')
-                AND NOMBRE IS NOT NULL
-                AND CENTRO_RECODIFICADO IS NOT NULL
-            ),
-            grouped_data AS (
-                SELECT 
-                    CASE 
-                        WHEN age BETWEEN 0 AND 9 THEN '0-9'
-                        WHEN age BETWEEN 10 AND 19 THEN '10-19'
-                        WHEN age BETWEEN 20 AND 29 THEN '20-29'
-                        WHEN age BETWEEN 30 AND 39 THEN '30-39'
-                        WHEN age BETWEEN 40 AND 49 THEN '40-49'
-                        WHEN age BETWEEN 50 AND 59 THEN '50-59'
-                        WHEN age BETWEEN 60 AND 69 THEN '60-69'
-                        WHEN age BETWEEN 70 AND 79 THEN '70-79'
-                        ELSE '80+'
-                    END as grupo_edad,
-                    SEXO,
-                    COUNT(DISTINCT NOMBRE || '_' || CENTRO_RECODIFICADO) as count
-                FROM age_calculations
-                WHERE age >= 0
-                GROUP BY 
-                    CASE 
-                        WHEN age BETWEEN 0 AND 9 THEN '0-9'
-                        WHEN age BETWEEN 10 AND 19 THEN '10-19'
-                        WHEN age BETWEEN 20 AND 29 THEN '20-29'
-                        WHEN age BETWEEN 30 AND 39 THEN '30-39'
-                        WHEN age BETWEEN 40 AND 49 THEN '40-49'
-                        WHEN age BETWEEN 50 AND 59 THEN '50-59'
-                        WHEN age BETWEEN 60 AND 69 THEN '60-69'
-                        WHEN age BETWEEN 70 AND 79 THEN '70-79'
-                        ELSE '80+'
-                    END,
-                    SEXO
-            )
-            SELECT grupo_edad, SEXO, count
-            FROM grouped_data
-            ORDER BY 
-                CASE grupo_edad
-                    WHEN '0-9' THEN 1
-                    WHEN '10-19' THEN 2
-                    WHEN '20-29' THEN 3
-                    WHEN '30-39' THEN 4
-                    WHEN '40-49' THEN 5
-                    WHEN '50-59' THEN 6
-                    WHEN '60-69' THEN 7
-                    WHEN '70-79' THEN 8
-                    ELSE 9
-                END
-            """
-            
-            cursor.execute(query, {"diagnosis": diagnosis})
-            results = cursor.fetchall()
-            
-            # Crear diccionario para organizar datos por intervalo
-            data_by_interval = {}
-            
-            # Inicializar todos los intervalos con 0 hombres y 0 mujeres
-            for interval in age_groups:
-                data_by_interval[interval] = {"hombres": 0, "mujeres": 0}
-            
-            # Procesar resultados de la consulta
-            for grupo_edad, sexo, count in results:
-                if grupo_edad in data_by_interval:
-                    if sexo == '1':  # Hombre
-                        data_by_interval[grupo_edad]["hombres"] = count
-                    elif sexo == '2':  # Mujer
-                        data_by_interval[grupo_edad]["mujeres"] = count
-            
-            # Convertir a lista de objetos con el formato solicitado
-            result_list = []
-            for interval in age_groups:
-                result_list.append({
-                    "intervalo": interval,
-                    "hombres": data_by_interval[interval]["hombres"],
-                    "mujeres": data_by_interval[interval]["mujeres"]
-                })
-            
-            return result_list
-            
+            # Hasta qué fila llega el cubo; las posteriores las añade update_cube
+            high_id = read_high_water_mark(cursor)
+            patients = self.load_cube_patients(0, high_id, cursor)
+            if self.count_mode == "approx":
+                cube = AggregateCube.from_sketches(patients, self.hll_precision, high_water_mark=high_id)
+                print(f"🧊 Cubo de agregados aproximado construido ({len(cube.cells)} celdas, "
+                      f"error relativo {cube.relative_error:.2%})")
+            else:
+                cube = AggregateCube(patients, high_water_mark=high_id)
+                print(f"🧊 Cubo de agregados construido ({len(cube.cells)} celdas)")
+            return cube
+
         except Exception as e:
-            print(f"Error en get_age_pyramid_data: {str(e)}")
+            print(f"Error en load_cube: {str(e)}")
             raise e
         finally:
             if connection:
                 connection.close()
 
-    def get_age_histogram_data(self, diagnosis: str) -> Dict[str, Any]:
+    def load_cube_patients(self, low_id: int, high_id: int, cursor: Any) -> Dict[Tuple, PatientSet]:
         """
-        Obtiene datos para histograma de distribución de edades
+        Pacientes por celda de las filas con low_id < ID <= high_id
+
+        La base de datos solo filtra y proyecta (sin DISTINCT ni ordenación);
+        las filas se leen por lotes y su clave de paciente se añade al
+        conjunto de su celda, o a su sketch HyperLogLog en modo aproximado.
+        """
+        query = f"""
+        SELECT CATEGORIA, SEXO_COD, ANIO_NACIMIENTO, COMUNIDAD_AUTONOMA, CENTRO_RECODIFICADO, PACIENTE_KEY
+        FROM {PATIENT_TABLE}
+        WHERE PACIENTE_KEY IS NOT NULL
+        AND ID > :low_id AND ID <= :high_id
         """
+
+        if self.count_mode == "approx":
+            precision = self.hll_precision
+            new_group = lambda: HyperLogLog(precision)
+        else:
+            new_group = set
+        cursor.arraysize = 5000
+        cursor.execute(query, {"low_id": low_id, "high_id": high_id})
+        patients: Dict[Tuple, PatientSet] = {}
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                key = tuple(row[:5])
+                group = patients.get(key)
+                if group is None:
+                    group = patients[key] = new_group()
+                group.add(row[5])
+        return patients
+
+    def update_cube(self, cube: AggregateCube) -> Optional[AggregateCube]:
+        """
+        Añade al cubo las filas cargadas después de su marca de agua
+
+        Returns:
+            El cubo actualizado (el mismo si no hay filas nuevas), o None si
+            hace falta reconstruirlo: no se sabe hasta dónde llega, cambió el
+            modo de recuento o la precisión, o la tabla tiene menos filas (se
+            reconstruyó)
+        """
+        precision = self.hll_precision if self.count_mode == "approx" else None
+        if not cube.mergeable or cube.precision != precision:
+            return None
+
         connection = None
         try:
             connection = self.get_connection()
             cursor = connection.cursor()
-            
-            # Definir grupos de edad más granulares para el histograma
-            age_groups = ['0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
-            
-            query = """
-            SELECT 
-                CASE 
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 0 AND 9 THEN '0-9'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 10 AND 19 THEN '10-19'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 20 AND 29 THEN '20-29'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 30 AND 39 THEN '30-39'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 40 AND 49 THEN '40-49'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 50 AND 59 THEN '50-59'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 60 AND 69 THEN '60-69'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 70 AND 79 THEN '70-79'
-                    ELSE '80+'
-                END as grupo_edad,
-                COUNT(DISTINCT NOMBRE || '_' || CENTRO_RECODIFICADO) as count
-            FROM DATOS_ORIGINALES 
-            WHERE CATEGORIA = :diagnosis
-            AND FECHA_DE_NACIMIENTO IS NOT NULL
-            GROUP BY 
-                CASE 
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 0 AND 9 THEN '0-9'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 10 AND 19 THEN '10-19'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 20 AND 29 THEN '20-29'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 30 AND 39 THEN '30-39'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 40 AND 49 THEN '40-49'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 50 AND 59 THEN '50-59'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 60 AND 69 THEN '60-69'
-                    WHEN 2024 - (CASE 
-                        WHEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) > 2025 
-                        THEN EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY')) - 100
-                        ELSE EXTRACT(YEAR FROM TO_DATE(FECHA_DE_NACIMIENTO, 'MM/DD/YY'))
-                    END) BETWEEN 70 AND 79 THEN '70-79'
-                    ELSE '80+'
-                END
-            """
-            
-            cursor.execute(query, {"diagnosis": diagnosis})
-            results = cursor.fetchall()
-            
-            # Organizar datos
-            counts = [0] * len(age_groups)
-            
-            for grupo_edad, count in results:
-                if grupo_edad in age_groups:
-                    group_index = age_groups.index(grupo_edad)
-                    counts[group_index] = count
-            
-            return {
-                "age_groups": age_groups,
-                "counts": counts,
-                "diagnosis": diagnosis
-            }
-            
+            high_id = read_high_water_mark(cursor)
+            low_id = cube.high_water_mark
+            if high_id < low_id:
+                return None
+            if high_id == low_id:
+                return cube
+
+            updated = cube.merge(self.load_cube_patients(low_id, high_id, cursor), high_id)
+            print(f"🧊 Cubo de agregados actualizado con las filas {low_id + 1}-{high_id}")
+            return updated
+
         except Exception as e:
-            print(f"Error en get_age_histogram_data: {str(e)}")
+            print(f"Error en update_cube: {str(e)}")
             raise e
         finally:
             if connection:
                 connection.close()
-    
-    def get_gender_distribution_data(self, diagnosis: str) -> Dict[str, Any]:
+
+    def get_chart_counts(self, diagnosis: str, binning: AgeBinning) -> ChartCounts:
+        """
+        Pacientes únicos de un diagnóstico contados al grano de cada gráfico
+
+        Con el cubo activo se unen en memoria los pacientes de cada intervalo
+        y sexo; si no, se cuentan en la base de datos (query_chart_counts).
+        """
+        if self.use_cube:
+            return self.cube_cache.get()[0].chart_counts(diagnosis, binning)
+        key = ("chart-counts", diagnosis, binning.key)
+        return self.single_flight.do(key, self.query_chart_counts, [diagnosis], binning)[diagnosis]
+
+    def get_cached_result(self, endpoint: str, diagnosis: str,
+                          binning: Optional[AgeBinning] = None) -> Tuple[Any, str]:
+        """
+        Resultado de un endpoint de visualización servido desde la caché de resultados
+
+        Returns:
+            Tupla (datos, ETag fuerte del contenido)
+        """
+        diagnosis = diagnosis.strip()
+        binning = binning or AgeBinning()
+        builder = self.result_builders[endpoint]
+        key = (endpoint, diagnosis, binning.key)
+        return self.result_cache.get(
+            key,
+            lambda: self.single_flight.do(key, builder, diagnosis, binning)
+        )
+
+    def get_batch_chart_counts(self, diagnoses: Optional[List[str]], binning: AgeBinning) -> Dict[str, ChartCounts]:
+        """
+        Recuentos de cada gráfico de varios diagnósticos a la vez
+
+        Args:
+            diagnoses: Diagnósticos pedidos, o None para todos
         """
-        Obtiene datos para distribución por sexo
+        if self.use_cube:
+            cube = self.cube_cache.get()[0]
+            names = cube.categorias() if diagnoses is None else diagnoses
+            return {diagnosis: cube.chart_counts(diagnosis, binning) for diagnosis in names}
+        key = ("batch-chart-counts", None if diagnoses is None else tuple(sorted(diagnoses)), binning.key)
+        return self.single_flight.do(key, self.query_chart_counts, diagnoses, binning)
+
+    def query_chart_counts(self, diagnoses: Optional[List[str]], binning: AgeBinning) -> Dict[str, ChartCounts]:
+        """
+        Cuenta pacientes únicos de cada gráfico por diagnóstico, cada uno a su grano
+
+        Un paciente con episodios de distinto año de nacimiento o sexo no se
+        puede contar por (año, sexo) y sumar después: cada gráfico se cuenta
+        con COUNT(DISTINCT PACIENTE_KEY) sobre sus propias columnas (intervalo,
+        sexo o ambos) en un solo GROUPING SETS (query_grain_counts). Con
+        cuantiles, los límites de cada diagnóstico salen antes de sus
+        pacientes por edad y se hace una consulta por límites distintos.
+
+        Args:
+            diagnoses: Diagnósticos pedidos, o None para todos
         """
         connection = None
         try:
             connection = self.get_connection()
             cursor = connection.cursor()
-            
-            query = """
-            SELECT 
-                CASE 
-                    WHEN SEXO = '1' THEN 'M'
-                    WHEN SEXO = '2' THEN 'F'
-                    ELSE 'Otros'
-                END as sexo,
-                COUNT(DISTINCT NOMBRE || '_' || CENTRO_RECODIFICADO) as count
-            FROM DATOS_ORIGINALES 
-            WHERE CATEGORIA = :diagnosis
-            AND FECHA_DE_NACIMIENTO IS NOT NULL
-            GROUP BY 
-                CASE 
-                    WHEN SEXO = '1' THEN 'M'
-                    WHEN SEXO = '2' THEN 'F'
-                    ELSE 'Otros'
-                END
-            """
-            
-            cursor.execute(query, {"diagnosis": diagnosis})
-            results = cursor.fetchall()
-            
-            male_count = 0
-            female_count = 0
-            
-            for sexo, count in results:
-                if sexo == 'M':
-                    male_count = count
-                elif sexo == 'F':
-                    female_count = count
-            
-            return {
-                "male_count": male_count,
-                "female_count": female_count,
-                "total": male_count + female_count,
-                "diagnosis": diagnosis
-            }
-            
+            cursor.arraysize = 1000
+
+            if binning.needs_age_counts:
+                diagnoses_by_edges: Dict[Tuple[int, ...], List[str]] = {}
+                for diagnosis, age_counts in self.query_age_counts(diagnoses, binning, cursor).items():
+                    diagnoses_by_edges.setdefault(tuple(binning.edges_for(age_counts)), []).append(diagnosis)
+            else:
+                diagnoses_by_edges = {tuple(binning.edges_for()): diagnoses}
+
+            counts: Dict[str, ChartCounts] = {}
+            for edges, names in diagnoses_by_edges.items():
+                counts.update(self.query_grain_counts(names, binning, list(edges), cursor))
+            return counts
+
         except Exception as e:
-            print(f"Error en get_gender_distribution_data: {str(e)}")
+            print(f"Error en query_chart_counts: {str(e)}")
             raise e
         finally:
             if connection:
                 connection.close()
-    
-    def get_pie_chart_data(self, diagnosis: str) -> Dict[str, int]:
+
+    def query_age_counts(self, diagnoses: Optional[List[str]], binning: AgeBinning,
+                         cursor: Any) -> Dict[str, Dict[int, int]]:
+        """Pacientes únicos por diagnóstico y edad, para calcular los cuantiles"""
+        params: Dict[str, Any] = {}
+        query = f"""
+        SELECT CATEGORIA, ANIO_NACIMIENTO, COUNT(DISTINCT PACIENTE_KEY) as count
+        FROM {PATIENT_TABLE}
+        WHERE {category_condition(diagnoses, params)}
+        AND PACIENTE_KEY IS NOT NULL
+        GROUP BY CATEGORIA, ANIO_NACIMIENTO
+        """
+
+        cursor.execute(query, params)
+        age_counts: Dict[str, Dict[int, int]] = {diagnosis: {} for diagnosis in diagnoses or []}
+        for categoria, anio, count in cursor.fetchall():
+            by_age = age_counts.setdefault(categoria, {})
+            if anio is not None:
+                by_age[binning.as_of_year - anio] = count
+        return age_counts
+
+    def query_grain_counts(self, diagnoses: Optional[List[str]], binning: AgeBinning, edges: List[int],
+                           cursor: Any) -> Dict[str, ChartCounts]:
+        """
+        Recuentos de cada gráfico con unos límites de intervalo dados, en una sola consulta
+
+        El intervalo de cada fila se calcula en la base de datos a partir de
+        los límites; GROUPING SETS agrupa a la vez por sexo (sectores), por
+        año conocido y sexo (distribución por sexo), por intervalo (histograma)
+        y por intervalo y sexo (pirámide).
+        """
+        params: Dict[str, Any] = {"as_of": binning.as_of_year}
+        source = f"""
+            SELECT CATEGORIA, SEXO_COD, PACIENTE_KEY,
+                   CASE WHEN ANIO_NACIMIENTO IS NULL THEN 0 ELSE 1 END AS CON_ANIO,
+                   {interval_sql(edges, NEGATIVE_BUCKET, params)} AS INTERVALO,
+                   {interval_sql(edges, len(edges) - 1, params)} AS INTERVALO_HISTOGRAMA
+            FROM {PATIENT_TABLE}
+            WHERE {category_condition(diagnoses, params)}
+            AND PACIENTE_KEY IS NOT NULL
+        """
+        query = grouping_sets_sql(source, CHART_COLUMNS, list(CHART_GRAINS.values()),
+                                  "COUNT(DISTINCT PACIENTE_KEY) as count")
+
+        cursor.execute(query, params)
+        labels = interval_labels(edges)
+        counts: Dict[str, ChartCounts] = {}
+
+        def chart_counts(categoria):
+            if categoria not in counts:
+                counts[categoria] = {"labels": labels, **{chart: {} for chart in CHART_GRAINS}}
+            return counts[categoria]
+
+        for diagnosis in diagnoses or []:
+            chart_counts(diagnosis)
+        grains = list(CHART_GRAINS)
+        for grain, categoria, sexo, con_anio, intervalo, intervalo_histograma, count in cursor.fetchall():
+            chart = grains[grain]
+            by_chart = chart_counts(categoria)
+            if chart == "pie":
+                by_chart["pie"][sexo] = count
+            elif chart == "gender" and con_anio == 1:
+                by_chart["gender"][sexo] = count
+            elif chart == "histogram" and intervalo_histograma is not None:
+                by_chart["histogram"][intervalo_histograma] = count
+            elif chart == "pyramid" and intervalo is not None and intervalo != NEGATIVE_BUCKET:
+                by_chart["pyramid"][(intervalo, sexo)] = count
+        return counts
+
+    def get_batch_data(self, diagnoses: Optional[List[str]], charts: List[str],
+                       binning: Optional[AgeBinning] = None) -> Dict[str, Any]:
+        """
+        Obtiene los gráficos pedidos de varios diagnósticos con una sola agregación
+        Devuelve formato: {charts: [...], results: {diagnóstico: {gráfico: datos}}}
+        """
+        counts_by_diagnosis = self.get_batch_chart_counts(diagnoses, binning or AgeBinning())
+        data = {
+            "charts": list(charts),
+            "results": {
+                diagnosis: {chart: CHART_BUILDERS[chart](diagnosis, counts) for chart in charts}
+                for diagnosis, counts in sorted(counts_by_diagnosis.items())
+            }
+        }
+        count_mode, error = self.count_precision()
+        if count_mode == "approx":
+            data["count_mode"] = count_mode
+            data["relative_error"] = error
+        return data
+
+    def count_precision(self) -> Tuple[str, float]:
+        """
+        Modo de recuento de las visualizaciones y error relativo típico
+
+        Returns:
+            ('exact', 0.0), o ('approx', error) si los recuentos salen de un
+            cubo aproximado
+        """
+        if not self.use_cube:
+            return "exact", 0.0
+        cube = self.cube_cache.get_if_fresh()
+        if cube is not None:
+            return cube.count_mode, cube.relative_error
+        if self.count_mode == "approx":
+            return "approx", relative_error(self.hll_precision)
+        return "exact", 0.0
+
+    def get_dashboard_data(self, diagnosis: str, binning: Optional[AgeBinning] = None) -> Dict[str, Any]:
+        """
+        Obtiene todos los gráficos de un diagnóstico a partir de los mismos recuentos
+        Devuelve formato: {diagnosis, age_pyramid, age_histogram, gender_distribution, pie_chart}
+        """
+        return build_dashboard(diagnosis, self.get_chart_counts(diagnosis, binning or AgeBinning()))
+
+    def get_age_pyramid_data(self, diagnosis: str, binning: Optional[AgeBinning] = None) -> List[Dict[str, Any]]:
+        """
+        Obtiene datos para pirámide poblacional filtrada por diagnóstico usando intervalos de edad
+        Devuelve lista de objetos con formato: {intervalo: str, hombres: int, mujeres: int}
+        """
+        return build_age_pyramid(self.get_chart_counts(diagnosis, binning or AgeBinning()))
+
+    def get_age_histogram_data(self, diagnosis: str, binning: Optional[AgeBinning] = None) -> Dict[str, Any]:
+        """
+        Obtiene datos para histograma de distribución de edades
+        """
+        return build_age_histogram(diagnosis, self.get_chart_counts(diagnosis, binning or AgeBinning()))
+
+    def get_gender_distribution_data(self, diagnosis: str, binning: Optional[AgeBinning] = None) -> Dict[str, Any]:
+        """
+        Obtiene datos para distribución por sexo (no depende de los intervalos de edad)
+        """
+        return build_gender_distribution(diagnosis, self.get_chart_counts(diagnosis, binning or AgeBinning()))
+
+    def get_pie_chart_data(self, diagnosis: str, binning: Optional[AgeBinning] = None) -> Dict[str, int]:
         """
         Obtiene datos para diagrama de sectores por sexo
         Devuelve formato: {"Hombres": int, "Mujeres": int}
         """
-        connection = None
-        try:
-            connection = self.get_connection()
-            cursor = connection.cursor()
-            
-            query = """
-            SELECT 
-                SEXO,
-                COUNT(DISTINCT NOMBRE || '_' || CENTRO_RECODIFICADO) as count
-            FROM DATOS_ORIGINALES 
-            WHERE CATEGORIA = :diagnosis
-            AND SEXO IN ('1', '2')
-            AND NOMBRE IS NOT NULL
-            AND CENTRO_RECODIFICADO IS NOT NULL
-            GROUP BY SEXO
-            """
-            
-            cursor.execute(query, {"diagnosis": diagnosis})
-            results = cursor.fetchall()
-            
-            # Inicializar diccionario con valores por defecto
-            pie_data = {
-                "Hombres": 0,
-                "Mujeres": 0
-            }
-            
-            # Procesar resultados
-            for sexo, count in results:
-                if sexo == '1':  # Hombre
-                    pie_data["Hombres"] = count
-                elif sexo == '2':  # Mujer
-                    pie_data["Mujeres"] = count
-            
-            return pie_data
-            
-        except Exception as e:
-            print(f"Error en get_pie_chart_data: {str(e)}")
-            raise e
-        finally:
-            if connection:
-                connection.close()
\ No newline at end of file
+        return build_pie_chart(self.get_chart_counts(diagnosis, binning or AgeBinning()))
+
+
+# Columnas de agrupación de query_grain_counts y grano de cada gráfico
+# (mismas claves que ChartCounts)
+CHART_COLUMNS = ("CATEGORIA", "SEXO_COD", "CON_ANIO", "INTERVALO", "INTERVALO_HISTOGRAMA")
+CHART_GRAINS = {
+    "pie": ("CATEGORIA", "SEXO_COD"),
+    "gender": ("CATEGORIA", "CON_ANIO", "SEXO_COD"),
+    "histogram": ("CATEGORIA", "INTERVALO_HISTOGRAMA"),
+    "pyramid": ("CATEGORIA", "INTERVALO", "SEXO_COD"),
+}
+
+
+def category_condition(diagnoses: Optional[List[str]], params: Dict[str, Any]) -> str:
+    """Condición SQL de los diagnósticos pedidos (None: todos)"""
+    if diagnoses is None:
+        return "CATEGORIA IS NOT NULL"
+    return f"CATEGORIA IN ({in_list_binds('diagnosis', diagnoses, params)})"
+
+
+def interval_sql(edges: List[int], negative: int, params: Dict[str, Any]) -> str:
+    """
+    Índice del intervalo de edad de cada fila, como AgeBinning.bucket
+
+    Usa el bind :as_of y añade los límites a params. negative es el índice
+    de las edades negativas; los años desconocidos y las edades por debajo
+    del primer límite dan NULL.
+    """
+    age = "(:as_of - ANIO_NACIMIENTO)"
+    arms = [f"WHEN {age} < 0 THEN {negative}"]
+    for i in reversed(range(len(edges))):
+        params[f"edge_{i}"] = edges[i]
+        arms.append(f"WHEN {age} >= :edge_{i} THEN {i}")
+    return f"CASE {' '.join(arms)} END"
+
+
+def build_age_pyramid(counts: ChartCounts) -> List[Dict[str, Any]]:
+    """Pirámide: hombres y mujeres por intervalo, sin edades desconocidas ni negativas"""
+    return [
+        {
+            "intervalo": interval,
+            "hombres": counts["pyramid"].get((i, 1), 0),
+            "mujeres": counts["pyramid"].get((i, 2), 0)
+        }
+        for i, interval in enumerate(counts["labels"])
+    ]
+
+
+def build_age_histogram(diagnosis: str, counts: ChartCounts) -> Dict[str, Any]:
+    """Histograma: todos los sexos por intervalo (las edades negativas caen en el último)"""
+    return {
+        "age_groups": counts["labels"],
+        "counts": [counts["histogram"].get(i, 0) for i in range(len(counts["labels"]))],
+        "diagnosis": diagnosis
+    }
+
+
+def build_gender_distribution(diagnosis: str, counts: ChartCounts) -> Dict[str, Any]:
+    """Distribución por sexo de los pacientes con año de nacimiento conocido"""
+    male_count = counts["gender"].get(1, 0)
+    female_count = counts["gender"].get(2, 0)
+
+    return {
+        "male_count": male_count,
+        "female_count": female_count,
+        "total": male_count + female_count,
+        "diagnosis": diagnosis
+    }
+
+
+def build_pie_chart(counts: ChartCounts) -> Dict[str, int]:
+    """Sectores por sexo de todos los pacientes del diagnóstico"""
+    return {
+        "Hombres": counts["pie"].get(1, 0),
+        "Mujeres": counts["pie"].get(2, 0)
+    }
+
+
+def build_dashboard(diagnosis: str, counts: ChartCounts) -> Dict[str, Any]:
+    """Construye los cuatro gráficos de un diagnóstico a partir de los mismos recuentos"""
+    return {
+        "diagnosis": diagnosis,
+        "age_pyramid": build_age_pyramid(counts),
+        "age_histogram": build_age_histogram(diagnosis, counts),
+        "gender_distribution": build_gender_distribution(diagnosis, counts),
+        "pie_chart": build_pie_chart(counts)
+    }
+
+
+# Gráficos disponibles en /api/visualization/batch (mismas claves que el panel)
+CHART_BUILDERS = {
+    "age_pyramid": lambda diagnosis, counts: build_age_pyramid(counts),
+    "age_histogram": build_age_histogram,
+    "gender_distribution": build_gender_distribution,
+    "pie_chart": lambda diagnosis, counts: build_pie_chart(counts),
+}
@@ -0,0 +1,270 @@
+"""
+Script de prueba de paridad entre motores de datos
+
+Construye una base SQLite con datos sintéticos con la forma de
+DATOS_ORIGINALES y comprueba que filtrado, opciones y visualizaciones dan lo
+mismo por SQL, por el motor columnar, por el cubo y calculados a mano.
+
+Con PARITY_ORACLE=true y SQLITE_PATH apuntando a una base creada con un CSV
+exportado de DATOS_ORIGINALES, compara además Oracle con SQLite.
+"""
+
+import contextlib
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db.sqlite_backend import build_sqlite_database, normalize_row
+from services.age_binning import AgeBinning
+from services.columnar_engine import numpy_available
+from services.patient_filter_service import PatientFilterService
+from services.visualization_service import VisualizationService
+
+COMUNIDADES = ["ANDALUCÍA", "Andalucía", "CATALUÑA", "Madrid", "Región de Murcia"]
+CATEGORIAS = ["Esquizofrenia", "Trastornos del estado de ánimo", "Trastornos neuróticos"]
+CENTROS = [f"CENTRO_{i}" for i in range(6)]
+PATIENTS = 450
+MOVED_EVERY = 5
+REBORN_EVERY = 7
+RESEXED_EVERY = 11
+
+CHARTS = ["age_pyramid", "age_histogram", "gender_distribution", "pie_chart"]
+BINNINGS = [
+    AgeBinning(quantiles=4),
+    AgeBinning(edges=[18, 40, 65]),
+    AgeBinning(width=5, as_of="2030"),
+]
+
+FILTER_CASES = [
+    {},
+    {"comunidades": ["andalucía"]},
+    {"comunidades": ["CATALUÑA", "madrid"], "sexo": ["Mujer"]},
+    {"año_nacimiento_min": 1960, "año_nacimiento_max": 1990},
+    {"diagnosticos": ["Esquizofrenia"], "centros": ["CENTRO_1", "CENTRO_3"]},
+    {"sexo": ["Otros"]},
+    {"diagnosticos": ["No existe"]},
+]
+
+
+def synthetic_source(count: int = 600, seed: int = 7):
+    """
+    Filas con la forma de DATOS_ORIGINALES, incluidos valores que no se pueden convertir
+
+    Cada paciente (NOMBRE + CENTRO) tiene su sexo, fecha de nacimiento y
+    comunidad, y sus episodios pueden ser de distintos diagnósticos. Los
+    pacientes múltiplos de MOVED_EVERY tienen además un segundo episodio
+    del mismo diagnóstico en otra comunidad, los de REBORN_EVERY con otra
+    fecha de nacimiento y los de RESEXED_EVERY con otro sexo: están en
+    varias celdas del cubo o grupos de (año, sexo) y cada gráfico debe
+    contarlos una vez por intervalo y sexo.
+    """
+    rng = random.Random(seed)
+    patients = []
+    for p in range(PATIENTS):
+        year = rng.randint(30, 99) if rng.random() < 0.8 else rng.randint(0, 24)
+        patients.append({
+            "CIP_SNS_RECODIFICADO": f"CIP{p:05d}",
+            "NOMBRE": f"PACIENTE_{p:04d}",
+            "COMUNIDAD_AUTONOMA": rng.choice(COMUNIDADES),
+            "CENTRO_RECODIFICADO": rng.choice(CENTROS),
+            "SEXO": rng.choice(["1", "2", "1", "2", "9"]),
+            "FECHA_DE_NACIMIENTO": rng.choice([f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/{year:02d}", "13/45/99", ""]),
+            "year": year,
+        })
+
+    rows = []
+    for i in range(count):
+        p = i % PATIENTS
+        patient = dict(patients[p])
+        year = patient.pop("year")
+        row = {
+            **patient,
+            "CATEGORIA": rng.choice(CATEGORIAS),
+            "FECHA_DE_INGRESO": rng.choice(["12/03/2021", "3/25/21", "sin fecha"]),
+            "FECHA_DE_FIN_CONTACTO": rng.choice(["30/04/2021", "4/30/21", ""]),
+            "ESTANCIA_DIAS": rng.choice(["5", "12", "", "x"]),
+        }
+        if i >= PATIENTS and p % MOVED_EVERY == 0:
+            row["CATEGORIA"] = rows[p]["CATEGORIA"]
+            row["COMUNIDAD_AUTONOMA"] = next(c for c in COMUNIDADES if c != row["COMUNIDAD_AUTONOMA"])
+        if i >= PATIENTS and p % REBORN_EVERY == 0:
+            # Otro año, de otro intervalo de edad; o conocido si antes no lo era
+            row["CATEGORIA"] = rows[p]["CATEGORIA"]
+            row["FECHA_DE_NACIMIENTO"] = f"6/15/{(year + 11) % 100:02d}"
+        if i >= PATIENTS and p % RESEXED_EVERY == 0:
+            row["CATEGORIA"] = rows[p]["CATEGORIA"]
+            row["SEXO"] = {"1": "2", "2": "1"}.get(row["SEXO"], "1")
+        if i % 97 == 0:
+            row["NOMBRE"] = rng.choice(["", row["NOMBRE"]])
+        rows.append(row)
+    return rows
+
+
+def expected_dashboard(normalized, categoria):
+    """Gráficos con los intervalos por defecto calculados a mano, como las consultas originales por gráfico"""
+    rows = [r for r in normalized if r[4] == categoria and r[2] is not None and r[5] is not None]
+    labels = ["0-9", "10-19", "20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80+"]
+
+    def patients(keep):
+        return len({(r[2], r[5]) for r in rows if keep(r)})
+
+    def interval(r):
+        age = 2024 - r[8]
+        return len(labels) - 1 if age < 0 else min(age // 10, len(labels) - 1)
+
+    known = lambda r: r[8] is not None
+    male = patients(lambda r: known(r) and r[7] == 1)
+    female = patients(lambda r: known(r) and r[7] == 2)
+    return {
+        "diagnosis": categoria,
+        "age_pyramid": [
+            {
+                "intervalo": label,
+                "hombres": patients(lambda r: known(r) and 2024 - r[8] >= 0 and interval(r) == i and r[7] == 1),
+                "mujeres": patients(lambda r: known(r) and 2024 - r[8] >= 0 and interval(r) == i and r[7] == 2),
+            }
+            for i, label in enumerate(labels)
+        ],
+        "age_histogram": {
+            "age_groups": labels,
+            "counts": [patients(lambda r: known(r) and interval(r) == i) for i in range(len(labels))],
+            "diagnosis": categoria,
+        },
+        "gender_distribution": {"male_count": male, "female_count": female, "total": male + female,
+                                "diagnosis": categoria},
+        "pie_chart": {"Hombres": patients(lambda r: r[7] == 1), "Mujeres": patients(lambda r: r[7] == 2)},
+    }
+
+
+def expected_ids(normalized, filters):
+    """Filtrado hecho a mano sobre las filas normalizadas, en orden (NOMBRE, ID)"""
+    def keep(r):
+        if None in (r[8], r[2], r[3], r[4], r[5]):
+            return False
+        if filters.get("comunidades") and r[3].upper() not in {c.upper() for c in filters["comunidades"]}:
+            return False
+        if filters.get("año_nacimiento_min") is not None and r[8] < filters["año_nacimiento_min"]:
+            return False
+        if filters.get("año_nacimiento_max") is not None and r[8] > filters["año_nacimiento_max"]:
+            return False
+        if filters.get("sexo") and r[7] not in {{"hombre": 1, "mujer": 2}.get(s.lower(), 3) for s in filters["sexo"]}:
+            return False
+        if filters.get("diagnosticos") and r[4] not in filters["diagnosticos"]:
+            return False
+        if filters.get("centros") and r[5] not in filters["centros"]:
+            return False
+        return True
+    return [r[0] for r in sorted((r for r in normalized if keep(r)), key=lambda r: (r[2], r[0]))]
+
+
+def walk_ids(service, filters, rows_per_page=25):
+    """Recorre todas las páginas con cursor y devuelve los IDs y el total"""
+    ids, cursor, total = [], None, None
+    while True:
+        result = service.get_filtered_patients(filters, rows_per_page=rows_per_page, cursor=cursor)
+        total = result["total_records"] if total is None else total
+        ids += [p["id"] for p in result["data"]]
+        cursor = result["next_cursor"]
+        if not cursor:
+            return ids, total
+
+
+@contextlib.contextmanager
+def sqlite_database(source, **env):
+    """
+    Base SQLite temporal con las filas de source y el entorno que la usa
+
+    Devuelve (ruta, monkeypatch): DB_BACKEND, SQLITE_PATH, COLUMNAR_ENGINE
+    y env se definen con el monkeypatch, y lo que el test cambie con él
+    (variables de entorno, servicios de main) se deshace al salir.
+    """
+    with tempfile.TemporaryDirectory() as tmp, pytest.MonkeyPatch.context() as monkeypatch:
+        path = os.path.join(tmp, "pacientes.sqlite3")
+        build_sqlite_database(source, path)
+        for key, value in {"DB_BACKEND": "sqlite", "SQLITE_PATH": path, "COLUMNAR_ENGINE": "false", **env}.items():
+            monkeypatch.setenv(key, value)
+        yield path, monkeypatch
+
+
+def test_sqlite_parity():
+    """SQL sobre SQLite frente a cálculo a mano, motor columnar y cubo"""
+    print("🧪 PROBANDO PARIDAD DEL MOTOR SQLITE")
+    print("=" * 50)
+
+    source = synthetic_source()
+    normalized = [normalize_row(i, row) for i, row in enumerate(
+        ({k: (v if v != "" else None) for k, v in r.items()} for r in source), start=1)]
+
+    with sqlite_database(source) as (_path, monkeypatch):
+        sql_service = PatientFilterService()
+        for filters in FILTER_CASES:
+            ids, total = walk_ids(sql_service, filters)
+            expected = expected_ids(normalized, filters)
+            assert ids == expected and total == len(expected), f"Filtrado distinto para {filters}"
+            page = sql_service.get_filtered_patients(filters, page=2, rows_per_page=10)
+            assert [p["id"] for p in page["data"]] == expected[10:20]
+        print(f"   ✅ {len(FILTER_CASES)} combinaciones de filtros coinciden con el cálculo a mano")
+
+        options = sql_service.get_filter_options()
+        assert options["comunidades"] == sorted({r[3] for r in normalized if r[3]})
+        assert options["año_nacimiento_range"]["min"] == min(r[8] for r in normalized if r[8])
+        print("   ✅ Opciones de filtro coinciden")
+
+        if numpy_available():
+            monkeypatch.setenv("COLUMNAR_ENGINE", "true")
+            columnar_service = PatientFilterService()
+            columnar_service.columnar_cache.refresh()
+            for filters in FILTER_CASES:
+                assert walk_ids(columnar_service, filters) == walk_ids(sql_service, filters)
+            print("   ✅ Motor columnar coincide con SQL")
+
+        visualization = VisualizationService()
+        visualization.use_cube = False
+        by_query = {c: visualization.get_dashboard_data(c) for c in CATEGORIAS}
+        batch = visualization.get_batch_data(None, ["pie_chart"])["results"]
+        binned = {b.key: (b, visualization.get_batch_data(None, CHARTS, b)) for b in BINNINGS}
+        visualization.use_cube = True
+        for categoria in CATEGORIAS:
+            expected = expected_dashboard(normalized, categoria)
+            assert by_query[categoria] == expected, f"Consulta distinta del cálculo a mano para {categoria}"
+            assert visualization.get_dashboard_data(categoria) == expected, f"Cubo distinto para {categoria}"
+            assert batch[categoria]["pie_chart"] == expected["pie_chart"]
+        # Los pacientes con episodios en dos celdas sumarían dos veces
+        cube = visualization.cube_cache.get()[0]
+        assert sum(cube.cells.values()) > sum(cube.rollup(["categoria", "sexo", "anio_nacimiento", "centro"]).values())
+        assert sum(cube.cells.values()) > sum(cube.rollup(["categoria"]).values())
+        print("   ✅ Visualizaciones por consulta, por lotes y por cubo coinciden con el cálculo a mano")
+
+        for binning, by_query_batch in binned.values():
+            assert visualization.get_batch_data(None, CHARTS, binning) == by_query_batch
+            for categoria in CATEGORIAS:
+                dashboard = visualization.get_dashboard_data(categoria, binning)
+                assert {chart: dashboard[chart] for chart in CHARTS} == by_query_batch["results"][categoria]
+        print(f"   ✅ {len(BINNINGS)} agrupaciones de edad coinciden por consulta y por cubo")
+
+
+def compare_with_oracle():
+    """Compara Oracle con la base SQLite de SQLITE_PATH (mismos datos de origen)"""
+    results = {}
+    for backend in ("oracle", "sqlite"):
+        os.environ["DB_BACKEND"] = backend
+        service, visualization = PatientFilterService(), VisualizationService()
+        visualization.use_cube = False
+        results[backend] = (
+            [service.get_filtered_patients(f, page=1, rows_per_page=50) for f in FILTER_CASES],
+            service.load_filter_options(),
+            visualization.get_batch_data(None, ["age_pyramid", "age_histogram", "pie_chart"]),
+        )
+    assert results["oracle"] == results["sqlite"], "Oracle y SQLite devuelven resultados distintos"
+    print("   ✅ Oracle y SQLite devuelven los mismos resultados")
+
+
+if __name__ == "__main__":
+    test_sqlite_parity()
+    if os.getenv("PARITY_ORACLE", "false").lower() == "true":
+        compare_with_oracle()
@@ -0,0 +1,128 @@
+"""
+Script de prueba de los índices bitmap
+
+Compara el filtrado por SQL (SQLite), por máscaras del motor columnar y por
+índices bitmap con combinaciones de filtros aleatorias: mismo total, mismas
+páginas por número y mismos recorridos con cursor hacia delante y hacia
+atrás. Comprueba también rank y select de Bitmap frente a NumPy.
+"""
+
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.columnar_engine import numpy_available
+from services.patient_filter_service import PatientFilterService
+from test_backend_parity import CATEGORIAS, CENTROS, COMUNIDADES, sqlite_database, synthetic_source
+
+RANDOM_CASES = 40
+
+
+def random_filters(rng: random.Random) -> dict:
+    """Combinación de filtros al azar, con valores en otra capitalización o que no existen"""
+    filters = {}
+    if rng.random() < 0.5:
+        filters["comunidades"] = rng.sample(COMUNIDADES + ["madrid", "Galicia"], rng.randint(1, 3))
+    if rng.random() < 0.5:
+        low = rng.randint(1925, 2000)
+        filters["año_nacimiento_min"] = low
+        filters["año_nacimiento_max"] = low + rng.randint(0, 40)
+    elif rng.random() < 0.3:
+        filters["año_nacimiento_max"] = rng.randint(1925, 2000)
+    if rng.random() < 0.5:
+        filters["sexo"] = rng.sample(["Hombre", "Mujer", "Otros"], rng.randint(1, 2))
+    if rng.random() < 0.5:
+        filters["diagnosticos"] = rng.sample(CATEGORIAS + ["No existe"], rng.randint(1, 2))
+    if rng.random() < 0.5:
+        filters["centros"] = rng.sample(CENTROS, rng.randint(1, 4))
+    return filters
+
+
+def cursor_walks(service, filters, rows_per_page):
+    """IDs por página hacia delante desde la primera y hacia atrás desde la última, y el total"""
+    first = service.get_filtered_page(filters, 1, rows_per_page)
+    forward = [first]
+    while forward[-1]["next_cursor"]:
+        forward.append(service.get_filtered_page(filters, 1, rows_per_page, forward[-1]["next_cursor"]))
+    backward = [forward[-1]]
+    while backward[-1]["prev_cursor"]:
+        backward.append(service.get_filtered_page(filters, 1, rows_per_page, backward[-1]["prev_cursor"]))
+    ids = [[row[0] for row in page["rows"]] for page in forward]
+    back_ids = [[row[0] for row in page["rows"]] for page in reversed(backward)]
+    return ids, back_ids, first["total_records"]
+
+
+def test_bitmap_primitives():
+    """rank y select de Bitmap frente a flatnonzero sobre máscaras aleatorias"""
+    if not numpy_available():
+        print("   ⚠️ NumPy no disponible: se omiten los índices bitmap")
+        return
+    import numpy as np
+    from services.bitmap_index import Bitmap
+
+    print("🧪 PROBANDO OPERACIONES DE BITMAP")
+    print("=" * 50)
+    rng = np.random.default_rng(3)
+    for size in (1, 63, 64, 65, 1000, 4099):
+        for density in (0.0, 0.05, 0.5, 1.0):
+            mask = rng.random(size) < density
+            other = rng.random(size) < 0.5
+            bitmap, other_bitmap = Bitmap.from_mask(mask), Bitmap.from_mask(other)
+            positions = np.flatnonzero(mask)
+            assert bitmap.cardinality() == positions.size
+            assert (bitmap & other_bitmap).cardinality() == int((mask & other).sum())
+            assert (bitmap | other_bitmap).cardinality() == int((mask | other).sum())
+            assert bitmap.and_not(other_bitmap).cardinality() == int((mask & ~other).sum())
+            for position in (0, size // 3, size - 1, size):
+                assert bitmap.rank(position) == int(mask[:position].sum())
+            for start in (0, positions.size // 2, max(positions.size - 3, 0), positions.size):
+                assert list(bitmap.select(start, 7)) == list(positions[start:start + 7])
+    print("   ✅ Cardinalidad, AND/OR/AND NOT, rank y select coinciden con NumPy")
+
+
+def test_bitmap_parity():
+    """SQL, máscaras columnares e índices bitmap con filtros aleatorios"""
+    if not numpy_available():
+        print("   ⚠️ NumPy no disponible: se omiten los índices bitmap")
+        return
+
+    print("🧪 PROBANDO PARIDAD DE LOS ÍNDICES BITMAP")
+    print("=" * 50)
+
+    with sqlite_database(synthetic_source(1500, seed=5)) as (_path, monkeypatch):
+        services = {"sql": PatientFilterService()}
+        monkeypatch.setenv("COLUMNAR_ENGINE", "true")
+        monkeypatch.setenv("BITMAP_INDEX", "false")
+        services["columnar"] = PatientFilterService()
+        monkeypatch.setenv("BITMAP_INDEX", "true")
+        services["bitmap"] = PatientFilterService()
+        for name in ("columnar", "bitmap"):
+            snapshot, _version = services[name].columnar_cache.refresh()
+            assert (snapshot.bitmap_index is not None) == (name == "bitmap")
+
+        rng = random.Random(13)
+        non_empty = 0
+        for _ in range(RANDOM_CASES):
+            filters = random_filters(rng)
+            rows_per_page = rng.randint(1, 60)
+            expected_ids, expected_back, expected_total = cursor_walks(services["sql"], filters, rows_per_page)
+            assert expected_back == expected_ids
+            assert sum(len(ids) for ids in expected_ids) == expected_total
+            non_empty += expected_total > 0
+            page = rng.randint(1, len(expected_ids) + 1)
+            for name in ("columnar", "bitmap"):
+                ids, back_ids, total = cursor_walks(services[name], filters, rows_per_page)
+                assert (ids, back_ids, total) == (expected_ids, expected_back, expected_total), (name, filters)
+                numbered = services[name].get_filtered_page(filters, page, rows_per_page)
+                expected_page = expected_ids[page - 1] if page <= len(expected_ids) else []
+                assert [row[0] for row in numbered["rows"]] == expected_page, (name, filters, page)
+        assert non_empty > RANDOM_CASES // 2
+        print(f"   ✅ {RANDOM_CASES} combinaciones aleatorias ({non_empty} no vacías): "
+              "SQL, columnar y bitmap coinciden")
+
+
+if __name__ == "__main__":
+    test_bitmap_primitives()
+    test_bitmap_parity()
@@ -0,0 +1,108 @@
+"""
+Script de prueba del arranque en frío (función serverless de Vercel)
+
+Importa main en un proceso nuevo, sin base de datos y con una instantánea de
+arranque, y mide cuánto tarda en responder /api/filter-options. Comprueba que
+oracledb, NumPy y PyArrow no se importan en ese camino. El tiempo propio de
+la aplicación (sin contar la importación de FastAPI) solo se informa; si se
+define COLD_START_BUDGET_MS se exige además que quede por debajo.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY_MODULES = ["oracledb", "numpy", "pyarrow"]
+
+# Proceso hijo: una invocación en frío sin lifespan, como en serverless
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+import fastapi.testclient
+framework = time.perf_counter()
+import main
+imported = time.perf_counter()
+client = fastapi.testclient.TestClient(main.app)
+options = client.get("/api/filter-options")
+answered = time.perf_counter()
+dashboard = client.get("/api/visualization/dashboard", params={"diagnosis": "Esquizofrenia"})
+print(json.dumps({
+    "framework_ms": (framework - start) * 1000,
+    "import_ms": (imported - framework) * 1000,
+    "first_request_ms": (answered - imported) * 1000,
+    "options_status": options.status_code,
+    "options": options.json(),
+    "dashboard_status": dashboard.status_code,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def write_test_snapshot(path):
+    """Instantánea mínima con el formato de services.startup_snapshot"""
+    snapshot = {
+        "format": 3,
+        "created_at": time.time(),
+        "filter_options": {
+            "comunidades": ["Andalucía", "Madrid"],
+            "sexos": ["Hombre", "Mujer", "Otros"],
+            "diagnosticos": ["Esquizofrenia"],
+            "centros": ["CENTRO_1"],
+            "año_nacimiento_range": {"min": 1950, "max": 2005},
+        },
+        "cube": [
+            ["Esquizofrenia", 1, 1990, "Madrid", "CENTRO_1", [1, 2, 3, 4]],
+            ["Esquizofrenia", 2, 1978, "Andalucía", "CENTRO_1", [5, 6, 7]],
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    return snapshot
+
+
+def test_cold_start():
+    """Primera petición de un proceso nuevo servida desde la instantánea de arranque"""
+    print("🧪 PROBANDO ARRANQUE EN FRÍO")
+    print("=" * 50)
+
+    budget = os.getenv("COLD_START_BUDGET_MS")
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "startup_snapshot.json")
+        snapshot = write_test_snapshot(snapshot_path)
+        env = {
+            **os.environ,
+            "STARTUP_SNAPSHOT_PATH": snapshot_path,
+            "DB_BACKEND": "oracle",
+            "COLUMNAR_ENGINE": "false",
+            "SLOW_QUERY_LOG_FILE": "",
+        }
+        completed = subprocess.run([sys.executable, "-c", CHILD], cwd=SERVER_DIR, env=env,
+                                   capture_output=True, text=True, timeout=120)
+        assert completed.returncode == 0, completed.stderr
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(f"   Importar FastAPI: {result['framework_ms']:.0f} ms")
+    print(f"   Importar main: {result['import_ms']:.0f} ms")
+    print(f"   Primera respuesta de /api/filter-options: {result['first_request_ms']:.0f} ms")
+
+    assert result["options_status"] == 200 and result["options"] == snapshot["filter_options"]
+    assert result["dashboard_status"] == 200
+    assert not result["loaded"], f"Módulos pesados importados en el arranque: {result['loaded']}"
+    print(f"   ✅ Sin {', '.join(HEAVY_MODULES)} y servido desde la instantánea")
+
+    elapsed_ms = result["import_ms"] + result["first_request_ms"]
+    if budget:
+        # Solo con un presupuesto explícito: el tiempo depende de la carga de la máquina
+        budget_ms = float(budget)
+        assert elapsed_ms < budget_ms, f"Arranque en frío de {elapsed_ms:.0f} ms (presupuesto {budget_ms:.0f} ms)"
+        print(f"   ✅ {elapsed_ms:.0f} ms de {budget_ms:.0f} ms de presupuesto")
+    else:
+        print(f"   ⏱️ {elapsed_ms:.0f} ms (sin presupuesto: defina COLD_START_BUDGET_MS para exigirlo)")
+
+
+if __name__ == "__main__":
+    test_cold_start()
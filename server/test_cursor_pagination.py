@@ -0,0 +1,136 @@
+"""
+Script de prueba de la paginación por cursor
+
+Comprueba que los cursores se codifican y decodifican sin pérdida, que los
+cursores no válidos dan InvalidCursorError (y 400 en la API, no 500) y que
+recorrer las páginas con next_cursor y prev_cursor, en el servicio y en la
+API (200 con cursores válidos), da lo mismo que la paginación por número de
+página.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.patient_filter_service import (
+    InvalidCursorError, PatientFilterService, decode_cursor, encode_cursor
+)
+from test_backend_parity import sqlite_database, synthetic_source
+
+
+def valid_source():
+    """Filas sintéticas que validan como PatientRecord (con fecha de fin de contacto)"""
+    return [{**row, "FECHA_DE_FIN_CONTACTO": row["FECHA_DE_FIN_CONTACTO"] or "30/04/2021"}
+            for row in synthetic_source()]
+
+
+def page_ids(pages):
+    """IDs de cada página (las filas por número llevan además el total)"""
+    return [[row[0] for row in page["rows"]] for page in pages]
+
+
+BAD_CURSORS = [
+    "no es base64 !!",
+    encode_cursor("PACIENTE", 1, "next")[:-3],  # Truncado
+    "WyJQQUNJRU5URSIsIDEsICJhcnJpYmEiXQ",  # ["PACIENTE", 1, "arriba"]
+    "WyJQQUNJRU5URSIsICJ1bm8iLCAibmV4dCJd",  # ["PACIENTE", "uno", "next"]
+    "WzEsIDEsICJuZXh0Il0",  # [1, 1, "next"]
+    "WyJQQUNJRU5URSIsIDEsICJuZXh0IiwgMTAsIDExXQ",  # ["PACIENTE", 1, "next", 10, 11]
+    "eyJub21icmUiOiAiUEFDSUVOVEUifQ",  # {"nombre": "PACIENTE"}
+]
+
+
+def test_cursor_round_trip():
+    """Codificar y decodificar un cursor devuelve la misma posición"""
+    print("🧪 PROBANDO CODIFICACIÓN DE CURSORES")
+    print("=" * 50)
+
+    cases = [
+        ("PACIENTE_0001", 1, "next", None),
+        ("NÚÑEZ, MARÍA JOSÉ", 123456789, "prev", 4321),
+        ("", 0, "next", 0),
+    ]
+    for nombre, patient_id, direction, total in cases:
+        cursor = encode_cursor(nombre, patient_id, direction, total)
+        assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+        assert decode_cursor(cursor) == (nombre, patient_id, direction, total)
+    print(f"   ✅ {len(cases)} cursores decodificados sin pérdida")
+
+    for cursor in BAD_CURSORS:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursorError:
+            continue
+        raise AssertionError(f"Cursor aceptado: {cursor}")
+    print(f"   ✅ {len(BAD_CURSORS)} cursores no válidos rechazados")
+
+
+def test_cursor_walk():
+    """Recorrido con cursores hacia delante y hacia atrás frente a páginas por número"""
+    print("🧪 PROBANDO RECORRIDO CON CURSORES")
+    print("=" * 50)
+
+    with sqlite_database(valid_source()) as (_path, monkeypatch):
+        service = PatientFilterService()
+        filters = {"sexo": ["Mujer", "Hombre"]}
+        rows_per_page = 17
+
+        pages = [service.get_filtered_page(filters, 1, rows_per_page)]
+        while pages[-1]["has_more"]:
+            pages.append(service.get_filtered_page(filters, len(pages) + 1, rows_per_page))
+        total = pages[0]["total_records"]
+        assert sum(len(p["rows"]) for p in pages) == total and len(pages) > 3
+
+        forward = [pages[0]]
+        while forward[-1]["next_cursor"]:
+            forward.append(service.get_filtered_page(filters, 1, rows_per_page, forward[-1]["next_cursor"]))
+        assert page_ids(forward) == page_ids(pages)
+        # El total se cuenta en la primera página y viaja en los cursores
+        assert all(p["total_records"] == total and p["total_is_exact"] for p in forward)
+        print(f"   ✅ {len(forward)} páginas hacia delante iguales a las páginas por número")
+
+        backward = [forward[-1]]
+        while backward[-1]["prev_cursor"]:
+            backward.append(service.get_filtered_page(filters, 1, rows_per_page, backward[-1]["prev_cursor"]))
+        assert page_ids(reversed(backward)) == page_ids(pages)
+        assert not backward[-1]["prev_cursor"] or not backward[-1]["rows"]
+        print(f"   ✅ {len(backward)} páginas hacia atrás iguales a las páginas por número")
+
+        uncounted = service.get_filtered_page(filters, 1, rows_per_page, exact_count=False)
+        following = service.get_filtered_page(filters, 1, rows_per_page, uncounted["next_cursor"])
+        assert not uncounted["total_is_exact"] and not following["total_is_exact"]
+        assert page_ids([following]) == page_ids(pages[1:2])
+        print("   ✅ Sin recuento exacto los cursores tampoco cuentan")
+
+        from fastapi.testclient import TestClient
+        import main
+
+        monkeypatch.setitem(main._services, "filter", service)
+        client = TestClient(main.app)
+        for cursor in BAD_CURSORS:
+            response = client.post("/api/filter-patients", json={"cursor": cursor})
+            assert response.status_code == 400, (cursor, response.status_code)
+        print(f"   ✅ La API responde 400 a {len(BAD_CURSORS)} cursores no válidos")
+
+        body = {"sexo": ["Mujer", "Hombre"], "rows_per_page": rows_per_page}
+        by_number, by_cursor = [], []
+        response = client.post("/api/filter-patients", json=body)
+        while True:
+            assert response.status_code == 200, response.text
+            page = response.json()
+            by_cursor.append([p["id"] for p in page["data"]])
+            if not page["next_cursor"]:
+                break
+            response = client.post("/api/filter-patients", json={**body, "cursor": page["next_cursor"]})
+        for number in range(1, len(by_cursor) + 1):
+            response = client.post("/api/filter-patients", json={**body, "page": number})
+            assert response.status_code == 200, response.text
+            by_number.append([p["id"] for p in response.json()["data"]])
+        assert by_cursor == by_number and len(by_cursor) > 3
+        print(f"   ✅ La API responde 200 a los cursores válidos ({len(by_cursor)} páginas)")
+
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_cursor_walk()
@@ -0,0 +1,112 @@
+"""
+Script de prueba de los sketches HyperLogLog
+
+Comprueba que el recuento es exacto mientras el sketch es disperso, que
+combinar sketches da lo mismo que contar la unión (también mezclando
+representación dispersa y densa) y que el error de la estimación está
+dentro de lo esperado: con precisión 14 (error típico 0,81 %) el error
+medio queda por debajo del 1 % y ningún sketch se aleja más de 3 veces el
+error típico.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.hyperloglog import HyperLogLog, relative_error
+
+ACCURACY_PRECISION = 14
+ACCURACY_SETS = 8
+ACCURACY_SIZE = 100_000
+
+
+def registers(sketch: HyperLogLog) -> bytes:
+    """Registros densos de una copia del sketch"""
+    dense = sketch.copy()
+    if dense.is_exact:
+        dense._to_dense()
+    return bytes(dense._registers)
+
+
+def test_exact_while_sparse():
+    """Recuento exacto con pocos pacientes"""
+    print("🧪 PROBANDO HYPERLOGLOG")
+    print("=" * 50)
+
+    sketch = HyperLogLog(12)
+    sketch.update(range(500))
+    sketch.update(range(250, 512))  # Claves repetidas
+    assert sketch.is_exact and sketch.count() == 512 and sketch.relative_error() == 0.0
+    sketch.add(512)
+    assert not sketch.is_exact and sketch.relative_error() == relative_error(12)
+    print("   ✅ Exacto mientras es disperso y denso al superar m/8 claves")
+
+    try:
+        HyperLogLog(12).merge(HyperLogLog(10))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Se combinaron sketches de distinta precisión")
+    for precision in (3, 17):
+        try:
+            HyperLogLog(precision)
+        except ValueError:
+            continue
+        raise AssertionError(f"Precisión {precision} aceptada")
+    print("   ✅ Precisiones no válidas rechazadas")
+
+
+def test_merge_equals_union():
+    """Combinar sketches da los mismos registros que contar la unión"""
+    cases = [
+        (range(0, 100), range(50, 300)),  # Disperso con disperso
+        (range(0, 100), range(0, 20_000)),  # Disperso con denso
+        (range(0, 20_000), range(15_000, 16_000)),  # Denso con disperso
+        (range(0, 20_000), range(10_000, 60_000)),  # Denso con denso
+        (range(0, 400), range(300, 700)),  # La unión de dos dispersos pasa a densa
+    ]
+    for left, right in cases:
+        union = HyperLogLog(12).update(left).update(right)
+        merged = HyperLogLog(12).update(left).merge(HyperLogLog(12).update(right))
+        reverse = HyperLogLog(12).update(right).merge(HyperLogLog(12).update(left))
+        assert merged.count() == reverse.count() == union.count()
+        assert registers(merged) == registers(reverse) == registers(union)
+    print(f"   ✅ {len(cases)} combinaciones iguales a la unión, en cualquier orden")
+
+    parts = [HyperLogLog(12).update(range(i * 5_000, (i + 1) * 5_000)) for i in range(10)]
+    total = HyperLogLog(12)
+    for part in parts:
+        total.merge(part)
+    assert total.count() == HyperLogLog(12).update(range(50_000)).count()
+    assert parts[0].count() == HyperLogLog(12).update(range(5_000)).count()  # merge no modifica el otro
+    copy = parts[1].copy().merge(parts[2])
+    assert parts[1].count() == HyperLogLog(12).update(range(5_000, 10_000)).count()
+    assert copy.count() == HyperLogLog(12).update(range(5_000, 15_000)).count()
+    print("   ✅ Agregar sketches por celda da lo mismo que un sketch global")
+
+
+def test_accuracy():
+    """Error relativo frente al recuento exacto"""
+    typical = relative_error(ACCURACY_PRECISION)
+    errors = []
+    for i in range(ACCURACY_SETS):
+        start = i * 10_000_000
+        sketch = HyperLogLog(ACCURACY_PRECISION).update(range(start, start + ACCURACY_SIZE))
+        errors.append(abs(sketch.count() - ACCURACY_SIZE) / ACCURACY_SIZE)
+    mean_error = sum(errors) / len(errors)
+    assert max(errors) < 3 * typical, errors
+    assert mean_error < 0.01, errors
+    print(f"   ✅ Error medio {mean_error * 100:.2f} % y máximo {max(errors) * 100:.2f} % "
+          f"(típico {typical * 100:.2f} %) con {ACCURACY_SIZE} claves")
+
+    keys = [f"PACIENTE_{i:06d}" for i in range(ACCURACY_SIZE)]
+    estimate = HyperLogLog(ACCURACY_PRECISION).update(keys).count()
+    assert abs(estimate - ACCURACY_SIZE) / ACCURACY_SIZE < 3 * typical
+    print("   ✅ Mismo error con claves de texto")
+
+
+if __name__ == "__main__":
+    test_exact_while_sparse()
+    test_merge_equals_union()
+    test_accuracy()
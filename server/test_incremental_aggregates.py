@@ -0,0 +1,84 @@
+"""
+Script de prueba de la actualización incremental de agregados
+
+Construye una base SQLite con parte de los datos sintéticos, carga el cubo
+(exacto y aproximado) y el catálogo de filtros, añade el resto de episodios a
+DATOS_ORIGINALES y comprueba que actualizar desde la marca de agua da lo
+mismo que recalcular sobre toda la tabla.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db.sqlite_backend import append_sqlite_rows, connect
+from services.patient_filter_service import PatientFilterService
+from services.visualization_service import VisualizationService
+from test_backend_parity import sqlite_database, synthetic_source
+
+
+def appended_source(count: int = 300):
+    """Episodios nuevos: pacientes ya contados en la misma celda, pacientes nuevos y valores de filtro que no existían"""
+    previous = synthetic_source()
+    rows = synthetic_source(count, seed=11)
+    for i, row in enumerate(rows):
+        if i % 3 == 0:
+            row["NOMBRE"] = f"PACIENTE_NUEVO_{i:04d}"
+        elif i % 3 == 1:
+            rows[i] = {**previous[i], "FECHA_DE_INGRESO": "1/15/24"}
+        if i % 50 == 0:
+            row["COMUNIDAD_AUTONOMA"] = "Galicia"
+            row["CENTRO_RECODIFICADO"] = "CENTRO_NUEVO"
+    rows[1]["FECHA_DE_NACIMIENTO"] = "1/1/1920"  # 1920, por debajo del mínimo anterior
+    return rows
+
+
+def test_incremental_aggregates():
+    """Cubo y catálogo actualizados con las filas nuevas frente a recalculados"""
+    print("🧪 PROBANDO AGREGADOS INCREMENTALES")
+    print("=" * 50)
+
+    with sqlite_database(synthetic_source(), VIS_COUNT_MODE="exact") as (path, monkeypatch):
+        filters = PatientFilterService()
+        exact = VisualizationService()
+        monkeypatch.setenv("VIS_COUNT_MODE", "approx")
+        approx = VisualizationService()
+        for cache in (filters.options_cache, exact.cube_cache, approx.cube_cache):
+            cache.refresh()
+        old_options = filters.get_filter_options()
+
+        with connect(path) as connection:
+            # Sin un INGEST_ID que no se reutiliza, el primer episodio nuevo
+            # tomaría el identificador de esta fila y quedaría por debajo de la marca
+            connection.execute(
+                "DELETE FROM DATOS_ORIGINALES WHERE INGEST_ID = (SELECT MAX(INGEST_ID) FROM DATOS_ORIGINALES)"
+            )
+            connection.commit()
+        added = append_sqlite_rows(appended_source(), path)
+        with connect(path) as connection:
+            pairs = connection.execute("""
+                SELECT COUNT(DISTINCT PACIENTE_KEY), COUNT(DISTINCT NOMBRE || '_' || CENTRO_RECODIFICADO)
+                FROM PACIENTES_NORMALIZADOS WHERE PACIENTE_KEY IS NOT NULL
+            """).fetchone()
+        assert added == 300 and pairs[0] == pairs[1], "Claves de paciente incoherentes tras la carga"
+        print(f"   ✅ {added} episodios nuevos normalizados con claves de paciente coherentes")
+
+        for service in (exact, approx):
+            cube, _version = service.cube_cache.refresh()
+            rebuilt = service.load_cube()
+            assert service.cube_cache.incremental_updates == 1
+            assert cube.cells == rebuilt.cells and cube.high_water_mark == rebuilt.high_water_mark
+            for categoria in rebuilt.categorias():
+                assert cube.year_sex_counts(categoria) == rebuilt.year_sex_counts(categoria)
+            print(f"   ✅ Cubo {service.count_mode} actualizado igual que reconstruido")
+
+        catalog, _version = filters.options_cache.refresh()
+        assert catalog.options == filters.load_filter_options() != old_options
+        assert "Galicia" in catalog.options["comunidades"]
+        assert catalog.options["año_nacimiento_range"]["min"] == 1920
+        print("   ✅ Catálogo de filtros actualizado igual que recalculado")
+
+
+if __name__ == "__main__":
+    test_incremental_aggregates()
@@ -0,0 +1,132 @@
+"""
+Script de prueba de la caché de resultados de visualización
+
+Con un reloj simulado comprueba los tres estados de una entrada (fresca,
+caducada dentro del margen stale-while-revalidate y expirada), que el
+recálculo en segundo plano se lanza una sola vez, el desalojo LRU y que el
+ETag depende solo del contenido. Sobre SQLite comprueba además el 304 de la
+API con If-None-Match.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import services.result_cache as result_cache
+from services.result_cache import ResultCache
+from test_backend_parity import CATEGORIAS, sqlite_database, synthetic_source
+
+
+class FakeClock:
+    """Sustituye al módulo time en services.result_cache"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Tiempo de espera agotado"
+        time.sleep(0.001)
+
+
+def test_stale_while_revalidate():
+    """Fresco, stale con recálculo en segundo plano y expirado"""
+    print("🧪 PROBANDO STALE-WHILE-REVALIDATE")
+    print("=" * 50)
+
+    clock = FakeClock()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(result_cache, "time", clock)
+        cache = ResultCache(ttl=60, stale_ttl=300, max_entries=2, name="test")
+        calls = []
+        release = threading.Event()
+        release.set()
+
+        def loader():
+            release.wait(5)
+            calls.append(len(calls))
+            return {"version": len(calls)}
+
+        value, etag = cache.get("a", loader)
+        assert value == {"version": 1} and len(calls) == 1
+        clock.now += 59
+        assert cache.get("a", loader) == (value, etag) and len(calls) == 1
+        print("   ✅ Dentro del TTL se sirve sin recalcular")
+
+        clock.now += 2
+        release.clear()
+        for _ in range(5):
+            # Se sirve el valor antiguo mientras se recalcula una sola vez
+            assert cache.get("a", loader) == (value, etag)
+        assert cache.stats()["refreshing"] == 1
+        release.set()
+        wait_until(lambda: cache.stats()["refreshing"] == 0)
+        new_value, new_etag = cache.get("a", loader)
+        assert new_value == {"version": 2} and new_etag != etag and len(calls) == 2
+        assert cache.stats()["stale_hits"] == 5
+        print("   ✅ Caducado se sirve el valor antiguo y se recalcula una vez en segundo plano")
+
+        clock.now += 60 + 300
+        assert cache.get("a", loader)[0] == {"version": 3} and len(calls) == 3
+        print("   ✅ Pasado el margen se recalcula en la petición")
+
+        cache.get("b", loader)
+        cache.get("a", loader)
+        cache.get("c", loader)  # Desaloja b, la usada hace más tiempo
+        before = len(calls)
+        cache.get("a", loader)
+        cache.get("b", loader)
+        assert len(calls) == before + 1 and cache.stats()["evictions"] >= 1
+        print("   ✅ Desalojo LRU al superar max_entries")
+
+
+def test_etag():
+    """El ETag solo depende del contenido"""
+    first = ResultCache.compute_etag({"Hombres": 3, "Mujeres": 4, "labels": ["0-9", "10-19"]})
+    same = ResultCache.compute_etag({"labels": ["0-9", "10-19"], "Mujeres": 4, "Hombres": 3})
+    other = ResultCache.compute_etag({"Hombres": 3, "Mujeres": 5, "labels": ["0-9", "10-19"]})
+    assert first == same != other
+    print("   ✅ ETag igual para el mismo contenido y distinto si cambia")
+
+
+def test_not_modified():
+    """La API responde 304 con el ETag vigente y 200 con otro"""
+    print("🧪 PROBANDO ETAG Y 304")
+    print("=" * 50)
+
+    with sqlite_database(synthetic_source()) as (_path, monkeypatch):
+        from fastapi.testclient import TestClient
+        import main
+        from services.visualization_service import VisualizationService
+
+        monkeypatch.setitem(main._services, "visualization", VisualizationService())
+        client = TestClient(main.app)
+        url = "/api/visualization/gender-distribution"
+        params = {"diagnosis": CATEGORIAS[0]}
+
+        response = client.get(url, params=params)
+        etag = response.headers["etag"]
+        assert response.status_code == 200 and "stale-while-revalidate" in response.headers["cache-control"]
+        cached = client.get(url, params=params, headers={"If-None-Match": etag})
+        assert cached.status_code == 304 and cached.headers["etag"] == etag and not cached.content
+        assert client.get(url, params=params, headers={"If-None-Match": f'W/"x", {etag}'}).status_code == 304
+        assert client.get(url, params=params, headers={"If-None-Match": '"otro"'}).status_code == 200
+        other = client.get(url, params={"diagnosis": CATEGORIAS[1]}, headers={"If-None-Match": etag})
+        assert other.status_code == 200 and other.headers["etag"] != etag
+        print("   ✅ 304 con el ETag vigente, 200 con otro ETag o con otro diagnóstico")
+
+
+if __name__ == "__main__":
+    test_stale_while_revalidate()
+    test_etag()
+    test_not_modified()
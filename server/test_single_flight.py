@@ -0,0 +1,98 @@
+"""
+Script de prueba de la agrupación de llamadas concurrentes (single-flight)
+
+Lanza varios hilos con la misma clave mientras la primera ejecución está
+bloqueada y comprueba que la función se ejecuta una sola vez, que todos
+reciben el mismo resultado o la misma excepción y que la clave se libera
+al terminar.
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.single_flight import SingleFlight
+
+WAITERS = 8
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    """Espera activa hasta que se cumple la condición"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Tiempo de espera agotado"
+        time.sleep(0.001)
+
+
+def run_concurrently(flight: SingleFlight, key, fn, count: int):
+    """Lanza count llamadas a flight.do y devuelve los hilos y sus resultados (valor o excepción)"""
+    results = [None] * count
+
+    def call(i):
+        try:
+            results[i] = flight.do(key, fn, i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_single_flight():
+    """Una ejecución por clave en curso, resultado y errores compartidos"""
+    print("🧪 PROBANDO SINGLE-FLIGHT")
+    print("=" * 50)
+
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def slow_query(i):
+        calls.append(i)
+        release.wait(5)
+        return {"rows": [1, 2, 3]}
+
+    threads, results = run_concurrently(flight, ("page", 1), slow_query, WAITERS)
+    wait_until(lambda: flight.stats()["coalesced"] == WAITERS - 1)
+    assert flight.stats()["in_flight"] == 1
+    # Otra clave no espera a la que está en curso
+    assert flight.do(("page", 2), lambda: "otra") == "otra"
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results), "Los hilos no comparten el resultado"
+    stats = flight.stats()
+    assert (stats["executed"], stats["coalesced"], stats["in_flight"]) == (2, WAITERS - 1, 0)
+    print(f"   ✅ {WAITERS} llamadas concurrentes, una sola ejecución y el mismo resultado")
+
+    # Terminada la ejecución, la misma clave se vuelve a ejecutar
+    assert flight.do(("page", 1), lambda: "nuevo") == "nuevo"
+    assert flight.stats()["executed"] == 3
+    print("   ✅ La clave se libera al terminar")
+
+    release.clear()
+
+    def failing_query(i):
+        release.wait(5)
+        raise RuntimeError("ORA-03113")
+
+    threads, results = run_concurrently(flight, ("page", 3), failing_query, WAITERS)
+    wait_until(lambda: flight.stats()["coalesced"] == 2 * (WAITERS - 1))
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(result, RuntimeError) and result is results[0] for result in results)
+    stats = flight.stats()
+    assert stats["errors"] == 1 and stats["in_flight"] == 0
+    assert flight.do(("page", 3), lambda: "recuperado") == "recuperado"
+    print("   ✅ La excepción llega a todos y no queda en caché")
+
+
+if __name__ == "__main__":
+    test_single_flight()